@@ -0,0 +1,64 @@
+import time
+import struct
+
+from store.column import Column
+from store.codec import RowCodec
+
+N = 100000
+
+columns = [
+    Column('a', 'int', 8),
+    Column('b', 'str', None),
+    Column('c', 'float', 8),
+    Column('d', 'bool', 1),
+    Column('e', 'str', 16),
+]
+
+rows = [
+    {'a': i, 'b': 'value-%i' % i, 'c': i * 0.5, 'd': i % 2 == 0, 'e': 'k%i' % i}
+    for i in range(N)
+]
+
+def encode_columns(rows):
+    blobs = []
+
+    for row in rows:
+        blob = b''.join(t._get_column_packed(row[t.name]) for t in columns)
+        blobs.append(blob)
+
+    return blobs
+
+def decode_columns(blobs):
+    for blob in blobs:
+        row = {}
+        p = 0
+
+        for t in columns:
+            v, p = t._get_column_unpacked(blob, p)
+            row[t.name] = v
+
+def encode_codec(codec, rows):
+    names = codec.names
+    return [codec.pack([row[c] for c in names]) for row in rows]
+
+def decode_codec(codec, blobs):
+    names = codec.names
+
+    for blob in blobs:
+        values, p = codec.unpack_from(blob, 0)
+        row = dict(zip(names, values))
+
+def bench(name, f, *args):
+    t0 = time.time()
+    r = f(*args)
+    dt = time.time() - t0
+    print '%-24s %12.0f rows/s' % (name, N / dt)
+    return r
+
+if __name__ == '__main__':
+    codec = RowCodec(columns)
+
+    blobs = bench('encode per column', encode_columns, rows)
+    bench('decode per column', decode_columns, blobs)
+    blobs = bench('encode RowCodec', encode_codec, codec, rows)
+    bench('decode RowCodec', decode_codec, codec, blobs)
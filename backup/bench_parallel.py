@@ -0,0 +1,57 @@
+import sys
+import time
+import shutil
+import multiprocessing
+
+from store import Store
+from store.table import Table
+
+N_ROWS = 400000
+N_SSTABLES = 4
+N_RUNS = 3
+
+def load(path):
+    shutil.rmtree(path, ignore_errors=True)
+    s = Store(path, compaction=False, wal=False)
+    t = s.database('db').table('t', a='int', b='str', c='int', primary_key=['a'])
+
+    # overlapping sstables, newer ones replace every other row
+    for i in range(N_SSTABLES):
+        step = 2 if i else 1
+        t.bulk_load(
+            ({'a': a, 'b': 'v%i-%i' % (i, a), 'c': a % 100} for a in range(0, N_ROWS, step)),
+            presorted=True,
+        )
+
+    s.close()
+
+def bench(path, parallelism):
+    s = Store(path, compaction=False, wal=False, parallelism=parallelism)
+    t = s.database('db').table('t')
+    times = []
+
+    for i in range(N_RUNS):
+        t0 = time.time()
+
+        with s.transaction():
+            q = t.select('a', 'b').where(t.c < 10)
+
+        rows = q.all().get()
+        times.append(time.time() - t0)
+
+    s.close()
+    return min(times), len(rows)
+
+if __name__ == '__main__':
+    path = 'data-bench-parallel'
+    load(path)
+    n_cpus = multiprocessing.cpu_count()
+    print '%i rows, %i sstables, %i cpus' % (N_ROWS, N_SSTABLES, n_cpus)
+    base = None
+
+    for parallelism in (1, 2, 4, 8):
+        dt, n = bench(path, parallelism)
+        base = base or dt
+        print 'parallelism %2i %8.3f s %8i rows %6.2fx' % (parallelism, dt, n, base / dt)
+
+    shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,464 @@
+'''
+Benchmarks of Store in style of LevelDB's db_bench.
+
+    python bench_store.py --benchmarks fillseq,readrandom --num 100000 --json out.json
+
+Fill benchmarks and bulkload start with empty store, other benchmarks
+use store left by previous ones. Each benchmark reports ops/s, latency
+percentiles, bytes written by process vs logical bytes of rows (write
+amplification), number of files in store and peak RSS.
+'''
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import resource
+import itertools
+import threading
+
+from store import Store
+from store.wal import WAL
+
+BENCHMARKS = [
+    'fillseq',
+    'fillrandom',
+    'overwrite',
+    'readrandom',
+    'readmissing',
+    'readseq',
+    'seekrandom',
+    'readwhilewriting',
+    'bulkload',
+]
+
+FRESH_BENCHMARKS = ('fillseq', 'fillrandom', 'bulkload')
+
+def get_written_bytes():
+    '''
+    Bytes passed to write calls by process so far, including wal,
+    flushes and compactions.
+    '''
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                name, value = line.split(':')
+
+                if name == 'wchar':
+                    return int(value)
+    except IOError as e:
+        pass
+
+    return None
+
+def get_peak_rss():
+    # kilobytes on linux, bytes on os x
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+def get_dir_stats(path):
+    n_files = 0
+    size = 0
+
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            n_files += 1
+            size += os.path.getsize(os.path.join(dirpath, filename))
+
+    return n_files, size
+
+class Histogram(object):
+    '''
+    Latencies of operations in seconds.
+    '''
+
+    def __init__(self):
+        self.values = []
+        self.lock = threading.Lock()
+
+    def add(self, value):
+        self.values.append(value)
+
+    def merge(self, other):
+        with self.lock:
+            self.values.extend(other.values)
+
+    def percentile(self, p):
+        if not self.values:
+            return None
+
+        values = sorted(self.values)
+        i = min(len(values) - 1, int(len(values) * p / 100.0))
+        return values[i]
+
+    def get_stats(self):
+        n = len(self.values)
+
+        return {
+            'count': n,
+            'avg_us': sum(self.values) / n * 1e6 if n else None,
+            'p50_us': self._us(self.percentile(50)),
+            'p99_us': self._us(self.percentile(99)),
+            'p999_us': self._us(self.percentile(99.9)),
+            'max_us': self._us(max(self.values) if n else None),
+        }
+
+    def _us(self, value):
+        return value * 1e6 if value is not None else None
+
+class Bench(object):
+    def __init__(self, args):
+        self.args = args
+        self.path = args.db
+        self.store = None
+        self.table = None
+        self.random = random.Random(args.seed)
+        self.value = 'x' * args.value_size
+
+        # keys present in table
+        self.n_keys = 0
+
+    def open(self):
+        args = self.args
+
+        self.store = Store(
+            self.path,
+            compaction=args.compaction,
+            wal=args.wal,
+            wal_sync=args.wal_sync,
+            cache_size=args.cache_size or None,
+            max_open_files=args.max_open_files or None,
+            metrics=bool(args.metrics),
+        )
+
+        # str primary key columns have fixed size
+        key_type = 'str[%i]' % args.key_size if args.key_type == 'str' else 'int'
+        type_fields = {'k': key_type, 'v': 'str', 'primary_key': ['k']}
+
+        for i in range(args.extra_columns):
+            type_fields['c%i' % i] = 'int'
+
+        if args.sstable_format != 'row':
+            type_fields['sstable_format'] = args.sstable_format
+
+        self.table = self.store.database('bench').table('t', **type_fields)
+
+    def close(self):
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+            self.table = None
+
+    def destroy(self):
+        self.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+        self.n_keys = 0
+
+    def get_key(self, i):
+        if self.args.key_type == 'int':
+            return i
+
+        return ('%0*i' % (self.args.key_size, i))[-self.args.key_size:]
+
+    def get_row(self, i):
+        row = {'k': self.get_key(i), 'v': self.value}
+
+        for j in range(self.args.extra_columns):
+            row['c%i' % j] = i + j
+
+        return row
+
+    def get_row_size(self):
+        '''
+        Logical size of row: key, value and extra columns.
+        '''
+        key_size = 8 if self.args.key_type == 'int' else self.args.key_size
+        return key_size + self.args.value_size + 8 * self.args.extra_columns
+
+    def write(self, indexes, hist):
+        '''
+        Insert rows in transactions of batch_size rows.
+        '''
+        s = self.store
+        t = self.table
+        batch_size = self.args.batch_size
+        n = 0
+
+        it = iter(indexes)
+
+        while True:
+            batch = list(itertools.islice(it, batch_size))
+
+            if not batch:
+                break
+
+            t0 = time.time()
+
+            with s.transaction():
+                for i in batch:
+                    t.insert(**self.get_row(i))
+
+            hist.add(time.time() - t0)
+            n += len(batch)
+
+        return n
+
+    def read(self, indexes, hist):
+        s = self.store
+        t = self.table
+        n_found = 0
+
+        for i in indexes:
+            t0 = time.time()
+
+            with s.transaction():
+                d = t.get(self.get_key(i))
+
+            if d.get() is not None:
+                n_found += 1
+
+            hist.add(time.time() - t0)
+
+        return n_found
+
+    # benchmarks, each returns number of ops and extra results
+
+    def fillseq(self, hist):
+        n = self.write(xrange(self.args.num), hist)
+        self.n_keys = self.args.num
+        return n, {'logical_bytes': n * self.get_row_size()}
+
+    def fillrandom(self, hist):
+        num = self.args.num
+        n = self.write((self.random.randrange(num) for i in xrange(num)), hist)
+        self.n_keys = num
+        return n, {'logical_bytes': n * self.get_row_size()}
+
+    def overwrite(self, hist):
+        return self.fillrandom(hist)
+
+    def readrandom(self, hist):
+        num = self.n_keys or self.args.num
+        indexes = [self.random.randrange(num) for i in xrange(self.args.reads)]
+        n_found = self.read(indexes, hist)
+        return len(indexes), {'found': n_found}
+
+    def readmissing(self, hist):
+        # keys after all loaded keys
+        num = self.n_keys or self.args.num
+        indexes = [num + self.random.randrange(num) for i in xrange(self.args.reads)]
+        n_found = self.read(indexes, hist)
+        return len(indexes), {'found': n_found}
+
+    def readseq(self, hist):
+        n = 0
+        t0 = time.time()
+
+        for row in self.table.scan():
+            n += 1
+
+            # latency of batches of 1000 rows
+            if not n % 1000:
+                t1 = time.time()
+                hist.add(t1 - t0)
+                t0 = t1
+
+        return n, {}
+
+    def seekrandom(self, hist):
+        num = self.n_keys or self.args.num
+        n_rows = 0
+
+        for i in xrange(self.args.reads):
+            t0 = time.time()
+            start = self.get_key(self.random.randrange(num))
+            rows = self.table.scan(start)
+
+            for row in itertools.islice(rows, self.args.seek_nexts):
+                n_rows += 1
+
+            rows.close()
+            hist.add(time.time() - t0)
+
+        return self.args.reads, {'rows': n_rows}
+
+    def readwhilewriting(self, hist):
+        '''
+        Readers read random keys while one writer overwrites random keys
+        until readers are done. Latency is of reads.
+        '''
+        num = self.n_keys or self.args.num
+        n_readers = max(1, self.args.threads - 1)
+        done = threading.Event()
+        results = []
+        write_hist = Histogram()
+
+        def reader(seed):
+            r = random.Random(seed)
+            h = Histogram()
+            indexes = [r.randrange(num) for i in xrange(self.args.reads // n_readers)]
+            results.append(self.read(indexes, h))
+            hist.merge(h)
+
+        def writer():
+            r = random.Random(self.args.seed + 1)
+
+            while not done.is_set():
+                self.write([r.randrange(num) for i in range(self.args.batch_size)], write_hist)
+
+        threads = [threading.Thread(target=reader, args=(self.args.seed + i,)) for i in range(n_readers)]
+        writer_thread = threading.Thread(target=writer)
+        writer_thread.start()
+
+        for th in threads:
+            th.start()
+
+        for th in threads:
+            th.join()
+
+        done.set()
+        writer_thread.join()
+
+        n_reads = (self.args.reads // n_readers) * n_readers
+        n_writes = write_hist.get_stats()['count'] * self.args.batch_size
+
+        return n_reads, {
+            'readers': n_readers,
+            'found': sum(results),
+            'writes': n_writes,
+            'logical_bytes': n_writes * self.get_row_size(),
+        }
+
+    def bulkload(self, hist):
+        num = self.args.num
+        indexes = range(num)
+        self.random.shuffle(indexes)
+
+        t0 = time.time()
+        n = self.table.bulk_load(self.get_row(i) for i in indexes)
+        hist.add(time.time() - t0)
+        self.n_keys = num
+        return n, {'logical_bytes': n * self.get_row_size()}
+
+    def run(self, name):
+        if name in FRESH_BENCHMARKS:
+            self.destroy()
+
+        if self.store is None:
+            self.open()
+
+        hist = Histogram()
+        written = get_written_bytes()
+        t0 = time.time()
+        n_ops, extra = getattr(self, name)(hist)
+
+        # flush memtables, so written bytes include sstables
+        if 'logical_bytes' in extra:
+            self.table.commit()
+
+        dt = time.time() - t0
+        written_after = get_written_bytes()
+        n_files, size = get_dir_stats(self.path)
+
+        result = {
+            'benchmark': name,
+            'ops': n_ops,
+            'seconds': dt,
+            'ops_per_sec': n_ops / dt if dt else None,
+            'latency': hist.get_stats(),
+            'files': n_files,
+            'disk_bytes': size,
+            'peak_rss_bytes': get_peak_rss(),
+        }
+
+        if written is not None:
+            result['bytes_written'] = written_after - written
+
+        logical = extra.get('logical_bytes')
+
+        if logical and 'bytes_written' in result:
+            result['write_amplification'] = float(result['bytes_written']) / logical
+
+        result.update(extra)
+        return result
+
+def print_result(r):
+    latency = r['latency']
+    line = '%-18s %10.0f ops/s %10i ops' % (r['benchmark'], r['ops_per_sec'] or 0, r['ops'])
+
+    if latency['count']:
+        line += '  p50 %8.1f p99 %8.1f p999 %8.1f us' % (latency['p50_us'], latency['p99_us'], latency['p999_us'])
+
+    if 'write_amplification' in r:
+        line += '  wamp %5.2f' % r['write_amplification']
+
+    line += '  %4i files  rss %6.1f MB' % (r['files'], r['peak_rss_bytes'] / 1048576.0)
+    print line
+    sys.stdout.flush()
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description='benchmarks of store')
+    parser.add_argument('--benchmarks', default=','.join(BENCHMARKS),
+                        help='comma separated list of %s' % ', '.join(BENCHMARKS))
+    parser.add_argument('--db', default='data-bench-store', help='store path, removed at the end')
+    parser.add_argument('--num', type=int, default=100000, help='number of rows written')
+    parser.add_argument('--reads', type=int, default=None, help='number of reads, default num')
+    parser.add_argument('--threads', type=int, default=4, help='threads of readwhilewriting')
+    parser.add_argument('--batch-size', type=int, default=100, help='rows per write transaction')
+    parser.add_argument('--seek-nexts', type=int, default=10, help='rows read after each seek')
+    parser.add_argument('--key-type', choices=('int', 'str'), default='int')
+    parser.add_argument('--key-size', type=int, default=16, help='size of str keys')
+    parser.add_argument('--value-size', type=int, default=100)
+    parser.add_argument('--extra-columns', type=int, default=0, help='number of extra int columns')
+    parser.add_argument('--sstable-format', choices=('row', 'block', 'columnar'), default='row')
+    parser.add_argument('--compaction', type=int, default=1)
+    parser.add_argument('--wal', type=int, default=1)
+    parser.add_argument('--wal-sync', default=WAL.SYNC_NONE,
+                        choices=(WAL.SYNC_ALWAYS, WAL.SYNC_INTERVAL, WAL.SYNC_NONE))
+    parser.add_argument('--cache-size', type=int, default=8 * 1024 * 1024)
+    parser.add_argument('--max-open-files', type=int, default=0)
+    parser.add_argument('--metrics', type=int, default=1, help='store metrics, see also python -O')
+    parser.add_argument('--seed', type=int, default=301)
+    parser.add_argument('--json', default=None, help='write results as json to file, - for stdout')
+    args = parser.parse_args(argv)
+
+    if args.reads is None:
+        args.reads = args.num
+
+    for name in args.benchmarks.split(','):
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark %r' % name)
+
+    return args
+
+def main(argv):
+    args = parse_args(argv)
+    bench = Bench(args)
+    results = []
+
+    try:
+        for name in args.benchmarks.split(','):
+            r = bench.run(name)
+            results.append(r)
+
+            if args.json != '-':
+                print_result(r)
+    finally:
+        bench.destroy()
+
+    if args.json:
+        config = dict(vars(args))
+        config.pop('json')
+        data = {'config': config, 'results': results}
+
+        if args.json == '-':
+            json.dump(data, sys.stdout, indent=2, sort_keys=True)
+            print
+        else:
+            with open(args.json, 'w') as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
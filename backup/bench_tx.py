@@ -0,0 +1,76 @@
+import sys
+import time
+import shutil
+import threading
+
+from store import Store
+from store.lock import LockManager, DeadlockError
+
+N_TXS = 200
+N_OPS = 10
+N_HOT_KEYS = 50
+
+def writer(s, t, i, hot):
+    for j in range(N_TXS):
+        with s.transaction():
+            for k in range(N_OPS):
+                if hot:
+                    a = (j * N_OPS + k) % N_HOT_KEYS
+                else:
+                    a = (i * N_TXS + j) * N_OPS + k
+
+                t.insert(a=a, b='w%i' % i)
+
+def bench(n_threads, hot):
+    path = 'data-bench-tx'
+    shutil.rmtree(path, ignore_errors=True)
+    s = Store(path, wal=False)
+    t = s.database('db').table('t', a='int', b='str', primary_key=['a'])
+    threads = [threading.Thread(target=writer, args=(s, t, i, hot)) for i in range(n_threads)]
+    t0 = time.time()
+
+    for th in threads:
+        th.start()
+
+    for th in threads:
+        th.join()
+
+    dt = time.time() - t0
+    stats = s.lock_manager.get_stats()
+    s.close()
+    shutil.rmtree(path, ignore_errors=True)
+
+    n = n_threads * N_TXS
+    print '%-8s %3i threads %10.0f tx/s %10.0f rows/s %8i waits' % (
+        'hot' if hot else 'disjoint', n_threads, n / dt, n * N_OPS / dt, stats['waits'])
+
+def bench_deadlock():
+    lm = LockManager()
+    a = threading.Event()
+    b = threading.Event()
+    errors = []
+
+    def run(owner, first, second, mine, other):
+        lm.acquire(owner, first, LockManager.X)
+        mine.set()
+        other.wait()
+
+        try:
+            lm.acquire(owner, second, LockManager.X)
+        except DeadlockError as e:
+            errors.append(owner)
+
+        lm.release_all(owner)
+
+    t1 = threading.Thread(target=run, args=('tx1', 'r1', 'r2', a, b))
+    t2 = threading.Thread(target=run, args=('tx2', 'r2', 'r1', b, a))
+    t1.start(); t2.start()
+    t1.join(); t2.join()
+    print 'deadlock victims: %r, stats: %r' % (errors, lm.get_stats())
+
+if __name__ == '__main__':
+    for hot in (False, True):
+        for n_threads in (1, 2, 4, 8, 16, 32):
+            bench(n_threads, hot)
+
+    bench_deadlock()
@@ -0,0 +1,424 @@
+__all__ = ['Aggregate', 'Count', 'Sum', 'Min', 'Max', 'Avg', 'Aggregator']
+
+from .column import Column
+from .memtable import MemTable
+from .columnar import ColumnarSSTable
+from .parallel import _compile_expr, _match
+
+class Aggregate(object):
+    '''
+    Aggregate function of column. State is partial result, which is
+    computed per memtable or sstable and merged with other states.
+    '''
+
+    name = None
+
+    def __init__(self, column=None):
+        self.column = column.name if isinstance(column, Column) else column
+
+    def __repr__(self):
+        return '<%s %s>' % (self.__class__.__name__, self.get_name())
+
+    def get_name(self):
+        return '%s(%s)' % (self.name, self.column or '*')
+
+    def init(self):
+        return None
+
+    def add(self, state, value):
+        raise NotImplementedError
+
+    def merge(self, a, b):
+        raise NotImplementedError
+
+    def result(self, state):
+        return state
+
+    def from_stats(self, sst):
+        '''
+        State of all rows of sstable from its stats, None if stats do
+        not have it.
+        '''
+        return None
+
+    def from_column(self, count, total, low, high):
+        '''
+        State from (number of non-NULL values, sum, min, max) of column.
+        '''
+        return None
+
+class Count(Aggregate):
+    '''
+    Number of rows, or of non-NULL values of column.
+    '''
+
+    name = 'count'
+
+    def init(self):
+        return 0
+
+    def add(self, state, value):
+        if self.column is None or value is not None:
+            state += 1
+
+        return state
+
+    def merge(self, a, b):
+        return a + b
+
+    def from_stats(self, sst):
+        n_rows = sst.stats.get_n_rows()
+
+        # number of rows is also length of offset file or block footer
+        if n_rows is None:
+            n_rows = len(sst)
+
+        if self.column is None:
+            return n_rows
+
+        column_stats = sst.stats.get_column(self.column)
+
+        if column_stats is None:
+            return None
+
+        min_value, max_value, n_nulls, n_distinct = column_stats
+        return n_rows - n_nulls
+
+    def from_column(self, count, total, low, high):
+        return count
+
+class Sum(Aggregate):
+    name = 'sum'
+
+    def add(self, state, value):
+        if value is None:
+            return state
+
+        return value if state is None else state + value
+
+    def merge(self, a, b):
+        if a is None:
+            return b
+
+        if b is None:
+            return a
+
+        return a + b
+
+    def from_column(self, count, total, low, high):
+        return total
+
+class Min(Aggregate):
+    name = 'min'
+
+    def add(self, state, value):
+        if value is None:
+            return state
+
+        return value if state is None or value < state else state
+
+    def merge(self, a, b):
+        return self.add(a, b)
+
+    def from_stats(self, sst):
+        primary_key = sst.table.schema.primary_key
+        column_stats = sst.stats.get_column(self.column)
+
+        if column_stats is not None:
+            return column_stats[0]
+
+        # first key of primary key index
+        if self.column == primary_key[0]:
+            key_range = sst.get_key_range()
+            return key_range[0][0] if key_range else None
+
+        return None
+
+    def from_column(self, count, total, low, high):
+        return low
+
+class Max(Aggregate):
+    name = 'max'
+
+    def add(self, state, value):
+        if value is None:
+            return state
+
+        return value if state is None or value > state else state
+
+    def merge(self, a, b):
+        return self.add(a, b)
+
+    def from_stats(self, sst):
+        primary_key = sst.table.schema.primary_key
+        column_stats = sst.stats.get_column(self.column)
+
+        if column_stats is not None:
+            return column_stats[1]
+
+        # last key of primary key index
+        if self.column == primary_key[0]:
+            key_range = sst.get_key_range()
+            return key_range[1][0] if key_range else None
+
+        return None
+
+    def from_column(self, count, total, low, high):
+        return high
+
+class Avg(Aggregate):
+    '''
+    Average of non-NULL values, state is (sum, count).
+    '''
+
+    name = 'avg'
+
+    def init(self):
+        return (0, 0)
+
+    def add(self, state, value):
+        if value is None:
+            return state
+
+        return (state[0] + value, state[1] + 1)
+
+    def merge(self, a, b):
+        return (a[0] + b[0], a[1] + b[1])
+
+    def result(self, state):
+        total, count = state
+        return float(total) / count if count else None
+
+    def from_column(self, count, total, low, high):
+        return (total if count else 0, count)
+
+class Aggregator(object):
+    '''
+    Aggregator computes aggregates of query, grouped by group by columns.
+
+    Memtables and sstables whose key ranges do not overlap with any
+    other are aggregated separately and their partial states merged,
+    without building rows: from stats (zone maps, number of rows or
+    primary key index ends) when query has no where clause and no
+    group by, vectorized over columns of columnar sstables, or by
+    unpacking only needed values otherwise. Sstables whose zone maps
+    can not satisfy where clause are skipped.
+
+    Overlapping memtables and sstables are merged by primary key first,
+    so only newest version of each row is aggregated.
+    '''
+
+    def __init__(self, table, query, snapshot=None):
+        self.table = table
+        self.query = query
+        self.snapshot = snapshot
+        self.aggregates = [c for c in query.select_clauses if isinstance(c, Aggregate)]
+        self.group_by = [
+            c.name if isinstance(c, Column) else c
+            for c in query.group_by_clauses
+        ]
+
+        self.where = _compile_expr(query.where_clause)
+        self.columns = self._get_columns()
+
+        # counters of last execution
+        self.n_from_stats = 0
+        self.n_from_columns = 0
+        self.n_streamed = 0
+        self.n_merged = 0
+        self.n_pruned = 0
+
+    def _get_columns(self):
+        '''
+        Columns whose values are needed: group by, aggregated and where.
+        '''
+        columns = list(self.group_by)
+
+        for aggregate in self.aggregates:
+            if aggregate.column is not None and aggregate.column not in columns:
+                columns.append(aggregate.column)
+
+        for c in self._get_expr_columns(self.where):
+            if c not in columns:
+                columns.append(c)
+
+        return columns
+
+    def _get_expr_columns(self, expr):
+        if expr is None:
+            return []
+
+        op, left, right = expr
+
+        if op in ('and', 'or'):
+            return self._get_expr_columns(left) + self._get_expr_columns(right)
+
+        return [left]
+
+    def _get_key_range(self, s):
+        if isinstance(s, MemTable):
+            first = next(s.iter_range(), None)
+            last = next(s.iter_range(reverse=True), None)
+            return (first[0], last[0]) if first else None
+
+        return s.get_key_range()
+
+    def _get_groups(self, structures):
+        '''
+        Lists of structures with overlapping key ranges, each ordered
+        from newest to oldest.
+        '''
+        ranges = []
+
+        for rank, s in enumerate(structures):
+            key_range = self._get_key_range(s)
+
+            if key_range is not None:
+                ranges.append((key_range[0], key_range[1], rank))
+
+        ranges.sort()
+        groups = []
+        last_key = None
+
+        for first_key, key, rank in ranges:
+            if groups and first_key <= last_key:
+                groups[-1].append(rank)
+                last_key = max(last_key, key)
+            else:
+                groups.append([rank])
+                last_key = key
+
+        return [[structures[rank] for rank in sorted(group)] for group in groups]
+
+    def _new_states(self):
+        return [aggregate.init() for aggregate in self.aggregates]
+
+    def _merge_states(self, partials, group, states):
+        if group not in partials:
+            partials[group] = states
+            return
+
+        merged = partials[group]
+
+        for i, aggregate in enumerate(self.aggregates):
+            merged[i] = aggregate.merge(merged[i], states[i])
+
+    def _add_values(self, partials, values_iter):
+        '''
+        Aggregate tuples of values of self.columns.
+        '''
+        columns = self.columns
+        n_group_by = len(self.group_by)
+        positions = [
+            columns.index(aggregate.column) if aggregate.column is not None else None
+            for aggregate in self.aggregates
+        ]
+
+        aggregates = list(zip(self.aggregates, positions))
+
+        for values in values_iter:
+            if self.where is not None and not _match(self.where, dict(zip(columns, values))):
+                continue
+
+            group = values[:n_group_by]
+            states = partials.get(group)
+
+            if states is None:
+                states = self._new_states()
+                partials[group] = states
+
+            for i, (aggregate, j) in enumerate(aggregates):
+                states[i] = aggregate.add(states[i], values[j] if j is not None else None)
+
+    def _add_from_stats(self, partials, sst):
+        states = [aggregate.from_stats(sst) for aggregate in self.aggregates]
+
+        if any(state is None for state in states):
+            return False
+
+        self._merge_states(partials, (), states)
+        return True
+
+    def _add_from_columns(self, partials, sst):
+        '''
+        Aggregates of columnar sstable computed over whole columns.
+        '''
+        by_column = {}
+        states = []
+
+        for aggregate in self.aggregates:
+            column = aggregate.column
+
+            if column is None:
+                state = aggregate.from_stats(sst)
+            else:
+                if sst.table.schema[column].type not in sst.FIXED_TYPES:
+                    return False
+
+                if column not in by_column:
+                    by_column[column] = sst.aggregate_column(column)
+
+                state = aggregate.from_column(*by_column[column])
+
+            if state is None and aggregate.init() is not None:
+                return False
+
+            states.append(state)
+
+        self._merge_states(partials, (), states)
+        return True
+
+    def _add_sstable(self, partials, sst):
+        if self.query.where_clause is not None and not sst.stats.may_match(self.query.where_clause):
+            self.n_pruned += 1
+            return
+
+        if self.where is None and not self.group_by:
+            if self._add_from_stats(partials, sst):
+                self.n_from_stats += 1
+                return
+
+            if isinstance(sst, ColumnarSSTable) and self._add_from_columns(partials, sst):
+                self.n_from_columns += 1
+                return
+
+        self.n_streamed += 1
+        self._add_values(partials, sst.iter_values(self.columns))
+
+    def _add_merged(self, partials, structures):
+        self.n_merged += 1
+        cursors = [s.iter_range() for s in structures]
+        rows = self.table._merge_cursors(cursors)
+        columns = self.columns
+
+        self._add_values(partials, (tuple(row[c] for c in columns) for row in rows))
+
+    def execute(self):
+        '''
+        Rows of group by columns and aggregates, ordered by group.
+        '''
+        partials = {}
+
+        with self.table.structures(self.snapshot) as (memtables, sstables):
+            for group in self._get_groups(memtables + sstables):
+                if len(group) == 1 and not isinstance(group[0], MemTable):
+                    self._add_sstable(partials, group[0])
+                else:
+                    self._add_merged(partials, group)
+
+        # aggregates of empty table without group by
+        if not partials and not self.group_by:
+            partials[()] = self._new_states()
+
+        rows = []
+
+        for group in sorted(partials):
+            states = partials[group]
+            row = dict(zip(self.group_by, group))
+
+            for aggregate, state in zip(self.aggregates, states):
+                row[aggregate.get_name()] = aggregate.result(state)
+
+            rows.append(row)
+
+        return rows
@@ -0,0 +1,628 @@
+__all__ = ['BlockSSTable']
+
+import os
+import sys
+import bz2
+import zlib
+import struct
+import bisect
+
+try:
+    import lzma
+except ImportError as e:
+    lzma = None
+
+from .sstable import SSTable
+from .cache import ENTRY_OVERHEAD_SIZE
+
+class BlockSSTable(SSTable):
+    '''
+    BlockSSTable groups rows into blocks of about BLOCK_SIZE bytes.
+
+    Block holds entries and restart points. Each entry is header
+    (shared key bytes, non-shared key bytes, row size), non-shared
+    part of packed primary key and packed row. Every RESTART_INTERVAL
+    entries key is stored whole and its position is restart point.
+    Blocks are optionally compressed.
+
+    After blocks there is sparse index with position, size, first row
+    number and first key of each block, and footer with format version.
+    Primary key lookups go through sparse index and rows are found by
+    row number through first row numbers of blocks, so there is no
+    index file for whole primary key and no offset file.
+    '''
+
+    HAS_OFFSET = False
+
+    MAGIC = b'YADBBLK1'
+    FORMAT_VERSION = 1
+    BLOCK_SIZE = 16 * 1024
+    RESTART_INTERVAL = 16
+    COMPRESSION = 'zlib'
+
+    COMPRESSIONS = {
+        'none': 0,
+        'zlib': 1,
+        'bz2': 2,
+        'lzma': 3,
+    }
+
+    ENTRY_FORMAT = struct.Struct(b'!HHI')
+    RESTART_FORMAT = struct.Struct(b'!I')
+    HANDLE_FORMAT = struct.Struct(b'!QIQ')
+    FOOTER_FORMAT = struct.Struct(b'!QQQBB')
+
+    def __init__(self, table, t=None, rows=None):
+        self.compression = table.schema.get_option('compression', self.COMPRESSION)
+
+        if self.compression == 'lzma' and lzma is None:
+            raise Exception('lzma compression is not available')
+
+        self.n_rows = 0
+        self.block_handles = None
+        self.block_first_keys = None
+        self.block_first_ordinals = None
+        SSTable.__init__(self, table, t, rows)
+
+    def __len__(self):
+        # number of rows is in footer, there is no offset file
+        with self.pinned():
+            self._get_block_index()
+            return self.n_rows
+
+    def __iter__(self):
+        with self.pinned():
+            self._get_block_index()
+            codec = self.table.schema.row_codec
+
+            for block_no in range(len(self.block_handles)):
+                keys, blobs = self._decode_block(block_no, fill_cache=False)
+
+                for blob in blobs:
+                    values, p = codec.unpack_from(blob)
+                    yield dict(zip(codec.names, values))
+
+    def _get_indexed_columns(self):
+        primary_key = self.table.schema.primary_key
+
+        # whole primary key is served by sparse index
+        if len(primary_key) == 1:
+            return ()
+
+        return tuple((n,) for n in primary_key)
+
+    def _get_key_codec(self):
+        schema = self.table.schema
+        return schema.get_key_codec(schema.primary_key)
+
+    def _is_primary_key(self, columns):
+        return columns == tuple(self.table.schema.primary_key)
+
+    def _compress(self, payload):
+        if self.compression == 'zlib':
+            payload = zlib.compress(payload)
+        elif self.compression == 'bz2':
+            payload = bz2.compress(payload)
+        elif self.compression == 'lzma':
+            payload = lzma.compress(payload)
+
+        return payload
+
+    def _decompress(self, payload):
+        if self.compression == 'zlib':
+            payload = zlib.decompress(payload)
+        elif self.compression == 'bz2':
+            payload = bz2.decompress(payload)
+        elif self.compression == 'lzma':
+            payload = lzma.decompress(payload)
+
+        return payload
+
+    def w_open(self):
+        '''
+        Open file for writing.
+        '''
+        SSTable.w_open(self)
+        self.n_rows = 0
+        self._handles = []
+        self._reset_block()
+
+        # zone map of each block
+        self.stats._begin_blocks()
+
+    def w_close(self):
+        '''
+        Close file for writing.
+        '''
+        self._flush_block()
+        f = self.f
+
+        # sparse index
+        index_offset = f.tell()
+
+        for offset, size, ordinal, key_blob in self._handles:
+            f.write(self.HANDLE_FORMAT.pack(offset, size, ordinal))
+            f.write(key_blob)
+
+        # footer
+        f.write(self.FOOTER_FORMAT.pack(
+            index_offset,
+            len(self._handles),
+            self.n_rows,
+            self.COMPRESSIONS[self.compression],
+            self.FORMAT_VERSION,
+        ))
+
+        f.write(self.MAGIC)
+        self._handles = None
+        SSTable.w_close(self)
+
+    def _reset_block(self):
+        self._block = []
+        self._block_size = 0
+        self._restarts = []
+        self._n_entries = 0
+        self._first = None
+        self._prev_key_blob = b''
+
+    def _add_row(self, row):
+        # row number is position of row
+        ordinal = self.n_rows
+        self.n_rows += 1
+
+        key = tuple(row[c] for c in self.table.schema.primary_key)
+        key_blob = self._get_key_codec().pack(key)
+
+        if not self._n_entries:
+            self._first = (ordinal, key_blob)
+
+        if self._n_entries % self.RESTART_INTERVAL == 0:
+            self._restarts.append(self._block_size)
+            shared = 0
+        else:
+            shared = len(os.path.commonprefix([self._prev_key_blob, key_blob]))
+
+        codec = self.table.schema.row_codec
+        row_blob = codec.pack([row.get(c, None) for c in codec.names])
+        suffix = key_blob[shared:]
+        header = self.ENTRY_FORMAT.pack(shared, len(suffix), len(row_blob))
+        self._block.extend((header, suffix, row_blob))
+        self._block_size += len(header) + len(suffix) + len(row_blob)
+        self._n_entries += 1
+        self._prev_key_blob = key_blob
+
+        # index
+        for column_names, index in self.indexes.items():
+            index._write_key(row, ordinal)
+
+        # bloom filter
+        if self.bloom:
+            self.bloom._add_key(key)
+
+        # zone map
+        self.stats._add_row(row)
+
+        if self._block_size >= self.BLOCK_SIZE:
+            self._flush_block()
+
+    def _flush_block(self):
+        if not self._n_entries:
+            return
+
+        restarts = [self.RESTART_FORMAT.pack(r) for r in self._restarts]
+        restarts.append(self.RESTART_FORMAT.pack(len(self._restarts)))
+        payload = b''.join(self._block) + b''.join(restarts)
+        payload = self._compress(payload)
+
+        offset = self.f.tell()
+        self.f.write(payload)
+        ordinal, key_blob = self._first
+        self._handles.append((offset, len(payload), ordinal, key_blob))
+        self._reset_block()
+        self.stats._end_block()
+
+    def _get_block_index(self):
+        '''
+        Load sparse index of blocks from file.
+        '''
+        if self.block_handles is not None:
+            return
+
+        mm = self._get_mm()
+        size = mm.size()
+
+        if mm[size - len(self.MAGIC):size] != self.MAGIC:
+            raise Exception('invalid block sstable %r' % self.get_path())
+
+        pos = size - len(self.MAGIC) - self.FOOTER_FORMAT.size
+        index_offset, n_blocks, n_rows, compression, version = \
+            self.FOOTER_FORMAT.unpack_from(mm, pos)
+
+        if version != self.FORMAT_VERSION:
+            raise Exception('unsupported block sstable version %i' % version)
+
+        for k, v in self.COMPRESSIONS.items():
+            if v == compression:
+                self.compression = k
+
+        key_codec = self._get_key_codec()
+        entry_size = self.HANDLE_FORMAT.size + key_codec.size
+        block_handles = []
+        block_first_keys = []
+        block_first_ordinals = []
+
+        for i in range(n_blocks):
+            p = index_offset + i * entry_size
+            offset, block_size, ordinal = self.HANDLE_FORMAT.unpack_from(mm, p)
+            key, p = key_codec.unpack_from(mm, p + self.HANDLE_FORMAT.size)
+            block_handles.append((offset, block_size))
+            block_first_keys.append(key)
+            block_first_ordinals.append(ordinal)
+
+        self.n_rows = n_rows
+        self.block_first_keys = block_first_keys
+        self.block_first_ordinals = block_first_ordinals
+        self.block_handles = block_handles
+
+    def _read_block(self, block_no, fill_cache=True):
+        '''
+        Decompressed block, cached in store's cache by block offset.
+        '''
+        cache = self.table.store.cache
+        offset, size = self.block_handles[block_no]
+        cache_key = (self.id, offset)
+
+        if cache:
+            payload = cache.get(cache_key)
+
+            if payload is not None:
+                return payload
+
+        mm = self._get_mm()
+        payload = self._decompress(mm[offset:offset + size])
+
+        if cache and fill_cache:
+            cache.set(cache_key, payload, ENTRY_OVERHEAD_SIZE + len(payload))
+
+        return payload
+
+    def _get_restarts(self, payload):
+        size = self.RESTART_FORMAT.size
+        n_restarts, = self.RESTART_FORMAT.unpack_from(payload, len(payload) - size)
+        end = len(payload) - size - n_restarts * size
+        restarts = struct.unpack_from(b'!%iI' % n_restarts, payload, end)
+        return restarts, end
+
+    def _decode_block(self, block_no, fill_cache=True):
+        '''
+        Keys and packed rows of all entries in block.
+        '''
+        payload = self._read_block(block_no, fill_cache)
+        restarts, end = self._get_restarts(payload)
+        key_codec = self._get_key_codec()
+        entry_size = self.ENTRY_FORMAT.size
+        keys = []
+        blobs = []
+        prev_key_blob = b''
+        pos = 0
+
+        while pos < end:
+            shared, non_shared, row_size = self.ENTRY_FORMAT.unpack_from(payload, pos)
+            pos += entry_size
+            key_blob = prev_key_blob[:shared] + payload[pos:pos + non_shared]
+            pos += non_shared
+            blobs.append(payload[pos:pos + row_size])
+            pos += row_size
+            key, p = key_codec.unpack_from(key_blob)
+            keys.append(key)
+            prev_key_blob = key_blob
+
+        return keys, blobs
+
+    def _find_in_block(self, block_no, key):
+        '''
+        Binary search restart points, then scan entries after restart.
+        Returns index of entry in block and packed row.
+        '''
+        payload = self._read_block(block_no)
+        restarts, end = self._get_restarts(payload)
+        key_codec = self._get_key_codec()
+        entry_size = self.ENTRY_FORMAT.size
+
+        # last restart with key <= key
+        low = 0
+        high = len(restarts) - 1
+
+        while low < high:
+            mid = (low + high + 1) // 2
+            pos = restarts[mid]
+            shared, non_shared, row_size = self.ENTRY_FORMAT.unpack_from(payload, pos)
+            pos += entry_size
+            cur_key, p = key_codec.unpack_from(payload[pos:pos + non_shared])
+
+            if cur_key <= key:
+                low = mid
+            else:
+                high = mid - 1
+
+        pos = restarts[low]
+        i = low * self.RESTART_INTERVAL
+        prev_key_blob = b''
+
+        while pos < end:
+            shared, non_shared, row_size = self.ENTRY_FORMAT.unpack_from(payload, pos)
+            pos += entry_size
+            key_blob = prev_key_blob[:shared] + payload[pos:pos + non_shared]
+            pos += non_shared
+            cur_key, p = key_codec.unpack_from(key_blob)
+
+            if cur_key == key:
+                return i, payload[pos:pos + row_size]
+            elif cur_key > key:
+                break
+
+            pos += row_size
+            prev_key_blob = key_blob
+            i += 1
+
+        raise KeyError(key)
+
+    def _unpack_row(self, blob):
+        codec = self.table.schema.row_codec
+        values, p = codec.unpack_from(blob)
+        return dict(zip(codec.names, values))
+
+    def _get_index(self, columns):
+        if columns not in self.indexes:
+            raise Exception('block sstable %r has no index of %r' % (self.get_path(), columns))
+
+        return SSTable._get_index(self, columns)
+
+    def _get_row_at(self, i):
+        return self._read_row(i)
+
+    def _read_row(self, pos):
+        # position is row number
+        self._get_block_index()
+        block_no = bisect.bisect_right(self.block_first_ordinals, pos) - 1
+        keys, blobs = self._decode_block(block_no)
+        return self._unpack_row(blobs[pos - self.block_first_ordinals[block_no]])
+
+    def _seek(self, key, upper=False):
+        '''
+        Row number of first row whose primary key prefix is >= key,
+        or > key if upper.
+        '''
+        self._get_block_index()
+        n = len(key)
+        first_keys = self.block_first_keys
+
+        # last block whose first key is before key
+        low = 0
+        high = len(first_keys) - 1
+        block_no = -1
+
+        while low <= high:
+            mid = (low + high) // 2
+            cur_key = first_keys[mid][:n]
+
+            if cur_key < key or (upper and cur_key == key):
+                block_no = mid
+                low = mid + 1
+            else:
+                high = mid - 1
+
+        if block_no < 0:
+            return 0
+
+        keys, blobs = self._decode_block(block_no)
+        first_ordinal = self.block_first_ordinals[block_no]
+
+        for i, cur_key in enumerate(keys):
+            cur_key = cur_key[:n]
+
+            if cur_key > key or (not upper and cur_key == key):
+                return first_ordinal + i
+
+        return first_ordinal + len(keys)
+
+    def iter_range(self, start=None, end=None, reverse=False, block_filter=None):
+        '''
+        (key, row) pairs with start <= key < end ordered by primary key.
+        Blocks are decoded one at a time, bypassing cache. Blocks for
+        which block_filter(block_no) is false are skipped.
+        '''
+        with self.pinned():
+            self._get_block_index()
+            low = self._seek(start) if start is not None else 0
+            high = self._seek(end) if end is not None else self.n_rows
+
+            if low >= high:
+                return
+
+            first_ordinals = self.block_first_ordinals
+            first_block_no = bisect.bisect_right(first_ordinals, low) - 1
+            last_block_no = bisect.bisect_right(first_ordinals, high - 1) - 1
+
+            if reverse:
+                block_nos = range(last_block_no, first_block_no - 1, -1)
+            else:
+                block_nos = range(first_block_no, last_block_no + 1)
+
+            for block_no in block_nos:
+                if block_filter is not None and not block_filter(block_no):
+                    continue
+
+                keys, blobs = self._decode_block(block_no, fill_cache=False)
+                first_ordinal = first_ordinals[block_no]
+                i_low = max(low - first_ordinal, 0)
+                i_high = min(high - first_ordinal, len(keys))
+
+                if reverse:
+                    positions = range(i_high - 1, i_low - 1, -1)
+                else:
+                    positions = range(i_low, i_high)
+
+                for i in positions:
+                    yield keys[i], self._unpack_row(blobs[i])
+
+    def iter_values(self, columns):
+        '''
+        Tuples of values of columns of all rows, unpacked without
+        building row dicts. Blocks are decoded one at a time, bypassing
+        cache.
+        '''
+        codec = self.table.schema.row_codec
+        positions = [codec.names.index(c) for c in columns]
+
+        with self.pinned():
+            self._get_block_index()
+
+            for block_no in range(len(self.block_handles)):
+                keys, blobs = self._decode_block(block_no, fill_cache=False)
+
+                for blob in blobs:
+                    values, p = codec.unpack_from(blob)
+                    yield tuple([values[j] for j in positions])
+
+    def get(self, key, columns=None):
+        columns = self._get_columns(columns)
+
+        if not self._is_primary_key(columns):
+            return SSTable.get(self, key, columns)
+
+        if len(key) != len(columns):
+            return self._get_prefix(key)
+
+        with self.pinned():
+            bloom = self._get_bloom()
+
+            if bloom and not bloom.may_contain(key):
+                raise KeyError(key)
+
+            self._get_block_index()
+            block_no = bisect.bisect_right(self.block_first_keys, key) - 1
+
+            if __debug__:
+                self.table.store.metrics.incr('sstable.block_gets')
+
+            try:
+                if block_no < 0:
+                    raise KeyError(key)
+
+                i, blob = self._find_in_block(block_no, key)
+            except KeyError as e:
+                if bloom:
+                    bloom.n_false_positives += 1
+
+                raise
+
+            pos = self.block_first_ordinals[block_no] + i
+            row = self._unpack_row(blob)
+
+        return row, pos, pos
+
+    def _get_prefix(self, key):
+        '''
+        First row whose primary key starts with key, found by block
+        fences.
+        '''
+        with self.pinned():
+            pos = self._seek(key)
+
+            if pos >= self.n_rows:
+                raise KeyError(key)
+
+            row = self._read_row(pos)
+
+        primary_key = self.table.schema.primary_key
+
+        if tuple(row[c] for c in primary_key[:len(key)]) != tuple(key):
+            raise KeyError(key)
+
+        return row, pos, pos
+
+    def get_key_range(self):
+        if self.key_range is None:
+            with self.pinned():
+                self._get_block_index()
+
+                if self.block_handles:
+                    keys, blobs = self._decode_block(len(self.block_handles) - 1)
+                    self.key_range = (self.block_first_keys[0], keys[-1])
+                else:
+                    self.key_range = ()
+
+        return self.key_range or None
+
+    def get_split_keys(self, n):
+        '''
+        Up to n - 1 first keys of blocks which split sstable into n
+        parts of about same number of blocks.
+        '''
+        with self.pinned():
+            self._get_block_index()
+            n_blocks = len(self.block_handles)
+            positions = sorted(set(n_blocks * i // n for i in range(1, n)))
+            return [self.block_first_keys[i] for i in positions if 0 < i < n_blocks]
+
+    def get_many(self, keys):
+        '''
+        Rows of sorted primary keys found in sstable, by key. Keys which
+        fall into same block are found in block decoded once.
+        '''
+        rows = {}
+
+        with self.pinned():
+            bloom = self._get_bloom()
+            self._get_block_index()
+            first_keys = self.block_first_keys
+            block_no = -1
+            block_keys = None
+            block_blobs = None
+
+            for key in keys:
+                if bloom and not bloom.may_contain(key):
+                    continue
+
+                # blocks are visited in order, never before current one
+                i = bisect.bisect_right(first_keys, key, max(block_no, 0)) - 1
+
+                if i < 0:
+                    continue
+
+                if i != block_no:
+                    block_no = i
+                    block_keys, block_blobs = self._decode_block(block_no)
+
+                j = bisect.bisect_left(block_keys, key)
+
+                if j < len(block_keys) and block_keys[j] == key:
+                    rows[key] = self._unpack_row(block_blobs[j])
+                elif bloom:
+                    bloom.n_false_positives += 1
+
+        return rows
+
+    def _get_by(self, name, key, columns=None):
+        columns = self._get_columns(columns)
+
+        if not self._is_primary_key(columns):
+            return SSTable._get_by(self, name, key, columns)
+
+        with self.pinned():
+            if name == 'get_lt_sstable_pos':
+                pos = self._seek(key) - 1
+            elif name == 'get_le_sstable_pos':
+                pos = self._seek(key, upper=True) - 1
+            elif name == 'get_gt_sstable_pos':
+                pos = self._seek(key, upper=True)
+            elif name == 'get_ge_sstable_pos':
+                pos = self._seek(key)
+
+            if pos < 0 or pos >= self.n_rows:
+                raise KeyError(key)
+
+            row = self._read_row(pos)
+
+        return row, pos, pos
@@ -0,0 +1,139 @@
+__all__ = ['BloomFilter']
+
+import os
+import sys
+import mmap
+import struct
+import hashlib
+
+class BloomFilter(object):
+    '''
+    BloomFilter answers if key may be in sstable or is surely not in it.
+    '''
+
+    HEADER_FORMAT = b'!QB'
+    HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+    def __init__(self, sstable, t, bits_per_key=10):
+        self.sstable = sstable
+        self.t = t
+        self.bits_per_key = bits_per_key
+        self.n_bits = 0
+        self.n_hashes = 0
+        self.mm = None
+        self.f = None
+        self.opened = False
+        self._hashes = None
+
+        # counters
+        self.n_checks = 0
+        self.n_negatives = 0
+        self.n_false_positives = 0
+
+    def __contains__(self, key):
+        return self.may_contain(key)
+
+    def get_path(self):
+        filename = 'bloom-%s.data' % self.t
+        path = os.path.join(self.sstable.table.get_path(), filename)
+        return path
+
+    def is_opened(self):
+        return self.opened
+
+    def open(self):
+        '''
+        Open file for reading.
+        '''
+        path = self.get_path()
+        self.opened = True
+
+        if not os.path.exists(path):
+            # sstable written without bloom filter
+            return
+
+        self.f = open(path, 'r+b')
+        self.mm = mmap.mmap(self.f.fileno(), 0)
+        self.n_bits, self.n_hashes = struct.unpack_from(self.HEADER_FORMAT, self.mm, 0)
+
+    def close(self):
+        '''
+        Close file for reading.
+        '''
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+        self.opened = False
+
+    def w_open(self):
+        '''
+        Open file for writing.
+        '''
+        self.f = open(self.get_path(), 'wb')
+        self._hashes = []
+
+    def w_close(self):
+        '''
+        Close file for writing.
+        '''
+        n_keys = len(self._hashes)
+        n_bits = max(64, n_keys * self.bits_per_key)
+        n_bits = ((n_bits + 7) // 8) * 8
+
+        # k = ln(2) * m / n
+        n_hashes = max(1, min(30, int(self.bits_per_key * 0.69)))
+        bits = bytearray(n_bits // 8)
+
+        for h1, h2 in self._hashes:
+            for i in range(n_hashes):
+                bit = (h1 + i * h2) % n_bits
+                bits[bit >> 3] |= 1 << (bit & 7)
+
+        self.f.write(struct.pack(self.HEADER_FORMAT, n_bits, n_hashes))
+        self.f.write(bytes(bits))
+        self.f.close()
+        self.f = None
+        self._hashes = None
+
+    def _get_key_hashes(self, key):
+        # pack key using column types so equal values hash equally,
+        # e.g. (1, 3) and (1, 3.0)
+        schema = self.sstable.table.schema
+        key_blob = schema.get_key_codec(schema.primary_key).pack(key)
+        digest = hashlib.md5(key_blob).digest()
+        h1, h2 = struct.unpack(b'!QQ', digest)
+        return h1, h2 | 1
+
+    def _add_key(self, key):
+        self._hashes.append(self._get_key_hashes(key))
+
+    def may_contain(self, key):
+        if self.mm is None:
+            return True
+
+        self.n_checks += 1
+        h1, h2 = self._get_key_hashes(key)
+        n_bits = self.n_bits
+        mm = self.mm
+        offset = self.HEADER_SIZE
+
+        for i in range(self.n_hashes):
+            bit = (h1 + i * h2) % n_bits
+
+            if not ord(mm[offset + (bit >> 3)]) & (1 << (bit & 7)):
+                self.n_negatives += 1
+                return False
+
+        return True
+
+    def get_stats(self):
+        return {
+            'checks': self.n_checks,
+            'negatives': self.n_negatives,
+            'false_positives': self.n_false_positives,
+        }
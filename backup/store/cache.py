@@ -0,0 +1,237 @@
+__all__ = ['Cache', 'get_row_size', 'ENTRY_OVERHEAD_SIZE']
+
+import threading
+from collections import OrderedDict, defaultdict
+
+# approximate per entry overhead of python objects
+ENTRY_OVERHEAD_SIZE = 64
+
+def get_row_size(row):
+    size = ENTRY_OVERHEAD_SIZE
+
+    for v in row.values():
+        if isinstance(v, basestring):
+            size += len(v)
+        else:
+            size += 8
+
+    return size
+
+class CacheShard(object):
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.lock = threading.Lock()
+        self.size = 0
+
+        # keys by sstable id, used to invalidate sstable's entries
+        self.keys_by_id = defaultdict(set)
+
+        # counters
+        self.n_hits = 0
+        self.n_misses = 0
+        self.n_evictions = 0
+
+    def _forget_key(self, key):
+        keys = self.keys_by_id[key[0]]
+        keys.discard(key)
+
+        if not keys:
+            del self.keys_by_id[key[0]]
+
+    def erase_id(self, id_):
+        with self.lock:
+            for key in list(self.keys_by_id.get(id_, ())):
+                self._erase(key)
+
+class LRUCacheShard(CacheShard):
+    '''
+    Least recently used entries are evicted first.
+    '''
+
+    def __init__(self, capacity):
+        CacheShard.__init__(self, capacity)
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            try:
+                value, charge = self.entries.pop(key)
+            except KeyError as e:
+                self.n_misses += 1
+                return None
+
+            # most recently used at the end
+            self.entries[key] = (value, charge)
+            self.n_hits += 1
+            return value
+
+    def set(self, key, value, charge):
+        with self.lock:
+            if key in self.entries:
+                self._erase(key)
+
+            # entry would evict whole shard
+            if charge > self.capacity:
+                return
+
+            self.entries[key] = (value, charge)
+            self.keys_by_id[key[0]].add(key)
+            self.size += charge
+
+            while self.size > self.capacity and self.entries:
+                old_key = next(iter(self.entries))
+                self._erase(old_key)
+                self.n_evictions += 1
+
+    def _erase(self, key):
+        value, charge = self.entries.pop(key)
+        self.size -= charge
+        self._forget_key(key)
+
+class ClockCacheShard(CacheShard):
+    '''
+    CLOCK approximation of LRU: hits only set reference bit, so reads
+    do not reorder entries. Hand clears bits until it finds entry
+    without it and evicts that entry.
+    '''
+
+    def __init__(self, capacity):
+        CacheShard.__init__(self, capacity)
+        self.entries = {}
+        self.ring = []
+        self.free_slots = []
+        self.hand = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            try:
+                entry = self.entries[key]
+            except KeyError as e:
+                self.n_misses += 1
+                return None
+
+            # value, charge, slot, referenced
+            entry[3] = True
+            self.n_hits += 1
+            return entry[0]
+
+    def set(self, key, value, charge):
+        with self.lock:
+            if key in self.entries:
+                self._erase(key)
+
+            # entry would evict whole shard
+            if charge > self.capacity:
+                return
+
+            if self.free_slots:
+                slot = self.free_slots.pop()
+                self.ring[slot] = key
+            else:
+                slot = len(self.ring)
+                self.ring.append(key)
+
+            self.entries[key] = [value, charge, slot, False]
+            self.keys_by_id[key[0]].add(key)
+            self.size += charge
+
+            while self.size > self.capacity and self.entries:
+                self._evict_one()
+
+    def _evict_one(self):
+        while True:
+            if self.hand >= len(self.ring):
+                self.hand = 0
+
+            key = self.ring[self.hand]
+            self.hand += 1
+
+            if key is None:
+                continue
+
+            entry = self.entries[key]
+
+            if entry[3]:
+                entry[3] = False
+                continue
+
+            self._erase(key)
+            self.n_evictions += 1
+            break
+
+    def _erase(self, key):
+        value, charge, slot, referenced = self.entries.pop(key)
+        self.ring[slot] = None
+        self.free_slots.append(slot)
+        self.size -= charge
+        self._forget_key(key)
+
+class Cache(object):
+    '''
+    Cache shared by all sstables in store, keyed by
+    (sstable id, position). Entries are split into shards by key, each
+    with own lock, so readers of different keys rarely contend.
+    '''
+
+    SHARD_CLASSES = {
+        'lru': LRUCacheShard,
+        'clock': ClockCacheShard,
+    }
+
+    def __init__(self, capacity, n_shards=16, policy='lru'):
+        if policy not in self.SHARD_CLASSES:
+            raise Exception('unsupported cache policy %r' % policy)
+
+        self.capacity = capacity
+        self.policy = policy
+        shard_class = self.SHARD_CLASSES[policy]
+        shard_capacity = max(1, capacity // n_shards)
+        self.shards = [shard_class(shard_capacity) for i in range(n_shards)]
+
+    def _get_shard(self, key):
+        # positions are often multiples of row or block size, so low bits
+        # of hash are mixed into high bits before picking shard
+        h = (hash(key) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+        return self.shards[(h >> 32) % len(self.shards)]
+
+    def get(self, key):
+        '''
+        Cached value or None.
+        '''
+        return self._get_shard(key).get(key)
+
+    def set(self, key, value, charge):
+        self._get_shard(key).set(key, value, charge)
+
+    def erase_id(self, id_):
+        '''
+        Invalidate all entries of sstable.
+        '''
+        for shard in self.shards:
+            shard.erase_id(id_)
+
+    def get_stats(self):
+        stats = {
+            'capacity': self.capacity,
+            'policy': self.policy,
+            'size': 0,
+            'entries': 0,
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+        }
+
+        for shard in self.shards:
+            stats['size'] += shard.size
+            stats['entries'] += len(shard)
+            stats['hits'] += shard.n_hits
+            stats['misses'] += shard.n_misses
+            stats['evictions'] += shard.n_evictions
+
+        return stats
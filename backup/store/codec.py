@@ -0,0 +1,230 @@
+__all__ = ['RowCodec']
+
+import struct
+
+class RowCodec(object):
+    '''
+    RowCodec packs and unpacks values of columns using struct.Struct
+    compiled once per schema.
+
+    Adjacent fixed-width columns are packed by single struct, while
+    variable-length str columns are packed as header and bytes.
+    Layout of each column is same as Column._get_column_packed:
+    status, is_null and value.
+    '''
+
+    STR_HEADER = struct.Struct(b'!BBQ')
+    SORTABLE_FORMAT = struct.Struct(b'!Q')
+    SIGN_BIT = 1 << 63
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.names = tuple(t.name for t in self.columns)
+
+        # segments: ('fixed', struct, types) or ('str', None, None)
+        self.segments = []
+        fmt_items = []
+        fixed_columns = []
+
+        for t in self.columns:
+            if t.type == 'str' and t.size is None:
+                if fmt_items:
+                    self._add_fixed_segment(fmt_items, fixed_columns)
+                    fmt_items = []
+                    fixed_columns = []
+
+                self.segments.append(('str', None, None))
+                continue
+
+            if t.type == 'bool':
+                fmt_items.append('BBB')
+            elif t.type == 'int':
+                fmt_items.append('BBq')
+            elif t.type == 'float':
+                fmt_items.append('BBd')
+            elif t.type == 'str':
+                fmt_items.append('BBQ%is' % t.size)
+            else:
+                raise Exception('unsupported column type')
+
+            fixed_columns.append(t)
+
+        if fmt_items:
+            self._add_fixed_segment(fmt_items, fixed_columns)
+
+        # whole row is fixed-width
+        if len(self.segments) == 1 and self.segments[0][0] == 'fixed':
+            self.struct = self.segments[0][1]
+            self.format = self.struct.format
+            self.size = self.struct.size
+        elif not self.segments:
+            self.struct = struct.Struct(b'!')
+            self.format = self.struct.format
+            self.size = 0
+        else:
+            self.struct = None
+            self.format = None
+            self.size = None
+
+    def _add_fixed_segment(self, fmt_items, columns):
+        s = struct.Struct(b'!' + b''.join(fmt_items))
+        types = tuple((t.type, t.size) for t in columns)
+        self.segments.append(('fixed', s, types))
+
+    def _pack_fixed_items(self, types, values):
+        items = []
+
+        for (type_, size), v in zip(types, values):
+            if v is None:
+                if type_ == 'str':
+                    items.extend((0, 1, 0, b''))
+                elif type_ == 'float':
+                    items.extend((0, 1, 0.0))
+                else:
+                    items.extend((0, 1, 0))
+            elif type_ == 'str':
+                if len(v) > size:
+                    raise Exception('value %r is longer than %i' % (v, size))
+
+                items.extend((0, 0, len(v), v))
+            else:
+                items.extend((0, 0, v))
+
+        return items
+
+    def pack(self, values):
+        '''
+        Pack values ordered as columns.
+        '''
+        if self.struct is not None:
+            items = self._pack_fixed_items(self.segments[0][2], values)
+            return self.struct.pack(*items)
+
+        blob_items = []
+        i = 0
+
+        for kind, s, types in self.segments:
+            if kind == 'fixed':
+                n = len(types)
+                items = self._pack_fixed_items(types, values[i:i + n])
+                blob_items.append(s.pack(*items))
+                i += n
+            else:
+                v = values[i]
+
+                if v is None:
+                    blob_items.append(self.STR_HEADER.pack(0, 1, 0))
+                else:
+                    blob_items.append(self.STR_HEADER.pack(0, 0, len(v)))
+                    blob_items.append(v)
+
+                i += 1
+
+        return b''.join(blob_items)
+
+    def _unpack_fixed_items(self, types, items, values):
+        j = 0
+
+        for type_, size in types:
+            is_null = items[j + 1]
+
+            if type_ == 'str':
+                if is_null:
+                    values.append(None)
+                else:
+                    values.append(items[j + 3][:items[j + 2]])
+
+                j += 4
+            else:
+                if is_null:
+                    values.append(None)
+                elif type_ == 'bool':
+                    values.append(bool(items[j + 2]))
+                else:
+                    values.append(items[j + 2])
+
+                j += 3
+
+    def unpack_from(self, buf, pos=0):
+        '''
+        Unpack values ordered as columns, returns values and position
+        after them.
+        '''
+        values = []
+
+        for kind, s, types in self.segments:
+            if kind == 'fixed':
+                items = s.unpack_from(buf, pos)
+                self._unpack_fixed_items(types, items, values)
+                pos += s.size
+            else:
+                status, is_null, str_len = self.STR_HEADER.unpack_from(buf, pos)
+                pos += self.STR_HEADER.size
+
+                if is_null:
+                    values.append(None)
+                else:
+                    values.append(buf[pos:pos + str_len])
+
+                pos += str_len
+
+        return tuple(values), pos
+
+    def _get_sortable_column_size(self, t):
+        if t.type == 'bool':
+            return 2
+        elif t.type in ('int', 'float'):
+            return 9
+        elif t.type == 'str' and t.size is not None:
+            return 1 + t.size
+        else:
+            raise Exception('column %r has no fixed size' % t.name)
+
+    def get_sortable_size(self, n=None):
+        '''
+        Size of sortable packed values of first n columns.
+        '''
+        return sum(self._get_sortable_column_size(t) for t in self.columns[:n])
+
+    def pack_sortable(self, values):
+        '''
+        Pack values of leading columns into bytes which compare in same
+        order as values, so keys can be compared and searched as bytes.
+        NULL is ordered before any other value.
+        '''
+        items = []
+
+        for t, v in zip(self.columns, values):
+            if v is None:
+                items.append(b'\0' * self._get_sortable_column_size(t))
+                continue
+
+            items.append(b'\1')
+
+            if t.type == 'bool':
+                items.append(b'\1' if v else b'\0')
+            elif t.type == 'int':
+                if not isinstance(v, (int, long)):
+                    raise TypeError('value %r of column %r is not int' % (v, t.name))
+
+                items.append(self.SORTABLE_FORMAT.pack(v + self.SIGN_BIT))
+            elif t.type == 'float':
+                if not isinstance(v, (int, long, float)):
+                    raise TypeError('value %r of column %r is not float' % (v, t.name))
+
+                bits, = self.SORTABLE_FORMAT.unpack(struct.pack(b'!d', v))
+
+                # negative floats are ordered reversed
+                if bits & self.SIGN_BIT:
+                    bits ^= 0xFFFFFFFFFFFFFFFF
+                else:
+                    bits |= self.SIGN_BIT
+
+                items.append(self.SORTABLE_FORMAT.pack(bits))
+            else:
+                if not isinstance(v, basestring):
+                    raise TypeError('value %r of column %r is not str' % (v, t.name))
+
+                items.append(v.ljust(t.size, b'\0'))
+
+        return b''.join(items)
@@ -57,8 +57,8 @@ class Column(object):
         elif self.type == 'float':
             fmt = b'!BBd'
         elif self.type == 'str':
-            if value is None:
-                fmt = b'!BBQ%is' % self.size
+            if self.size is not None or value is None:
+                fmt = b'!BBQ%is' % (self.size or 0)
             else:
                 fmt = b'!BBQ%is' % len(value)
         else:
@@ -76,8 +76,13 @@ class Column(object):
         is_null = 1 if value is None else 0
 
         if self.type == 'str':
-            # FIXME: use self.size if required
-            b = struct.pack(fmt, 0, is_null, len(value), value)
+            # fixed size str is padded to self.size
+            if value is None:
+                b = struct.pack(fmt, 0, is_null, 0, b'')
+            else:
+                b = struct.pack(fmt, 0, is_null, len(value), value)
+        elif value is None:
+            b = struct.pack(fmt, 0, is_null, 0)
         else:
             b = struct.pack(fmt, 0, is_null, value)
 
@@ -101,8 +106,11 @@ class Column(object):
             str_len, = struct.unpack_from('!Q', mm, pos)
             pos += 8
             value = mm[pos:pos + str_len]
-            pos += str_len
+            pos += self.size if self.size is not None else str_len
         else:
             raise Exception('unsupported column type')
 
+        if is_null:
+            value = None
+
         return value, pos
@@ -0,0 +1,413 @@
+__all__ = ['ColumnarSSTable']
+
+import os
+import sys
+import shutil
+import struct
+import operator
+import tempfile
+import itertools
+
+try:
+    import numpy
+except ImportError as e:
+    numpy = None
+
+from .sstable import SSTable
+from .expr import OPERATORS
+
+class ColumnarSSTable(SSTable):
+    '''
+    ColumnarSSTable stores each column contiguously in data file.
+
+    For every column there is null map (one byte per row) and values:
+    bool, int and float as fixed-width big-endian arrays, str as
+    offsets array followed by bytes. Footer holds positions of column
+    sections, number of rows and magic. Offset and index files are
+    same as in SSTable, but their positions are row numbers.
+
+    Columns are written in chunks of CHUNK_N_ROWS rows to temporary
+    files, one per column part, which are copied into data file when
+    sstable is closed, so writer does not hold whole sstable in memory.
+
+    If numpy is available, fixed-width columns are mapped with
+    numpy.frombuffer directly over mmap and scanned vectorized.
+    '''
+
+    CHUNK_N_ROWS = 64 * 1024
+
+    MAGIC = b'YADBCOL1'
+    ALIGNMENT = 8
+    SECTION_FORMAT = struct.Struct(b'!QQQ')
+    COUNT_FORMAT = struct.Struct(b'!Q')
+    STR_OFFSETS_FORMAT = struct.Struct(b'!QQ')
+
+    # column type: (numpy dtype, struct format)
+    FIXED_TYPES = {
+        'bool': ('>u1', b'B'),
+        'int': ('>i8', b'q'),
+        'float': ('>f8', b'd'),
+    }
+
+    def __init__(self, table, t=None, rows=None):
+        self.layout = None
+        self.n_rows = 0
+        self._columns = None
+        self._parts = None
+        self._str_pos = None
+        SSTable.__init__(self, table, t, rows)
+
+    def w_open(self):
+        '''
+        Open file for writing.
+        '''
+        SSTable.w_open(self)
+        self.n_rows = 0
+        self._columns = dict((c, []) for c, t in self.table.schema)
+
+        # temporary files of null map, values and str data of columns
+        self._parts = {}
+        self._str_pos = {}
+
+        for c, t in self.table.schema:
+            n_parts = 2 if t.type in self.FIXED_TYPES else 3
+            self._parts[c] = [tempfile.TemporaryFile(dir=self.table.get_path()) for i in range(n_parts)]
+            self._str_pos[c] = 0
+
+    def w_close(self):
+        '''
+        Close file for writing.
+        '''
+        try:
+            self._write_columns()
+        finally:
+            for parts in self._parts.values():
+                for part in parts:
+                    part.close()
+
+            self._columns = None
+            self._parts = None
+            self._str_pos = None
+
+        SSTable.w_close(self)
+
+    def _add_row(self, row):
+        # row number is position of row
+        sstable_pos = self.n_rows
+        self.n_rows += 1
+
+        for c, t in self.table.schema:
+            self._columns[c].append(row.get(c, None))
+
+        if not self.n_rows % self.CHUNK_N_ROWS:
+            self._write_chunk()
+
+        # offset
+        self.offset._write_sstable_pos(sstable_pos)
+
+        # index
+        for column_names, index in self.indexes.items():
+            index._write_key(row, sstable_pos)
+
+        # bloom filter
+        if self.bloom:
+            key = tuple(row[c] for c in self.table.schema.primary_key)
+            self.bloom._add_key(key)
+
+        # zone map
+        self.stats._add_row(row)
+
+    def _write_padding(self):
+        pos = self.f.tell()
+        padding = -pos % self.ALIGNMENT
+
+        if padding:
+            self.f.write(b'\0' * padding)
+
+    def _write_chunk(self):
+        '''
+        Append buffered values of columns to their temporary files.
+        '''
+        for c, t in self.table.schema:
+            values = self._columns[c]
+            parts = self._parts[c]
+
+            if not values:
+                continue
+
+            # null map
+            parts[0].write(bytes(bytearray(1 if v is None else 0 for v in values)))
+
+            if t.type in self.FIXED_TYPES:
+                dtype, fmt = self.FIXED_TYPES[t.type]
+                zero = 0.0 if t.type == 'float' else 0
+                values = [zero if v is None else v for v in values]
+                parts[1].write(struct.pack(b'!%i%s' % (len(values), fmt), *values))
+            else:
+                offsets = []
+                pos = self._str_pos[c]
+
+                for v in values:
+                    offsets.append(pos)
+                    pos += len(v) if v is not None else 0
+
+                self._str_pos[c] = pos
+                parts[1].write(struct.pack(b'!%iQ' % len(offsets), *offsets))
+                parts[2].write(b''.join(v for v in values if v is not None))
+
+            self._columns[c] = []
+
+    def _copy_part(self, part):
+        part.seek(0)
+        shutil.copyfileobj(part, self.f)
+
+    def _write_columns(self):
+        self._write_chunk()
+        f = self.f
+        n = self.n_rows
+        sections = []
+
+        for c, t in self.table.schema:
+            parts = self._parts[c]
+
+            # null map
+            null_pos = f.tell()
+            self._copy_part(parts[0])
+            self._write_padding()
+            values_pos = f.tell()
+            self._copy_part(parts[1])
+
+            if t.type in self.FIXED_TYPES:
+                data_pos = 0
+            else:
+                # offsets end with end of last value
+                f.write(struct.pack(b'!Q', self._str_pos[c]))
+                self._write_padding()
+                data_pos = f.tell()
+                self._copy_part(parts[2])
+
+            self._write_padding()
+            sections.append((null_pos, values_pos, data_pos))
+
+        # footer
+        for section in sections:
+            f.write(self.SECTION_FORMAT.pack(*section))
+
+        f.write(self.COUNT_FORMAT.pack(n))
+        f.write(self.MAGIC)
+
+    def _get_layout(self):
+        '''
+        Positions of column sections by column name, read from footer.
+        '''
+        if self.layout is not None:
+            return self.layout
+
+        mm = self._get_mm()
+        columns = list(self.table.schema)
+        size = mm.size()
+
+        if mm[size - len(self.MAGIC):size] != self.MAGIC:
+            raise Exception('invalid columnar sstable %r' % self.get_path())
+
+        pos = size - len(self.MAGIC) - self.COUNT_FORMAT.size
+        n, = self.COUNT_FORMAT.unpack_from(mm, pos)
+        pos -= len(columns) * self.SECTION_FORMAT.size
+        layout = {}
+
+        for c, t in columns:
+            null_pos, values_pos, data_pos = self.SECTION_FORMAT.unpack_from(mm, pos)
+            pos += self.SECTION_FORMAT.size
+
+            if t.type in self.FIXED_TYPES:
+                dtype, fmt = self.FIXED_TYPES[t.type]
+                reader = struct.Struct(b'!' + fmt)
+            else:
+                reader = None
+
+            layout[c] = (t, null_pos, values_pos, data_pos, reader)
+
+        self.n_rows = n
+        self.layout = layout
+        return layout
+
+    def _read_value(self, mm, layout, c, i):
+        t, null_pos, values_pos, data_pos, reader = layout[c]
+
+        if ord(mm[null_pos + i]):
+            return None
+
+        if reader is not None:
+            v, = reader.unpack_from(mm, values_pos + i * reader.size)
+
+            if t.type == 'bool':
+                v = bool(v)
+        else:
+            start, end = self.STR_OFFSETS_FORMAT.unpack_from(mm, values_pos + i * 8)
+            v = mm[data_pos + start:data_pos + end]
+
+        return v
+
+    def _decode_row(self, pos):
+        mm = self._get_mm()
+        layout = self._get_layout()
+        row = {}
+
+        for c in layout:
+            row[c] = self._read_value(mm, layout, c, pos)
+
+        return row
+
+    def get_column_array(self, column):
+        '''
+        Values of fixed-width column mapped over mmap without copying.
+        Array is valid only while sstable is pinned.
+        '''
+        mm = self._get_mm()
+        t, null_pos, values_pos, data_pos, reader = self._get_layout()[column]
+        dtype, fmt = self.FIXED_TYPES[t.type]
+        return numpy.frombuffer(mm, dtype=dtype, count=self.n_rows, offset=values_pos)
+
+    def get_null_array(self, column):
+        '''
+        Null map of column mapped over mmap without copying.
+        Array is valid only while sstable is pinned.
+        '''
+        mm = self._get_mm()
+        t, null_pos, values_pos, data_pos, reader = self._get_layout()[column]
+        return numpy.frombuffer(mm, dtype='u1', count=self.n_rows, offset=null_pos)
+
+    def get_column(self, column):
+        '''
+        All values of column as list.
+        '''
+        with self.pinned():
+            if numpy is not None and self.table.schema[column].type in self.FIXED_TYPES:
+                values = self.get_column_array(column).tolist()
+                nulls = self.get_null_array(column)
+
+                for i in numpy.flatnonzero(nulls).tolist():
+                    values[i] = None
+
+                if self.table.schema[column].type == 'bool':
+                    values = [None if v is None else bool(v) for v in values]
+            else:
+                mm = self._get_mm()
+                layout = self._get_layout()
+                values = [self._read_value(mm, layout, column, i) for i in range(self.n_rows)]
+
+        return values
+
+    def iter_values(self, columns):
+        '''
+        Tuples of values of columns of all rows, read column by column.
+        '''
+        return itertools.izip(*[self.get_column(c) for c in columns])
+
+    def aggregate_column(self, column):
+        '''
+        (number of non-NULL values, sum, min, max) of fixed-width column,
+        computed over mmap without building rows. Values are added as by
+        Sum, so sum is None without values and bools are added as ints.
+        '''
+        t = self.table.schema[column]
+
+        with self.pinned():
+            if numpy is None or t.type not in self.FIXED_TYPES:
+                values = [v for v in self.get_column(column) if v is not None]
+
+                if not values:
+                    return 0, None, None, None
+
+                total = reduce(operator.add, values)
+                return len(values), total, min(values), max(values)
+
+            values = self.get_column_array(column)
+            values = values[self.get_null_array(column) == 0]
+
+            if not len(values):
+                return 0, None, None, None
+
+            if t.type == 'int':
+                total = int(values.astype('i8').sum())
+                low, high = int(values.min()), int(values.max())
+            elif t.type == 'float':
+                total = float(values.sum())
+                low, high = float(values.min()), float(values.max())
+            else:
+                # True + True is int, but single value is added as is
+                total = int(values.sum()) if len(values) > 1 else bool(values[0])
+                low, high = bool(values.min()), bool(values.max())
+
+            return len(values), total, low, high
+
+    def can_scan_column(self, column, op, value):
+        '''
+        Predicate "column op value" can be evaluated vectorized, i.e.
+        column is fixed-width and value is number comparable with it.
+        '''
+        if numpy is None or column not in self.table.schema or op not in OPERATORS:
+            return False
+
+        t = self.table.schema[column]
+
+        if t.type not in self.FIXED_TYPES:
+            return False
+
+        if isinstance(value, bool):
+            return True
+
+        if isinstance(value, (int, long)):
+            # larger ints do not fit into int64 array
+            return -2 ** 63 <= value < 2 ** 63
+
+        return isinstance(value, float) and t.type != 'bool'
+
+    def get_column_mask(self, column, op, value):
+        '''
+        Boolean array of rows whose column satisfies "column op value".
+        NULL values never satisfy it.
+        '''
+        values = self.get_column_array(column)
+        nulls = self.get_null_array(column)
+        return OPERATORS[op](values, value) & (nulls == 0)
+
+    def scan_column(self, column, op, value):
+        '''
+        Offset positions of rows whose column satisfies "column op value".
+        NULL values never satisfy it.
+        '''
+        if not self.can_scan_column(column, op, value):
+            f = OPERATORS[op]
+            values = self.get_column(column)
+            return [i for i, v in enumerate(values) if v is not None and f(v, value)]
+
+        with self.pinned():
+            mask = self.get_column_mask(column, op, value)
+            positions = numpy.flatnonzero(mask).tolist()
+
+        return positions
+
+    def iter_where(self, start, predicates):
+        '''
+        (key, row) pairs with key >= start ordered by primary key, whose
+        columns satisfy all predicates (column, op, value), which must
+        pass can_scan_column. Predicates are evaluated over whole columns
+        and only matching rows are decoded.
+        '''
+        primary_key = self.table.schema.primary_key
+
+        with self.pinned():
+            low = self._seek(start) if start is not None else 0
+            mask = None
+
+            for column, op, value in predicates:
+                column_mask = self.get_column_mask(column, op, value)
+                mask = column_mask if mask is None else mask & column_mask
+
+            positions = numpy.flatnonzero(mask[low:]) + low
+            offset = self._get_offset()
+
+            for i in positions.tolist():
+                row = self._decode_row(offset[i])
+                yield tuple(row[c] for c in primary_key), row
@@ -0,0 +1,150 @@
+__all__ = ['Compactor']
+
+import os
+import sys
+import threading
+
+class Compactor(object):
+    '''
+    Size-tiered compaction of table's sstables on background thread.
+
+    Only runs of adjacent sstables are merged, so merged sstable can take
+    place of sstables it replaces and newer sstables still shadow it.
+    Replaced sstables pinned by live snapshots are unlinked but stay
+    readable until snapshots release them.
+    '''
+
+    INTERVAL = 1.0
+    MIN_THRESHOLD = 4
+    MAX_THRESHOLD = 32
+    BUCKET_LOW = 0.5
+    BUCKET_HIGH = 1.5
+
+    def __init__(self, store, interval=None, min_threshold=None,
+                 max_threshold=None, bucket_low=None, bucket_high=None):
+        self.store = store
+        self.interval = interval or self.INTERVAL
+        self.min_threshold = min_threshold or self.MIN_THRESHOLD
+        self.max_threshold = max_threshold or self.MAX_THRESHOLD
+        self.bucket_low = bucket_low or self.BUCKET_LOW
+        self.bucket_high = bucket_high or self.BUCKET_HIGH
+        self.thread = None
+        self.event = threading.Event()
+        self.running = False
+
+        # counters
+        self.n_compactions = 0
+        self.n_merged_sstables = 0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        self.event.set()
+
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def notify(self, table=None):
+        '''
+        Wake up compaction thread, e.g. after table flushed memtable.
+        '''
+        self.event.set()
+
+    def run(self):
+        while self.running:
+            self.event.wait(self.interval)
+            self.event.clear()
+
+            if not self.running:
+                break
+
+            for db in list(self.store.databases.values()):
+                for table in list(db.tables):
+                    while self.running and self.compact_table(table):
+                        pass
+
+    def get_bucket(self, sstables):
+        '''
+        Find first run of adjacent sstables with similar size.
+        '''
+        bucket = []
+        bucket_size = 0
+
+        for sst in sstables:
+            size = sst.get_size()
+            avg_size = bucket_size / float(len(bucket)) if bucket else size
+
+            if bucket and not (avg_size * self.bucket_low <= size <= avg_size * self.bucket_high):
+                if len(bucket) >= self.min_threshold:
+                    break
+
+                bucket = []
+                bucket_size = 0
+
+            bucket.append(sst)
+            bucket_size += size
+
+            if len(bucket) >= self.max_threshold:
+                break
+
+        if len(bucket) < self.min_threshold:
+            return None
+
+        return bucket
+
+    def compact_table(self, table):
+        '''
+        Compact one bucket of table's sstables if there is any.
+        '''
+        sstables = table.sstables
+        bucket = self.get_bucket(sstables)
+
+        if not bucket:
+            return False
+
+        self.compact(table, bucket)
+        return True
+
+    def compact(self, table, bucket):
+        if __debug__:
+            metrics = self.store.metrics
+            t0 = metrics.now()
+
+        # merge outside of table's lock, sstables are read-only
+        sst = table.sstable_class.merge(table, bucket)
+        sst.open()
+
+        # merged sstable replaces bucket in manifest first, so crash
+        # before old files are removed only leaves orphans
+        table.manifest.apply(bucket, [sst])
+
+        # swap sstables
+        with table.lock:
+            sstables = list(table.sstables)
+            i = sstables.index(bucket[0])
+            sstables[i:i + len(bucket)] = [sst]
+            table.sstables = sstables
+
+            for old_sst in bucket:
+                old_sst.remove()
+
+        self.n_compactions += 1
+        self.n_merged_sstables += len(bucket)
+
+        if __debug__:
+            metrics.observe('compaction.compact_us', t0)
+            metrics.add('compaction.merged_sstables', len(bucket))
+
+        return sst
+
+    def get_stats(self):
+        return {
+            'compactions': self.n_compactions,
+            'merged_sstables': self.n_merged_sstables,
+        }
@@ -6,6 +6,8 @@ from collections import OrderedDict
 
 from .table import Table
 from .column import Column
+from .schema import Schema
+from .block import BlockSSTable
 
 class Database(object):
     def __init__(self, store, db_name):
@@ -71,7 +73,7 @@ class Database(object):
             _items = sorted(_type_fields.items(), key=lambda n: n[0])
 
             for column_name, column_type in _items:
-                if column_name == 'primary_key':
+                if column_name in Schema.OPTIONS:
                     continue
 
                 if column_type == 'bool':
@@ -88,7 +90,7 @@ class Database(object):
                     else:
                         size = None
 
-                    column = Column(column_name, column_type, size)
+                    column = Column(column_name, 'str', size)
                 else:
                     raise Exception('unsupported column type')
 
@@ -110,6 +112,54 @@ class Database(object):
                     )
 
             type_fields['primary_key'] = column_names
+
+            # sstable format, see Table.SSTABLE_FORMATS
+            if 'sstable_format' in _type_fields:
+                sstable_format = _type_fields['sstable_format']
+
+                if sstable_format not in Table.SSTABLE_FORMATS:
+                    raise Exception('unsupported sstable format %r' % sstable_format)
+
+                type_fields['sstable_format'] = sstable_format
+
+            # block compression, see BlockSSTable.COMPRESSIONS
+            if 'compression' in _type_fields:
+                compression = _type_fields['compression']
+
+                if compression not in BlockSSTable.COMPRESSIONS:
+                    raise Exception('unsupported compression %r' % compression)
+
+                type_fields['compression'] = compression
+
+            # secondary indexes, each is column name, list of columns or
+            # dict with columns and included columns for covering index
+            if 'indexes' in _type_fields:
+                indexes = []
+
+                for index in _type_fields['indexes']:
+                    if isinstance(index, basestring):
+                        columns, include = [index], []
+                    elif isinstance(index, dict):
+                        columns = list(index['columns'])
+                        include = list(index.get('include', ()))
+                    else:
+                        columns, include = list(index), []
+
+                    for column_name in columns + include:
+                        if column_name not in type_fields:
+                            raise Exception('index column %r is not defined' % column_name)
+
+                        column = type_fields[column_name]
+
+                        if column.type == 'str' and column.size is None:
+                            raise Exception(
+                                'Index\'s column with type'
+                                '"str" must have fixed size'
+                            )
+
+                    indexes.append({'columns': columns, 'include': include})
+
+                type_fields['indexes'] = indexes
         else:
             type_fields = None
 
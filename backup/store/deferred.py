@@ -1,12 +1,73 @@
 __all__ = ['Deferred']
 
+import threading
+
+# guards lazy creation of events and callbacks of all deferreds
+_lock = threading.Lock()
+
 class Deferred(object):
+    '''
+    Deferred holds result of operation, set when transaction commits.
+    Other threads can wait for it or add callbacks called when it is set.
+    '''
+
     def __init__(self, value=None, query=None):
         self._value = value
         self._query = query
+        self._is_set = False
+        self._event = None
+        self._callbacks = None
 
     def set(self, value):
-        self._value = value
+        with _lock:
+            self._value = value
+            self._is_set = True
+            event = self._event
+            callbacks = self._callbacks
+            self._callbacks = None
+
+        if event is not None:
+            event.set()
+
+        for callback in callbacks or ():
+            callback(value)
 
     def get(self):
         return self._value
+
+    def is_set(self):
+        return self._is_set
+
+    def wait(self, timeout=None):
+        '''
+        Wait until value is set and return it.
+        '''
+        with _lock:
+            if self._is_set:
+                return self._value
+
+            if self._event is None:
+                self._event = threading.Event()
+
+            event = self._event
+
+        event.wait(timeout)
+
+        if not self._is_set:
+            raise Exception('timeout waiting for deferred value')
+
+        return self._value
+
+    def add_callback(self, callback):
+        '''
+        Call callback with value when it is set, or now if it is set.
+        '''
+        with _lock:
+            if not self._is_set:
+                if self._callbacks is None:
+                    self._callbacks = []
+
+                self._callbacks.append(callback)
+                return
+
+        callback(self._value)
@@ -0,0 +1,200 @@
+__all__ = ['Executor', 'Future', 'AsyncScan']
+
+import sys
+import Queue
+import itertools
+import threading
+
+class Future(object):
+    '''
+    Future holds result or exception of call submitted to Executor.
+    '''
+
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self._done = False
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done
+
+    def _wait(self, timeout):
+        with self.cond:
+            if not self._done:
+                self.cond.wait(timeout)
+
+            if not self._done:
+                raise Exception('timeout waiting for future result')
+
+    def result(self, timeout=None):
+        '''
+        Wait for call to finish, return its result or raise its exception.
+        '''
+        self._wait(timeout)
+
+        if self._exc_info is not None:
+            exc_type, exc_value, tb = self._exc_info
+            raise exc_type, exc_value, tb
+
+        return self._result
+
+    def exception(self, timeout=None):
+        self._wait(timeout)
+        return self._exc_info[1] if self._exc_info is not None else None
+
+    def add_done_callback(self, callback):
+        '''
+        Call callback with future when it is done, or now if it is done.
+        Callbacks run on executor's worker thread.
+        '''
+        with self.cond:
+            if not self._done:
+                self._callbacks.append(callback)
+                return
+
+        callback(self)
+
+    def _set(self, result, exc_info):
+        with self.cond:
+            self._result = result
+            self._exc_info = exc_info
+            self._done = True
+            self.cond.notify_all()
+            callbacks = self._callbacks
+            self._callbacks = []
+
+        for callback in callbacks:
+            callback(self)
+
+class Executor(object):
+    '''
+    Executor runs calls on bounded pool of worker threads, so callers,
+    e.g. event loops, are not blocked by sstable I/O, flushes or lock
+    waits. Queue of pending calls is bounded too, so submit blocks when
+    workers fall behind instead of queueing without limit.
+
+    Each call runs whole on one worker thread, so transactions, which
+    are bound to thread, can be used inside it.
+    '''
+
+    MAX_WORKERS = 4
+    MAX_QUEUE = 64
+
+    def __init__(self, max_workers=None, max_queue=None):
+        self.max_workers = max_workers or self.MAX_WORKERS
+        self.max_queue = max_queue or self.MAX_QUEUE
+        self.queue = Queue.Queue(self.max_queue)
+        self.threads = []
+        self.running = False
+
+        # counters
+        self.n_calls = 0
+        self.n_errors = 0
+
+    def start(self):
+        self.running = True
+
+        for i in range(self.max_workers):
+            thread = threading.Thread(target=self.run)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        '''
+        Stop workers after all submitted calls are done.
+        '''
+        self.running = False
+
+        for thread in self.threads:
+            self.queue.put(None)
+
+        for thread in self.threads:
+            thread.join()
+
+        self.threads = []
+
+    def submit(self, f, *args, **kwargs):
+        '''
+        Schedule call of f, returns its Future.
+        '''
+        if not self.running:
+            raise Exception('executor is not running')
+
+        future = Future()
+        self.queue.put((future, f, args, kwargs))
+        return future
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+
+            if item is None:
+                break
+
+            future, f, args, kwargs = item
+
+            try:
+                result = f(*args, **kwargs)
+            except Exception as e:
+                self.n_errors += 1
+                future._set(None, sys.exc_info())
+            else:
+                future._set(result, None)
+
+            self.n_calls += 1
+
+    def get_stats(self):
+        return {
+            'workers': self.max_workers,
+            'pending': self.queue.qsize(),
+            'calls': self.n_calls,
+            'errors': self.n_errors,
+        }
+
+class AsyncScan(object):
+    '''
+    Scan whose rows are read on executor in batches. Each next_batch
+    returns Future of list of next rows, empty list when scan is done.
+    '''
+
+    BATCH_SIZE = 1000
+
+    def __init__(self, executor, rows, batch_size=None):
+        self.executor = executor
+        self.rows = rows
+        self.batch_size = batch_size or self.BATCH_SIZE
+
+        # batches are read one at a time, in order of next_batch calls;
+        # calls are dequeued in order, so earlier batch is never waited for
+        # by worker while it is still queued
+        self.cond = threading.Condition(threading.Lock())
+        self.n_requested = 0
+        self.n_read = 0
+
+    def _read_batch(self, n):
+        with self.cond:
+            while self.n_read != n:
+                self.cond.wait()
+
+            try:
+                return list(itertools.islice(self.rows, self.batch_size))
+            finally:
+                self.n_read += 1
+                self.cond.notify_all()
+
+    def next_batch(self):
+        with self.cond:
+            n = self.n_requested
+            self.n_requested += 1
+
+        return self.executor.submit(self._read_batch, n)
+
+    def close(self):
+        '''
+        Stop scan early and unpin its sstables.
+        '''
+        with self.cond:
+            self.rows.close()
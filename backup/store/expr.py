@@ -1,4 +1,16 @@
-__all__ = ['Expr']
+__all__ = ['Expr', 'OPERATORS']
+
+import operator
+
+# comparison operators used in expressions
+OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
 
 class Expr(object):
     def __init__(self, left, op, right):
@@ -0,0 +1,137 @@
+__all__ = ['Flusher']
+
+import os
+import sys
+import time
+import threading
+from collections import deque
+
+class Flusher(object):
+    '''
+    Flusher writes tables' immutable memtables to sstables on background
+    thread, so committing transactions do not pay for sstable writes.
+
+    Failed flush is logged and recorded on table, so writers stalled
+    meanwhile get the error, and retried after delay which doubles on
+    each failure up to MAX_RETRY_DELAY.
+    '''
+
+    RETRY_DELAY = 0.1
+    MAX_RETRY_DELAY = 5.0
+
+    def __init__(self, store):
+        self.store = store
+        self.thread = None
+        self.cond = threading.Condition(threading.Lock())
+        self.queue = deque()
+        self.running = False
+
+        # table -> (time of next attempt, delay) of failed tables
+        self.retries = {}
+
+        # counters
+        self.n_flushes = 0
+        self.n_errors = 0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        '''
+        Stop thread after all scheduled tables are flushed, failed
+        flushes are attempted once more without delay.
+        '''
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def schedule(self, table):
+        with self.cond:
+            if table not in self.queue:
+                self.queue.append(table)
+
+            self.cond.notify_all()
+
+    def _pop_table(self):
+        '''
+        First queued table which is not waiting for retry.
+        '''
+        now = time.time()
+
+        for table in self.queue:
+            if not self.running or table not in self.retries or self.retries[table][0] <= now:
+                self.queue.remove(table)
+                return table
+
+        return None
+
+    def _get_timeout(self):
+        '''
+        Seconds until next retry, None if no table waits for retry.
+        '''
+        times = [self.retries[table][0] for table in self.queue if table in self.retries]
+
+        if not times:
+            return None
+
+        return max(min(times) - time.time(), 0)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while True:
+                    table = self._pop_table()
+
+                    if table is not None or not self.queue and not self.running:
+                        break
+
+                    self.cond.wait(self._get_timeout())
+
+                if table is None:
+                    break
+
+            try:
+                n = table.flush_immutable_memtables()
+            except Exception as e:
+                self._flush_failed(table, e, sys.exc_info())
+                continue
+
+            with self.cond:
+                self.n_flushes += n
+                self.retries.pop(table, None)
+
+            table._set_flush_error(None)
+
+    def _flush_failed(self, table, e, exc_info):
+        sys.stderr.write('flush of table %s.%s failed: %r\n' % (table.db.db_name, table.table_name, e))
+
+        with self.cond:
+            self.n_errors += 1
+
+            if table in self.retries:
+                delay = min(self.retries[table][1] * 2, self.MAX_RETRY_DELAY)
+            else:
+                delay = self.RETRY_DELAY
+
+            self.retries[table] = (time.time() + delay, delay)
+
+            if self.running and table not in self.queue:
+                self.queue.append(table)
+
+        table._set_flush_error(exc_info)
+
+    def get_stats(self):
+        with self.cond:
+            return {
+                'flushes': self.n_flushes,
+                'queued': len(self.queue),
+                'retries': len(self.retries),
+                'errors': self.n_errors,
+            }
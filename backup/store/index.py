@@ -3,22 +3,56 @@ __all__ = ['Index']
 import os
 import sys
 import mmap
+import bisect
 import struct
 
+try:
+    import numpy
+except ImportError as e:
+    numpy = None
+
 class Index(object):
-    def __init__(self, sstable, t, columns, path=None):
+    '''
+    Index keeps entries sorted by columns. Entry is packed values of
+    stored columns, which start with indexed columns, and position of
+    row in sstable.
+
+    Sortable packed keys of every Nth entry are loaded on first seek as
+    fence pointers, into NumPy array if available, and searched with
+    searchsorted. Only entries inside final fence interval are read
+    from file. Indexes with at most FENCE_MAX_KEYS entries keep all keys.
+    '''
+
+    FENCE_MAX_KEYS = 4096
+
+    def __init__(self, sstable, t, columns, stored_columns=None, path=None):
         self.sstable = sstable
         self.t = t
         self.columns = columns
+        self.stored_columns = stored_columns or columns
         self.mm = None
         self.f = None
 
+        # keys of columns which are not prefix of primary key are not
+        # written in order, so they are sorted on w_close
+        self.entries = None
+
+        # fence pointers, loaded on first seek
+        self.fences = None
+        self.fence_interval = None
+
+    def __len__(self):
+        return self.mm.size() // (8 + self._get_key_size())
+
     def get_path(self):
         table = self.sstable.table
         filename = 'index-%s-%s.data' % (self.t, '-'.join(self.columns))
         path = os.path.join(table.get_path(), filename)
         return path
 
+    def is_opened(self):
+        return self.mm is not None
+
     def open(self):
         '''
         Open file for reading.
@@ -28,200 +62,217 @@ class Index(object):
 
     def close(self):
         '''
-        Open file for reading.
+        Close file for reading.
         '''
         self.mm.close()
         self.f.close()
+        self.mm = None
+        self.f = None
+        self.fences = None
+        self.fence_interval = None
 
     def w_open(self):
         '''
         Open file for writing.
         '''
         self.f = open(self.get_path(), 'wb')
+        primary_key = tuple(self.sstable.table.schema.primary_key)
+
+        if tuple(self.columns) != primary_key[:len(self.columns)]:
+            self.entries = []
 
     def w_close(self):
         '''
         Close file for writing.
         '''
+        if self.entries is not None:
+            self.entries.sort()
+
+            for key, sstable_pos in self.entries:
+                self._write_entry(key, sstable_pos)
+
+            self.entries = None
+
         self.f.close()
 
+    def _get_codec(self):
+        return self.sstable.table.schema.get_key_codec(self.stored_columns)
+
     def _write_key(self, row, sstable_pos):
-        table = self.sstable.table
-        key_blob_items = []
-        
-        for c in self.columns:
-            t = table.schema[c]
-            b = t._get_column_packed(row[c])
-            key_blob_items.append(b)
-
-        key_blob = b''.join(key_blob_items) 
+        key = tuple(row[c] for c in self.stored_columns)
+
+        if self.entries is not None:
+            self.entries.append((key, sstable_pos))
+        else:
+            self._write_entry(key, sstable_pos)
+
+    def _write_entry(self, key, sstable_pos):
+        codec = self._get_codec()
+        key_blob = codec.pack(key)
         pos_blob = struct.pack('!Q', sstable_pos)
         self.f.write(key_blob)
         self.f.write(pos_blob)
 
     def _read_key(self, pos):
-        table = self.sstable.table
-        key = []
-        p = pos
-
-        for c in self.columns:
-            t = table.schema[c]
-            v, p = t._get_column_unpacked(self.mm, p)
-            key.append(v)
-
-        key = tuple(key)
+        codec = self._get_codec()
+        key, p = codec.unpack_from(self.mm, pos)
         sstable_pos, = struct.unpack_from('!Q', self.mm, p)
         return key, sstable_pos
 
-    def _get_key_size(self, key):
-        table = self.sstable.table
-        size = 0
+    def _get_key_size(self, key=None):
+        # indexed columns are fixed-width
+        return self._get_codec().size
 
-        for c in self.columns:
-            t = table.schema[c]
-            i = self.columns.index(c)
-            s = t._get_column_size(key[i])
-            size += s
+    def read_entry(self, i):
+        '''
+        Key and sstable position of i-th entry.
+        '''
+        return self._read_key(i * (8 + self._get_key_size()))
 
-        return size
+    def _load_fences(self):
+        '''
+        Keep sortable packed keys of every fence_interval-th entry in
+        memory. Small indexes keep all keys.
+        '''
+        codec = self._get_codec()
+        n = len(self)
+        interval = max(1, -(-n // self.FENCE_MAX_KEYS))
+        fences = [
+            codec.pack_sortable(self.read_entry(i)[0])
+            for i in range(0, n, interval)
+        ]
+
+        if numpy is not None:
+            size = codec.get_sortable_size()
+            fences = numpy.array(fences, dtype='S%i' % max(size, 1))
+
+        self.fence_interval = interval
+        self.fences = fences
+
+    def _search_fences(self, key, upper=False):
+        '''
+        Range of entries [low, high] which holds first entry whose key
+        prefix is >= key, or > key if upper.
+        '''
+        if self.fences is None:
+            self._load_fences()
 
-    def get_sstable_pos(self, key):
-        sstable = self.sstable
-        table = self.sstable.table
-        step = 8 + self._get_key_size(key) # !Q + KEY
+        codec = self._get_codec()
+        size = codec.get_sortable_size()
+        blob = codec.pack_sortable(key)
 
-        # binary search
-        low = 0
-        high = (self.mm.size() // step) - 1
-        key_pos = None
-        offset_pos = None
+        # NULL bytes pad to smallest key with this prefix, 0xff to largest
+        if upper:
+            blob = blob.ljust(size, b'\xff')
+            side = 'right'
+        else:
+            blob = blob.ljust(size, b'\0')
+            side = 'left'
 
-        while low <= high:
-            mid = (low + high) // 2
-            key_pos = mid * step
-            offset_pos = mid
-            cur_key, sstable_pos = self._read_key(key_pos)
-            # print 'cur_key:', cur_key
-
-            if cur_key > key:
-                high = mid - 1
-            elif cur_key < key:
-                low = mid + 1
-            else:
-                break
+        if numpy is not None:
+            j = int(numpy.searchsorted(self.fences, blob, side))
+        elif upper:
+            j = bisect.bisect_right(self.fences, blob)
         else:
-            sstable_pos = None
+            j = bisect.bisect_left(self.fences, blob)
 
-        return offset_pos, sstable_pos
+        # fence j - 1 is before entry and fence j is not
+        interval = self.fence_interval
 
-    def get_lt_sstable_pos(self, key):
-        sstable = self.sstable
-        table = self.sstable.table
-        step = 8 + self._get_key_size(key) # !Q + KEY
+        if interval == 1:
+            return j, j
 
-        # binary search
-        low = 0
-        high = (self.mm.size() // step) - 1
-        key_pos = None
+        low = (j - 1) * interval + 1 if j else 0
+        high = min(j * interval, len(self))
+        return low, high
+
+    def seek(self, key, upper=False):
+        '''
+        Number of first entry whose key prefix is >= key, or > key if upper.
+        '''
+        n = len(key)
+
+        try:
+            low, high = self._search_fences(key, upper)
+        except TypeError as e:
+            # values of other type than column are compared as python values
+            low, high = 0, len(self)
 
+        if __debug__:
+            n_probes = 0
+
+        # binary search inside fence interval
         while low < high:
+            if __debug__:
+                n_probes += 1
+
             mid = (low + high) // 2
-            key_pos = mid * step
-            cur_key, sstable_pos = self._read_key(key_pos)
-            # print 'left cur_key:', cur_key
-            
-            _key = tuple(x for x, y in zip(key, cur_key) if x != None)
-            _cur_key = tuple(y for x, y in zip(key, cur_key) if x != None)
-            
-            if _cur_key < _key:
+            cur_key, sstable_pos = self.read_entry(mid)
+            cur_key = cur_key[:n]
+
+            if cur_key < key or (upper and cur_key == key):
                 low = mid + 1
             else:
                 high = mid
-        
-        offset_pos = low - 1
-        _, sstable_pos = self._read_key(offset_pos * step)
-        return offset_pos, sstable_pos
 
-    def get_le_sstable_pos(self, key):
-        sstable = self.sstable
-        table = self.sstable.table
-        step = 8 + self._get_key_size(key) # !Q + KEY
+        if __debug__:
+            self.sstable.table.store.metrics.add('index.seek_probes', n_probes)
 
-        # binary search
-        low = 0
-        high = (self.mm.size() // step) - 1
-        key_pos = None
+        return low
+
+    def gallop(self, key, start=0):
+        '''
+        Number of first entry at or after start whose key is >= key.
+        Steps grow exponentially from start, so searching sorted keys
+        with monotonic cursor reads few entries when keys are close.
+        '''
+        n = len(self)
+        low = start
+        step = 1
+
+        while start + step <= n and self.read_entry(start + step - 1)[0] < key:
+            low = start + step
+            step *= 2
 
+        high = min(start + step - 1, n)
+
+        # binary search
         while low < high:
             mid = (low + high) // 2
-            key_pos = mid * step
-            cur_key, sstable_pos = self._read_key(key_pos)
-            # print 'left cur_key:', cur_key
-
-            _key = tuple(x for x, y in zip(key, cur_key) if x != None)
-            _cur_key = tuple(y for x, y in zip(key, cur_key) if x != None)
 
-            if _key < _cur_key:
-                high = mid
-            else:
+            if self.read_entry(mid)[0] < key:
                 low = mid + 1
-        
-        offset_pos = low - 1
-        _, sstable_pos = self._read_key(offset_pos * step)
-        return offset_pos, sstable_pos
+            else:
+                high = mid
 
-    def get_gt_sstable_pos(self, key):
-        sstable = self.sstable
-        table = self.sstable.table
-        step = 8 + self._get_key_size(key) # !Q + KEY
+        return low
 
-        # binary search
-        low = 0
-        high = (self.mm.size() // step) - 1
-        key_pos = None
+    def get_sstable_pos(self, key):
+        offset_pos = self.seek(key)
 
-        while low < high:
-            mid = (low + high) // 2
-            key_pos = mid * step
-            cur_key, sstable_pos = self._read_key(key_pos)
-            # print 'left cur_key:', cur_key
+        if offset_pos < len(self):
+            cur_key, sstable_pos = self.read_entry(offset_pos)
 
-            _key = tuple(x for x, y in zip(key, cur_key) if x != None)
-            _cur_key = tuple(y for x, y in zip(key, cur_key) if x != None)
+            if cur_key[:len(key)] == key:
+                return offset_pos, sstable_pos
 
-            if _key < _cur_key:
-                high = mid
-            else:
-                low = mid + 1
-        
-        offset_pos = low
-        _, sstable_pos = self._read_key(offset_pos * step)
+        return offset_pos, None
+
+    def _get_entry_at(self, offset_pos, key):
+        if offset_pos < 0 or offset_pos >= len(self):
+            raise KeyError(key)
+
+        cur_key, sstable_pos = self.read_entry(offset_pos)
         return offset_pos, sstable_pos
 
-    def get_ge_sstable_pos(self, key):
-        sstable = self.sstable
-        table = self.sstable.table
-        step = 8 + self._get_key_size(key) # !Q + KEY
+    def get_lt_sstable_pos(self, key):
+        return self._get_entry_at(self.seek(key) - 1, key)
 
-        # binary search
-        low = 0
-        high = (self.mm.size() // step) - 1
-        key_pos = None
+    def get_le_sstable_pos(self, key):
+        return self._get_entry_at(self.seek(key, upper=True) - 1, key)
 
-        while low < high:
-            mid = (low + high) // 2
-            key_pos = mid * step
-            cur_key, sstable_pos = self._read_key(key_pos)
-            # print 'left cur_key:', cur_key
-            
-            _key = tuple(x for x, y in zip(key, cur_key) if x != None)
-            _cur_key = tuple(y for x, y in zip(key, cur_key) if x != None)
-            
-            if _cur_key < _key:
-                low = mid + 1
-            else:
-                high = mid
-        
-        offset_pos = low
-        _, sstable_pos = self._read_key(offset_pos * step)
-        return offset_pos, sstable_pos
+    def get_gt_sstable_pos(self, key):
+        return self._get_entry_at(self.seek(key, upper=True), key)
+
+    def get_ge_sstable_pos(self, key):
+        return self._get_entry_at(self.seek(key), key)
@@ -0,0 +1,287 @@
+__all__ = ['LockManager', 'SharedLock', 'LockError', 'DeadlockError', 'LockTimeoutError']
+
+import time
+import threading
+from contextlib import contextmanager
+from collections import deque
+
+class LockError(Exception):
+    pass
+
+class DeadlockError(LockError):
+    pass
+
+class LockTimeoutError(LockError):
+    pass
+
+class LockState(object):
+    def __init__(self, lock):
+        # modes by owner
+        self.granted = {}
+
+        # (owner, mode) in order of requests
+        self.waiters = deque()
+        self.cond = threading.Condition(lock)
+
+class LockManager(object):
+    '''
+    LockManager grants locks on resources in modes IS, IX, S and X.
+    Tables are locked in intent modes and keys in S or X mode, so
+    transactions on different keys of same table do not block each other.
+
+    Requests are granted in order of arrival. Blocked owners wait on
+    condition of resource. Before waiting, graph of waiting owners is
+    checked for cycle, and if there is one, request fails with
+    DeadlockError. Waiting longer than timeout fails with
+    LockTimeoutError.
+    '''
+
+    IS = 'IS'
+    IX = 'IX'
+    S = 'S'
+    X = 'X'
+
+    COMPATIBLE = {
+        'IS': set(['IS', 'IX', 'S']),
+        'IX': set(['IS', 'IX']),
+        'S': set(['IS', 'S']),
+        'X': set(),
+    }
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.states = {}
+
+        # resources by owner
+        self.owned = {}
+
+        # resource which owner waits for
+        self.waiting = {}
+
+        # counters
+        self.n_acquires = 0
+        self.n_waits = 0
+        self.n_deadlocks = 0
+        self.n_timeouts = 0
+
+    def _combine(self, a, b):
+        '''
+        Weakest mode which covers both modes.
+        '''
+        if a is None or a == b:
+            return b
+
+        modes = set([a, b])
+
+        if modes <= set([self.IS, self.IX]):
+            return self.IX
+        elif modes <= set([self.IS, self.S]):
+            return self.S
+
+        return self.X
+
+    def _is_compatible(self, state, owner, mode):
+        for other, other_mode in state.granted.items():
+            if other is not owner and other_mode not in self.COMPATIBLE[mode]:
+                return False
+
+        return True
+
+    def _can_grant(self, state, owner, mode):
+        if not self._is_compatible(state, owner, mode):
+            return False
+
+        # earlier waiters go first, except for owners which already hold
+        # lock, so their upgrades do not wait behind requests they block
+        if owner in state.granted:
+            return True
+
+        for other, other_mode in state.waiters:
+            if other is owner:
+                return True
+
+            if other_mode not in self.COMPATIBLE[mode]:
+                return False
+
+        return True
+
+    def _get_blockers(self, owner):
+        resource, mode = self.waiting[owner]
+        state = self.states[resource]
+        blockers = set()
+
+        for other, other_mode in state.granted.items():
+            if other is not owner and other_mode not in self.COMPATIBLE[mode]:
+                blockers.add(other)
+
+        # upgrades do not wait for earlier waiters, see _can_grant
+        if owner in state.granted:
+            return blockers
+
+        for other, other_mode in state.waiters:
+            if other is owner:
+                break
+
+            if other_mode not in self.COMPATIBLE[mode]:
+                blockers.add(other)
+
+        return blockers
+
+    def _has_deadlock(self, owner):
+        '''
+        Owner waits, transitively, for itself.
+        '''
+        visited = set()
+        stack = list(self._get_blockers(owner))
+
+        while stack:
+            other = stack.pop()
+
+            if other is owner:
+                return True
+
+            if other in visited or other not in self.waiting:
+                continue
+
+            visited.add(other)
+            stack.extend(self._get_blockers(other))
+
+        return False
+
+    def acquire(self, owner, resource, mode, timeout=None):
+        '''
+        Lock resource in mode, waits until lock is granted.
+        '''
+        deadline = time.time() + timeout if timeout is not None else None
+
+        with self.lock:
+            state = self.states.get(resource)
+
+            if state is None:
+                state = LockState(self.lock)
+                self.states[resource] = state
+
+            mode = self._combine(state.granted.get(owner), mode)
+
+            if not self._can_grant(state, owner, mode):
+                self.n_waits += 1
+                state.waiters.append((owner, mode))
+                self.waiting[owner] = (resource, mode)
+
+                try:
+                    while not self._can_grant(state, owner, mode):
+                        if self._has_deadlock(owner):
+                            self.n_deadlocks += 1
+                            raise DeadlockError('deadlock on %r' % (resource,))
+
+                        if deadline is None:
+                            state.cond.wait()
+                        else:
+                            remaining = deadline - time.time()
+
+                            if remaining <= 0:
+                                self.n_timeouts += 1
+                                raise LockTimeoutError('timeout on %r' % (resource,))
+
+                            state.cond.wait(remaining)
+                except LockError as e:
+                    if not state.granted and len(state.waiters) == 1:
+                        del self.states[resource]
+
+                    raise
+                finally:
+                    state.waiters.remove((owner, mode))
+                    del self.waiting[owner]
+
+                    # requests behind this one may be granted now
+                    state.cond.notify_all()
+
+            state.granted[owner] = mode
+            self.owned.setdefault(owner, set()).add(resource)
+            self.n_acquires += 1
+
+    def acquire_all(self, owner, requests, timeout=None):
+        '''
+        Lock (resource, mode) requests in order of resources, which
+        avoids deadlocks between owners that lock only this way.
+        On error locks acquired so far are released.
+        '''
+        modes = {}
+
+        for resource, mode in requests:
+            modes[resource] = self._combine(modes.get(resource), mode)
+
+        try:
+            for resource in sorted(modes):
+                self.acquire(owner, resource, modes[resource], timeout)
+        except LockError as e:
+            self.release_all(owner)
+            raise
+
+    def release_all(self, owner):
+        with self.lock:
+            for resource in self.owned.pop(owner, ()):
+                state = self.states[resource]
+                del state.granted[owner]
+
+                if state.granted or state.waiters:
+                    state.cond.notify_all()
+                else:
+                    del self.states[resource]
+
+    def get_stats(self):
+        return {
+            'acquires': self.n_acquires,
+            'waits': self.n_waits,
+            'deadlocks': self.n_deadlocks,
+            'timeouts': self.n_timeouts,
+        }
+
+class SharedLock(object):
+    '''
+    SharedLock is held by many owners in shared mode or by one owner in
+    exclusive mode. Waiting exclusive owner blocks new shared owners.
+    '''
+
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.n_shared = 0
+        self.n_exclusive_waiting = 0
+        self.exclusive_owned = False
+
+    @contextmanager
+    def shared(self):
+        with self.cond:
+            while self.exclusive_owned or self.n_exclusive_waiting:
+                self.cond.wait()
+
+            self.n_shared += 1
+
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.n_shared -= 1
+
+                if not self.n_shared:
+                    self.cond.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        with self.cond:
+            self.n_exclusive_waiting += 1
+
+            try:
+                while self.exclusive_owned or self.n_shared:
+                    self.cond.wait()
+            finally:
+                self.n_exclusive_waiting -= 1
+
+            self.exclusive_owned = True
+
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.exclusive_owned = False
+                self.cond.notify_all()
@@ -0,0 +1,214 @@
+__all__ = ['Manifest']
+
+import os
+import sys
+import zlib
+import struct
+import marshal
+import threading
+
+class Manifest(object):
+    '''
+    Manifest is log of edits of table's set of sstables. Each edit has
+    sequence number and removes and adds sstables, so flush, bulk load
+    and compaction are published by one appended record. First record
+    of log is checkpoint with whole list of sstables.
+
+    CURRENT file names current log. When log has MAX_EDITS edits, new
+    log is started with checkpoint and CURRENT is replaced by rename.
+
+    Sstable files are synced before edit which adds them is written,
+    so files which are not in manifest are leftovers of interrupted
+    flush or compaction and are removed when table is opened.
+    '''
+
+    MAX_EDITS = 1000
+    SYNC = True
+
+    RECORD_HEADER_FORMAT = b'!II'
+    RECORD_HEADER_SIZE = struct.calcsize(RECORD_HEADER_FORMAT)
+
+    def __init__(self, table):
+        self.table = table
+        self.lock = threading.Lock()
+        self.f = None
+        self.number = None
+
+        # names of sstables from oldest to newest
+        self.sstables = []
+        self.seq = 0
+        self.n_edits = 0
+
+        # counters
+        self.n_checkpoints = 0
+
+    def get_current_path(self):
+        return os.path.join(self.table.get_path(), 'CURRENT')
+
+    def get_log_path(self, number):
+        filename = 'manifest-%020i.log' % number
+        return os.path.join(self.table.get_path(), filename)
+
+    def get_paths(self):
+        '''
+        Paths of CURRENT and current log.
+        '''
+        return [self.get_current_path(), self.get_log_path(self.number)]
+
+    def exists(self):
+        return os.path.exists(self.get_current_path())
+
+    def open(self):
+        '''
+        Replay current log, returns names of sstables from oldest to
+        newest.
+        '''
+        with open(self.get_current_path(), 'rb') as f:
+            filename = f.read().strip()
+
+        s = filename.index('manifest-') + len('manifest-')
+        e = filename.index('.log')
+        number = int(filename[s:e])
+        path = self.get_log_path(number)
+
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        pos = 0
+        sstables = None
+
+        while pos + self.RECORD_HEADER_SIZE <= len(data):
+            size, crc = struct.unpack_from(self.RECORD_HEADER_FORMAT, data, pos)
+            blob = data[pos + self.RECORD_HEADER_SIZE:pos + self.RECORD_HEADER_SIZE + size]
+
+            # torn write at the end of log, edit was not published
+            if len(blob) != size or zlib.crc32(blob) & 0xffffffff != crc:
+                break
+
+            record = marshal.loads(blob)
+
+            if 'sstables' in record:
+                sstables = list(record['sstables'])
+            elif sstables is None or record['seq'] != self.seq + 1:
+                raise Exception('corrupted manifest %r at seq %i' % (path, record['seq']))
+            else:
+                self._apply(sstables, record['remove'], record['add'])
+                self.n_edits += 1
+
+            self.seq = record['seq']
+            pos += self.RECORD_HEADER_SIZE + size
+
+        if sstables is None:
+            raise Exception('manifest %r has no checkpoint' % path)
+
+        self.sstables = sstables
+        self.number = number
+
+        # appended records must follow last valid record
+        self.f = open(path, 'r+b')
+        self.f.truncate(pos)
+        self.f.seek(pos)
+        return list(sstables)
+
+    def create(self, sstables):
+        '''
+        Start manifest of existing sstables, e.g. of table created before
+        manifests.
+        '''
+        with self.lock:
+            self.sstables = list(sstables)
+            self._checkpoint(0)
+
+    def close(self):
+        with self.lock:
+            if self.f is not None:
+                self.f.close()
+                self.f = None
+
+    def apply(self, removed, added):
+        '''
+        Remove and add sstables by one edit. Added sstables take place of
+        first removed sstable, or become newest if nothing is removed.
+        '''
+        for sst in added:
+            sst.sync()
+
+        with self.lock:
+            removed = [sst.t for sst in removed]
+            added = [sst.t for sst in added]
+            self.seq += 1
+            record = {'seq': self.seq, 'remove': removed, 'add': added}
+            self._write(self.f, record)
+            self._apply(self.sstables, removed, added)
+            self.n_edits += 1
+
+            if self.n_edits >= self.MAX_EDITS:
+                self._checkpoint(self.number + 1)
+
+    def _apply(self, sstables, removed, added):
+        if removed:
+            i = sstables.index(removed[0])
+            sstables[:] = [t for t in sstables if t not in removed]
+            sstables[i:i] = added
+        else:
+            sstables.extend(added)
+
+    def _write(self, f, record):
+        blob = marshal.dumps(record)
+        header = struct.pack(self.RECORD_HEADER_FORMAT, len(blob), zlib.crc32(blob) & 0xffffffff)
+        f.write(header + blob)
+        f.flush()
+
+        if self.SYNC:
+            os.fsync(f.fileno())
+
+    def _checkpoint(self, number):
+        '''
+        Start new log with all sstables and point CURRENT to it.
+        '''
+        f = open(self.get_log_path(number), 'wb')
+        self._write(f, {'seq': self.seq, 'sstables': list(self.sstables)})
+
+        # CURRENT is replaced at once
+        current_path = self.get_current_path()
+        tmp_path = current_path + '.tmp'
+
+        with open(tmp_path, 'wb') as tmp_f:
+            tmp_f.write(os.path.basename(self.get_log_path(number)) + '\n')
+            tmp_f.flush()
+
+            if self.SYNC:
+                os.fsync(tmp_f.fileno())
+
+        os.rename(tmp_path, current_path)
+
+        if self.SYNC:
+            self._sync_dir()
+
+        # previous log
+        if self.f is not None:
+            self.f.close()
+
+            if os.path.exists(self.get_log_path(self.number)):
+                os.remove(self.get_log_path(self.number))
+
+        self.f = f
+        self.number = number
+        self.n_edits = 0
+        self.n_checkpoints += 1
+
+    def _sync_dir(self):
+        fd = os.open(self.table.get_path(), os.O_RDONLY)
+
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def get_stats(self):
+        return {
+            'seq': self.seq,
+            'sstables': len(self.sstables),
+            'edits': self.n_edits,
+            'checkpoints': self.n_checkpoints,
+        }
@@ -1,88 +1,432 @@
-__all__ = ['MemTable']
+__all__ = ['MemTable', 'SkipListMemTable', 'MemTableView']
 
 import bisect
 
+from .skiplist import SkipList
+
 class MemTable(object):
+    '''
+    MemTable keeps rows sorted by primary key in list.
+
+    While store has live snapshots, sequence number of each set row is
+    kept, and replaced rows are kept as older versions of key as long
+    as some snapshot can see them. Rows without sequence number were set
+    before oldest live snapshot.
+    '''
+
+    # approximate per row overhead of python objects
+    ROW_OVERHEAD_SIZE = 64
+
     def __init__(self, table, *args, **kwargs):
         self.table = table
+        self.keys = []
         self.items = []
 
+        # oldest wal segment with rows of this memtable
+        self.wal_segment = None
+
+        # approximate size of rows in bytes
+        self.size = 0
+
+        # sequence numbers of rows set while snapshots are live
+        self.seqs = {}
+
+        # older (seq, row) versions by key, from newest to oldest
+        self.versions = {}
+
         for k, row in args:
-            self.items.append(k, row)
+            self.set(k, row)
 
         for k, row in kwargs.items():
-            self.items.append(k, row)
-
-        self.items.sort(key=lambda n: n[0])
+            self.set(k, row)
 
     def __len__(self):
         return len(self.items)
 
+    def __iter__(self):
+        return iter(self.items)
+
+    def _get_row_size(self, row):
+        size = self.ROW_OVERHEAD_SIZE
+
+        for v in row.values():
+            if isinstance(v, basestring):
+                size += len(v)
+            else:
+                size += 8
+
+        return size
+
+    def _is_primary_key(self, columns):
+        return not columns or tuple(columns) == tuple(self.table.schema.primary_key)
+
+    def _get_by_columns(self, op, key, columns):
+        '''
+        Memtable is sorted by primary key only, so other columns are scanned.
+        '''
+        found_key = None
+        found_row = None
+
+        for k, row in self:
+            cur_key = tuple(row[c] for c in columns)
+
+            if op == '==':
+                if cur_key == key:
+                    return row, None, None
+
+                continue
+            elif op == '<':
+                ok = cur_key < key and (found_key is None or cur_key > found_key)
+            elif op == '<=':
+                ok = cur_key <= key and (found_key is None or cur_key > found_key)
+            elif op == '>':
+                ok = cur_key > key and (found_key is None or cur_key < found_key)
+            elif op == '>=':
+                ok = cur_key >= key and (found_key is None or cur_key < found_key)
+
+            if ok:
+                found_key = cur_key
+                found_row = row
+
+        if found_row is None:
+            raise KeyError(key)
+
+        return found_row, None, None
+
     def get(self, key, columns=None):
-        pos = None
-        row = None
-
-        for i, (k, r) in enumerate(self.items):
-            if k == key:
-                pos = i
-                row = r
-                break
-        else:
-            raise KeyError
+        if not self._is_primary_key(columns):
+            return self._get_by_columns('==', key, columns)
+
+        pos = bisect.bisect_left(self.keys, key)
 
+        if pos == len(self.keys) or self.keys[pos] != key:
+            raise KeyError(key)
+
+        row = self.items[pos][1]
         return row, pos, pos
 
-    def set(self, key, row):
-        bisect.insort(self.items, (key, row))
+    def set(self, key, row, seq=0):
+        self._set_version(key, seq)
+        pos = bisect.bisect_left(self.keys, key)
+
+        if pos != len(self.keys) and self.keys[pos] == key:
+            self.size -= self._get_row_size(self.items[pos][1])
+            self.items[pos] = (key, row)
+        else:
+            self.keys.insert(pos, key)
+            self.items.insert(pos, (key, row))
+
+        self.size += self._get_row_size(row)
+
+    def _set_version(self, key, seq):
+        '''
+        Remember sequence number of row about to be set and keep row it
+        replaces while live snapshots can see it. Done before row is set,
+        so snapshot readers never see new row without its sequence number.
+        '''
+        oldest_seq = self.table.store.get_oldest_snapshot_seq()
+
+        if oldest_seq is None:
+            if self.seqs:
+                self.seqs.pop(key, None)
+                self.versions.pop(key, None)
+
+            return
+
+        try:
+            prev_row, op, sp = self.get(key)
+        except KeyError as e:
+            prev_row = None
+
+        if prev_row is not None:
+            versions = [(self.seqs.get(key, 0), prev_row)]
+            versions.extend(self.versions.get(key, ()))
+
+            # versions newer than oldest snapshot and newest one it sees
+            for i, (version_seq, version_row) in enumerate(versions):
+                if version_seq <= oldest_seq:
+                    del versions[i + 1:]
+                    break
+
+            self.versions[key] = versions
+
+        self.seqs[key] = seq
+
+    def get_version(self, key, row, seq):
+        '''
+        Newest version of row with key visible at sequence number seq,
+        None if key did not exist then.
+        '''
+        if self.seqs.get(key, 0) <= seq:
+            return row
+
+        for version_seq, version_row in self.versions.get(key, ()):
+            if version_seq <= seq:
+                return version_row
+
+        return None
+
+    def as_of(self, seq):
+        '''
+        Read-only view of rows visible at sequence number seq.
+        '''
+        return MemTableView(self, seq)
 
     def get_lt(self, key, columns=None):
-        keys = tuple(k for k, r in self.items)
-        memtable_pos = bisect.bisect_left(keys, key)
+        if not self._is_primary_key(columns):
+            return self._get_by_columns('<', key, columns)
+
+        memtable_pos = bisect.bisect_left(self.keys, key)
 
         if memtable_pos:
             row = self.items[memtable_pos - 1][1]
         else:
-            raise KeyError
+            raise KeyError(key)
 
-        return row, memtable_pos
+        return row, memtable_pos - 1, memtable_pos - 1
 
     def get_le(self, key, columns=None):
-        keys = tuple(k for k, r in self.items)
-        memtable_pos = bisect.bisect_right(keys, key)
+        if not self._is_primary_key(columns):
+            return self._get_by_columns('<=', key, columns)
+
+        memtable_pos = bisect.bisect_right(self.keys, key)
 
         if memtable_pos:
             row = self.items[memtable_pos - 1][1]
         else:
-            raise KeyError
+            raise KeyError(key)
 
-        return row, memtable_pos
+        return row, memtable_pos - 1, memtable_pos - 1
 
     def get_gt(self, key, columns=None):
-        keys = tuple(k for k, r in self.items)
-        memtable_pos = bisect.bisect_right(keys, key)
+        if not self._is_primary_key(columns):
+            return self._get_by_columns('>', key, columns)
 
-        if memtable_pos != len(keys):
+        memtable_pos = bisect.bisect_right(self.keys, key)
+
+        if memtable_pos != len(self.keys):
             row = self.items[memtable_pos][1]
         else:
-            raise KeyError
+            raise KeyError(key)
 
-        return row, memtable_pos
+        return row, memtable_pos, memtable_pos
 
     def get_ge(self, key, columns=None):
-        keys = tuple(k for k, r in self.items)
-        memtable_pos = bisect.bisect_left(keys, key)
+        if not self._is_primary_key(columns):
+            return self._get_by_columns('>=', key, columns)
+
+        memtable_pos = bisect.bisect_left(self.keys, key)
 
-        if memtable_pos != len(keys):
+        if memtable_pos != len(self.keys):
             row = self.items[memtable_pos][1]
         else:
-            raise KeyError
+            raise KeyError(key)
+
+        return row, memtable_pos, memtable_pos
+
+    def iter_range(self, start=None, end=None, reverse=False):
+        '''
+        (key, row) pairs with start <= key < end ordered by primary key.
+        Next key is searched again on each step, so rows set meanwhile
+        do not break iteration.
+        '''
+        keys = self.keys
+
+        if reverse:
+            pos = bisect.bisect_left(keys, end) - 1 if end is not None else len(keys) - 1
+
+            while pos >= 0:
+                key, row = self.items[pos]
+
+                if start is not None and key < start:
+                    break
+
+                yield key, row
+                pos = bisect.bisect_left(keys, key) - 1
+        else:
+            pos = bisect.bisect_left(keys, start) if start is not None else 0
+
+            while pos < len(keys):
+                key, row = self.items[pos]
 
-        return row, memtable_pos
+                if end is not None and key >= end:
+                    break
+
+                yield key, row
+                pos = bisect.bisect_right(keys, key)
 
     def get_sorted_rows(self, columns):
         '''
         sort by table's primary_key
         '''
-        rows = list(r for k, r in self.items)
-        rows.sort(key=lambda row: tuple(row[c] for c in columns))
+        rows = list(r for k, r in self)
+
+        if not self._is_primary_key(columns):
+            rows.sort(key=lambda row: tuple(row[c] for c in columns))
+
         return rows
+
+class SkipListMemTable(MemTable):
+    '''
+    MemTable keeps rows sorted by primary key in skiplist.
+    '''
+
+    def __init__(self, table, *args, **kwargs):
+        self.skiplist = SkipList()
+        MemTable.__init__(self, table, *args, **kwargs)
+
+    def __len__(self):
+        return len(self.skiplist)
+
+    def __iter__(self):
+        return iter(self.skiplist)
+
+    def get(self, key, columns=None):
+        if not self._is_primary_key(columns):
+            return self._get_by_columns('==', key, columns)
+
+        row = self.skiplist.get(key)
+        return row, None, None
+
+    def set(self, key, row, seq=0):
+        self._set_version(key, seq)
+        prev_row = self.skiplist.set(key, row)
+
+        if prev_row is not None:
+            self.size -= self._get_row_size(prev_row)
+
+        self.size += self._get_row_size(row)
+
+    def _get_node_row(self, node, key):
+        if node is None:
+            raise KeyError(key)
+
+        return node.value, None, None
+
+    def get_lt(self, key, columns=None):
+        if not self._is_primary_key(columns):
+            return self._get_by_columns('<', key, columns)
+
+        return self._get_node_row(self.skiplist.seek_lt(key), key)
+
+    def get_le(self, key, columns=None):
+        if not self._is_primary_key(columns):
+            return self._get_by_columns('<=', key, columns)
+
+        return self._get_node_row(self.skiplist.seek_le(key), key)
+
+    def get_gt(self, key, columns=None):
+        if not self._is_primary_key(columns):
+            return self._get_by_columns('>', key, columns)
+
+        return self._get_node_row(self.skiplist.seek_gt(key), key)
+
+    def get_ge(self, key, columns=None):
+        if not self._is_primary_key(columns):
+            return self._get_by_columns('>=', key, columns)
+
+        return self._get_node_row(self.skiplist.seek_ge(key), key)
+
+    def iter_range(self, start=None, end=None, reverse=False):
+        '''
+        (key, row) pairs with start <= key < end ordered by primary key.
+        '''
+        skiplist = self.skiplist
+
+        if reverse:
+            node = skiplist.seek_lt(end) if end is not None else skiplist.last()
+
+            while node is not None:
+                if start is not None and node.key < start:
+                    break
+
+                yield node.key, node.value
+                node = node.prev
+        else:
+            node = skiplist.seek_ge(start) if start is not None else skiplist.first()
+
+            while node is not None:
+                if end is not None and node.key >= end:
+                    break
+
+                yield node.key, node.value
+                node = node.next[0]
+
+class MemTableView(MemTable):
+    '''
+    MemTableView reads memtable as of sequence number. Rows set later
+    are skipped, or replaced by their older versions.
+    '''
+
+    def __init__(self, memtable, seq):
+        self.memtable = memtable
+        self.table = memtable.table
+        self.seq = seq
+
+    def __len__(self):
+        return sum(1 for item in self)
+
+    def __iter__(self):
+        return self.iter_range()
+
+    def set(self, key, row, seq=0):
+        raise Exception('memtable view is read-only')
+
+    def _first(self, items, key):
+        for k, row in items:
+            return row, None, None
+
+        raise KeyError(key)
+
+    def get(self, key, columns=None):
+        if not self._is_primary_key(columns):
+            return self._get_by_columns('==', key, columns)
+
+        row, op, sp = self.memtable.get(key)
+        row = self.memtable.get_version(key, row, self.seq)
+
+        if row is None:
+            raise KeyError(key)
+
+        return row, None, None
+
+    def get_lt(self, key, columns=None):
+        if not self._is_primary_key(columns):
+            return self._get_by_columns('<', key, columns)
+
+        return self._first(self.iter_range(None, key, reverse=True), key)
+
+    def get_le(self, key, columns=None):
+        if not self._is_primary_key(columns):
+            return self._get_by_columns('<=', key, columns)
+
+        try:
+            return self.get(key)
+        except KeyError as e:
+            return self.get_lt(key)
+
+    def get_gt(self, key, columns=None):
+        if not self._is_primary_key(columns):
+            return self._get_by_columns('>', key, columns)
+
+        items = ((k, row) for k, row in self.iter_range(key) if k != key)
+        return self._first(items, key)
+
+    def get_ge(self, key, columns=None):
+        if not self._is_primary_key(columns):
+            return self._get_by_columns('>=', key, columns)
+
+        return self._first(self.iter_range(key), key)
+
+    def iter_range(self, start=None, end=None, reverse=False):
+        '''
+        (key, row) pairs with start <= key < end ordered by primary key.
+        '''
+        memtable = self.memtable
+
+        for key, row in memtable.iter_range(start, end, reverse):
+            row = memtable.get_version(key, row, self.seq)
+
+            if row is not None:
+                yield key, row
+
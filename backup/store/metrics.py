@@ -0,0 +1,224 @@
+__all__ = ['Metrics', 'Histogram', 'MetricsDumper']
+
+import os
+import sys
+import json
+import time
+import threading
+from collections import defaultdict
+
+class Histogram(object):
+    '''
+    Histogram of non-negative values in buckets of powers of two, so it
+    has fixed size. Percentiles are upper bounds of their buckets,
+    capped by max value.
+    '''
+
+    __slots__ = ('buckets', 'count', 'total', 'min', 'max')
+
+    N_BUCKETS = 64
+
+    def __init__(self):
+        self.buckets = [0] * self.N_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        bucket = min(int(value).bit_length(), self.N_BUCKETS - 1)
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += value
+
+        if self.min is None or value < self.min:
+            self.min = value
+
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+
+        rank = self.count * p / 100.0
+        n = 0
+
+        for bucket, count in enumerate(self.buckets):
+            n += count
+
+            if n >= rank:
+                return min((1 << bucket) - 1, self.max) if bucket else 0
+
+        return self.max
+
+    def get_stats(self):
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'avg': float(self.total) / self.count if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'p999': self.percentile(99.9),
+        }
+
+    def merge(self, other):
+        for bucket, count in enumerate(other.buckets):
+            self.buckets[bucket] += count
+
+        self.count += other.count
+        self.total += other.total
+
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+class MetricsShard(object):
+    '''
+    Counters and histograms updated by one thread.
+    '''
+
+    __slots__ = ('counters', 'histograms')
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.histograms = defaultdict(Histogram)
+
+class Metrics(object):
+    '''
+    Store-wide counters and histograms. Latencies are in microseconds
+    and named with _us suffix.
+
+    Instrumented code calls metrics inside "if __debug__:" blocks, which
+    python -O compiles out, so metrics have no overhead then. Otherwise
+    they can be switched off at runtime by enabled, which leaves check
+    of flag on hot paths.
+
+    Each thread updates its own shard without locking, shards are
+    merged by get_stats. Lock guards only list of shards.
+    '''
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.shards = []
+        self.reset_time = time.time()
+
+    def _get_shard(self):
+        shard = getattr(self.local, 'shard', None)
+
+        if shard is None:
+            shard = MetricsShard()
+            self.local.shard = shard
+
+            with self.lock:
+                self.shards.append(shard)
+
+        return shard
+
+    def now(self):
+        '''
+        Start time for observe, None if metrics are disabled.
+        '''
+        return time.time() if self.enabled else None
+
+    def incr(self, name, n=1):
+        if not self.enabled:
+            return
+
+        self._get_shard().counters[name] += n
+
+    def add(self, name, value):
+        if not self.enabled:
+            return
+
+        self._get_shard().histograms[name].add(value)
+
+    def observe(self, name, t0):
+        '''
+        Add microseconds since t0 returned by now.
+        '''
+        if t0 is None:
+            return
+
+        self.add(name, (time.time() - t0) * 1e6)
+
+    def reset(self):
+        # threads start new shards, updates in flight may go to old ones
+        with self.lock:
+            self.local = threading.local()
+            self.shards = []
+            self.reset_time = time.time()
+
+    def get_stats(self):
+        counters = defaultdict(int)
+        histograms = defaultdict(Histogram)
+
+        with self.lock:
+            shards = list(self.shards)
+            reset_time = self.reset_time
+
+        for shard in shards:
+            # copies are atomic, owner thread may update shard meanwhile
+            for name, n in shard.counters.items():
+                counters[name] += n
+
+            for name, h in shard.histograms.items():
+                histograms[name].merge(h)
+
+        return {
+            'enabled': self.enabled,
+            'compiled': __debug__,
+            'seconds': time.time() - reset_time,
+            'counters': dict(counters),
+            'histograms': dict((k, h.get_stats()) for k, h in histograms.items()),
+        }
+
+class MetricsDumper(object):
+    '''
+    MetricsDumper appends store stats as json lines to file, or writes
+    them to stderr, every interval seconds on background thread.
+    '''
+
+    def __init__(self, store, interval, path=None):
+        self.store = store
+        self.interval = interval
+        self.path = path
+        self.thread = None
+        self.event = threading.Event()
+
+        # counters
+        self.n_dumps = 0
+
+    def start(self):
+        self.event.clear()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.event.set()
+
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while not self.event.wait(self.interval):
+            self.dump()
+
+    def dump(self):
+        line = json.dumps(self.store.stats(), sort_keys=True, default=repr)
+
+        if self.path:
+            with open(self.path, 'a') as f:
+                f.write(line + '\n')
+        else:
+            sys.stderr.write(line + '\n')
+
+        self.n_dumps += 1
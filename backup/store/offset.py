@@ -24,6 +24,9 @@ class Offset(object):
         path = os.path.join(self.sstable.table.get_path(), filename)
         return path
 
+    def is_opened(self):
+        return self.mm is not None
+
     def open(self):
         '''
         Open file for reading.
@@ -33,10 +36,12 @@ class Offset(object):
 
     def close(self):
         '''
-        Open file for reading.
+        Close file for reading.
         '''
         self.mm.close()
         self.f.close()
+        self.mm = None
+        self.f = None
 
     def w_open(self):
         '''
@@ -0,0 +1,251 @@
+__all__ = ['ParallelScanner']
+
+import os
+import sys
+import marshal
+import multiprocessing
+
+from .expr import OPERATORS
+
+# store opened in worker process, see _init_worker
+_worker_store = None
+_worker_tables = {}
+
+def _init_worker(data_path):
+    global _worker_store
+    from .store import Store
+
+    # sstables are only read, so no background threads, wal or cache
+    _worker_store = Store(data_path, compaction=False, flush=False, wal=False, cache_size=None)
+    _worker_store.open()
+
+def _get_worker_table(db_name, table_name):
+    from .database import Database
+    from .table import Table
+
+    key = (db_name, table_name)
+    table = _worker_tables.get(key)
+
+    if table is None:
+        db = Database(_worker_store, db_name)
+        table = Table(db, table_name, readonly=True)
+        _worker_tables[key] = table
+
+    return table
+
+def _compile_expr(expr):
+    '''
+    Where clause as nested tuples, which can be sent to workers.
+    '''
+    if expr is None:
+        return None
+
+    if expr.op in ('and', 'or'):
+        return (expr.op, _compile_expr(expr.left), _compile_expr(expr.right))
+
+    return (expr.op, expr.left.name, expr.right)
+
+def _match(expr, row):
+    if expr is None:
+        return True
+
+    op, left, right = expr
+
+    if op == 'and':
+        return _match(left, row) and _match(right, row)
+    elif op == 'or':
+        return _match(left, row) or _match(right, row)
+
+    value = row[left]
+
+    # NULL never satisfies comparison
+    if value is None or right is None:
+        return False
+
+    return OPERATORS[op](value, right)
+
+def _is_past(key, prefix, high):
+    '''
+    Key is after all keys with prefix and range (value, inclusive) of
+    next column.
+    '''
+    n = len(prefix)
+
+    if key[:n] != prefix:
+        return True
+
+    if high is None or key[n] is None:
+        return False
+
+    value, inclusive = high
+    return key[n] > value or (key[n] == value and not inclusive)
+
+def _scan_part(rows, prefix, high, where, columns):
+    '''
+    (key, values) pairs of rows, values is None for rows which do not
+    match where clause.
+    '''
+    for key, row in rows:
+        if _is_past(key, prefix, high):
+            break
+
+        if _match(where, row):
+            yield key, tuple(row[c] for c in columns)
+        else:
+            yield key, None
+
+def _scan_sstable(sst, start, end, prefix, high, where, columns):
+    items = _scan_part(sst.iter_range(start, end), prefix, high, where, columns)
+    return marshal.dumps(list(items))
+
+def _scan_sstable_in_worker(args):
+    db_name, table_name, t, start, end, prefix, high, where, columns = args
+    table = _get_worker_table(db_name, table_name)
+    sst = table.sstable_class(table, t)
+    sst.open()
+
+    try:
+        return _scan_sstable(sst, start, end, prefix, high, where, columns)
+    finally:
+        sst.close()
+
+class ParallelScanner(object):
+    '''
+    ParallelScanner runs primary key range scans on process pool.
+
+    Range is split into partitions by keys sampled from largest sstable,
+    and each sstable of each partition is scanned by worker process,
+    which opens sstable files by path. Workers filter rows by where
+    clause and send back marshalled (key, values) pairs, with None
+    values for rows which do not match, so they still shadow older
+    versions. Parent merges results of each partition with memtables
+    in key order, newest version of key wins.
+
+    Sstables removed by compaction meanwhile are unlinked, so their parts
+    are scanned in parent, which keeps them pinned.
+    '''
+
+    # smaller scans are not worth sending to workers
+    MIN_SIZE = 1024 * 1024
+
+    def __init__(self, store, processes):
+        self.store = store
+        self.processes = processes
+        self.pool = None
+
+        # counters
+        self.n_scans = 0
+        self.n_tasks = 0
+        self.n_local_tasks = 0
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def _get_pool(self):
+        if self.pool is None:
+            data_path = self.store.get_path()
+            self.pool = multiprocessing.Pool(self.processes, _init_worker, (data_path,))
+
+        return self.pool
+
+    def is_worth(self, sstables):
+        return sum(sst.get_size() for sst in sstables) >= self.MIN_SIZE
+
+    def _get_partitions(self, sstables, start, end):
+        largest = max(sstables, key=lambda sst: sst.get_size())
+        bounds = [start]
+
+        for key in largest.get_split_keys(self.processes):
+            if (start is None or key > start) and (end is None or key < end):
+                bounds.append(key)
+
+        bounds.append(end)
+        return zip(bounds[:-1], bounds[1:])
+
+    def _overlaps(self, sst, start, end):
+        key_range = sst.get_key_range()
+
+        if key_range is None:
+            return False
+
+        first_key, last_key = key_range
+
+        if start is not None and last_key < start:
+            return False
+
+        if end is not None and first_key >= end:
+            return False
+
+        return True
+
+    def scan(self, table, memtables, sstables, start=None, end=None,
+             prefix=(), high=None, where_clause=None, columns=None):
+        '''
+        Rows with primary key in [start, end), up to first key past
+        prefix and high bound, which match where clause, as dicts of
+        columns ordered by primary key. Memtables and sstables are
+        ordered from newest to oldest and sstables are pinned.
+        '''
+        from .table import Table
+
+        if columns is None:
+            columns = [c for c, t in table.schema]
+
+        columns = list(columns)
+        where = _compile_expr(where_clause)
+        pool = self._get_pool()
+        partitions = self._get_partitions(sstables, start, end)
+        self.n_scans += 1
+
+        # send all tasks first, so workers run while parent waits
+        tasks = []
+
+        for lo, hi in partitions:
+            for sst in sstables:
+                if not self._overlaps(sst, lo, hi):
+                    continue
+
+                args = (table.db.db_name, table.table_name, sst.t, lo, hi, prefix, high, where, columns)
+                result = pool.apply_async(_scan_sstable_in_worker, (args,))
+                tasks.append((lo, hi, sst, result))
+                self.n_tasks += 1
+
+        results = {}
+
+        for lo, hi, sst, result in tasks:
+            try:
+                blob = result.get()
+            except (IOError, OSError) as e:
+                # sstable was removed by compaction, parent keeps it open
+                self.n_local_tasks += 1
+                blob = _scan_sstable(sst, lo, hi, prefix, high, where, columns)
+
+            results.setdefault(lo, []).append(marshal.loads(blob))
+
+        rows = []
+
+        for lo, hi in partitions:
+            # cursors ordered from newest to oldest
+            cursors = [
+                _scan_part(m.iter_range(lo, hi), prefix, high, where, columns)
+                for m in memtables
+            ]
+
+            cursors.extend(iter(items) for items in results.get(lo, ()))
+
+            for values in Table._merge_cursors(cursors):
+                if values is not None:
+                    rows.append(dict(zip(columns, values)))
+
+        return rows
+
+    def get_stats(self):
+        return {
+            'processes': self.processes,
+            'scans': self.n_scans,
+            'tasks': self.n_tasks,
+            'local_tasks': self.n_local_tasks,
+        }
@@ -0,0 +1,490 @@
+__all__ = ['Planner', 'Range']
+
+from .column import Column
+from .expr import Expr, OPERATORS
+from .memtable import MemTable
+from .columnar import ColumnarSSTable
+
+class Range(object):
+    '''
+    Range of values of column built from predicates joined by 'and'.
+    '''
+
+    def __init__(self):
+        self.low = None
+        self.low_inclusive = True
+        self.high = None
+        self.high_inclusive = True
+        self.empty = False
+
+    def __repr__(self):
+        return '<%s %s%r, %r%s>' % (
+            self.__class__.__name__,
+            '[' if self.low_inclusive else '(',
+            self.low,
+            self.high,
+            ']' if self.high_inclusive else ')',
+        )
+
+    def add(self, op, value):
+        # NULL never satisfies comparison
+        if value is None:
+            self.empty = True
+            return
+
+        if op == '==':
+            self._set_low(value, True)
+            self._set_high(value, True)
+        elif op in ('>', '>='):
+            self._set_low(value, op == '>=')
+        elif op in ('<', '<='):
+            self._set_high(value, op == '<=')
+
+        if self.low is not None and self.high is not None:
+            if self.low > self.high:
+                self.empty = True
+            elif self.low == self.high and not (self.low_inclusive and self.high_inclusive):
+                self.empty = True
+
+    def _set_low(self, value, inclusive):
+        if self.low is None or value > self.low or (value == self.low and not inclusive):
+            self.low = value
+            self.low_inclusive = inclusive
+
+    def _set_high(self, value, inclusive):
+        if self.high is None or value < self.high or (value == self.high and not inclusive):
+            self.high = value
+            self.high_inclusive = inclusive
+
+    def is_eq(self):
+        return self.low is not None and self.low == self.high
+
+    def is_bounded(self):
+        return self.low is not None or self.high is not None
+
+    def is_above(self, value):
+        '''
+        Value is after end of range.
+        '''
+        if self.high is None:
+            return False
+
+        return value > self.high or (value == self.high and not self.high_inclusive)
+
+class Planner(object):
+    '''
+    Planner turns where clause of query into ranges of columns and picks
+    access path: primary key range scan or seek on per-column or
+    secondary index of sstables. Rows found by access path are filtered
+    by whole where clause and projected to selected columns.
+
+    If index stores all columns used by query, rows are built from index
+    entries only (index-only scan). Memtables are sorted by primary key
+    only, so they are seeked when index columns are prefix of primary
+    key and scanned otherwise. When memtables have more than
+    MAX_MEMTABLE_SCAN_ROWS rows, usable primary key range is preferred
+    to such scan. If snapshot is given, query reads memtables and
+    sstables as of snapshot.
+
+    Large primary key scans run on store's process pool, if enabled,
+    see ParallelScanner. Otherwise sstables and blocks whose zone maps
+    can not satisfy where clause are not read, see Stats, and predicates
+    on fixed-width columns of columnar sstables are evaluated vectorized
+    over whole columns, see ColumnarSSTable.iter_where.
+    '''
+
+    MAX_MEMTABLE_SCAN_ROWS = 10000
+
+    def __init__(self, table, query, snapshot=None):
+        self.table = table
+        self.query = query
+        self.snapshot = snapshot
+        self.n_pruned = 0
+        self.primary_key = tuple(table.schema.primary_key)
+        self.ranges = self._get_ranges(query.where_clause)
+
+    def _get_predicates(self, expr):
+        '''
+        Flatten conjunction into (column, op, value) predicates.
+        Returns None if expression can not be flattened.
+        '''
+        if expr is None:
+            return []
+
+        if expr.op == 'and':
+            left = self._get_predicates(expr.left)
+            right = self._get_predicates(expr.right)
+
+            if left is None or right is None:
+                return None
+
+            return left + right
+
+        if isinstance(expr.left, Column) and not isinstance(expr.right, (Column, Expr)):
+            return [(expr.left.name, expr.op, expr.right)]
+
+        return None
+
+    def _get_ranges(self, expr):
+        '''
+        Ranges by column name, None if where clause has no usable ranges.
+        '''
+        predicates = self._get_predicates(expr)
+
+        if predicates is None:
+            return None
+
+        ranges = {}
+
+        for c, op, v in predicates:
+            if op not in ('==', '<', '<=', '>', '>='):
+                continue
+
+            if c not in ranges:
+                ranges[c] = Range()
+
+            ranges[c].add(op, v)
+
+        return ranges
+
+    def _get_access(self, columns):
+        '''
+        Equal values of leading columns and range of next column, if any.
+        '''
+        prefix = ()
+        r = None
+
+        for c in columns:
+            r = self.ranges.get(c) if self.ranges else None
+
+            if r is None or not r.is_eq():
+                break
+
+            prefix += (r.low,)
+            r = None
+
+        if r is not None and not r.is_bounded():
+            r = None
+
+        return prefix, r
+
+    def _get_score(self, columns):
+        prefix, r = self._get_access(columns)
+        return len(prefix), 1 if r is not None else 0
+
+    def _is_primary_key_prefix(self, columns):
+        return self.primary_key[:len(columns)] == tuple(columns)
+
+    def get_plan(self, sstables, memtables=()):
+        '''
+        Columns of chosen access path: primary key or index columns.
+        '''
+        columns = self.primary_key
+        score = self._get_score(columns)
+
+        if not sstables:
+            return columns
+
+        # index path scans memtables whole unless index columns are
+        # prefix of primary key, primary key path seeks them
+        seek_memtables = score > (0, 0) and sum(len(m) for m in memtables) > self.MAX_MEMTABLE_SCAN_ROWS
+
+        # only indexes present in all sstables are used
+        indexed_columns = set(sstables[0].indexes)
+
+        for sst in sstables[1:]:
+            indexed_columns &= set(sst.indexes)
+
+        for index_columns in sorted(indexed_columns):
+            if seek_memtables and not self._is_primary_key_prefix(index_columns):
+                continue
+
+            index_score = self._get_score(index_columns)
+
+            if index_score > score:
+                columns = index_columns
+                score = index_score
+
+        return columns
+
+    def _get_start(self, prefix, r):
+        if r is not None and r.low is not None:
+            return prefix + (r.low,)
+
+        return prefix or None
+
+    def _is_past(self, key, prefix, r):
+        '''
+        Key ordered by access path columns is after all matching keys.
+        '''
+        n = len(prefix)
+
+        if key[:n] != prefix:
+            return True
+
+        return r is not None and key[n] is not None and r.is_above(key[n])
+
+    def _match(self, expr, row):
+        if expr is None:
+            return True
+
+        if expr.op == 'and':
+            return self._match(expr.left, row) and self._match(expr.right, row)
+        elif expr.op == 'or':
+            return self._match(expr.left, row) or self._match(expr.right, row)
+
+        value = row[expr.left.name]
+
+        if value is None or expr.right is None:
+            return False
+
+        return OPERATORS[expr.op](value, expr.right)
+
+    def _get_selected_columns(self):
+        select_clauses = self.query.select_clauses
+
+        if not select_clauses:
+            return [c for c, t in self.table.schema]
+
+        return [c.name if isinstance(c, Column) else c for c in select_clauses]
+
+    def _get_expr_columns(self, expr):
+        if expr is None:
+            return set()
+
+        if expr.op in ('and', 'or'):
+            return self._get_expr_columns(expr.left) | self._get_expr_columns(expr.right)
+
+        return set([expr.left.name])
+
+    def is_covering(self, stored_columns):
+        '''
+        Index stores all columns used by query.
+        '''
+        columns = set(self._get_selected_columns())
+        columns |= self._get_expr_columns(self.query.where_clause)
+        return columns <= set(stored_columns)
+
+    def _project(self, row):
+        if not self.query.select_clauses:
+            return row
+
+        return dict((c, row[c]) for c in self._get_selected_columns())
+
+    def _prune(self, sstables):
+        '''
+        Sstables whose zone maps can not satisfy where clause.
+        '''
+        where_clause = self.query.where_clause
+
+        if where_clause is None:
+            return set()
+
+        pruned = set(sst for sst in sstables if not sst.stats.may_match(where_clause))
+        self.n_pruned += len(pruned)
+        self.table.n_pruned_sstables += len(pruned)
+        return pruned
+
+    def _get_block_filter(self, sst):
+        where_clause = self.query.where_clause
+        stats = sst.stats
+
+        def block_filter(block_no):
+            if stats.block_may_match(block_no, where_clause):
+                return True
+
+            self.table.n_pruned_blocks += 1
+            return False
+
+        return block_filter
+
+    def _get_column_predicates(self, sst):
+        '''
+        Predicates of where clause which columnar sstable can evaluate
+        vectorized.
+        '''
+        if not isinstance(sst, ColumnarSSTable):
+            return []
+
+        predicates = self._get_predicates(self.query.where_clause) or []
+        return [p for p in predicates if sst.can_scan_column(*p)]
+
+    @staticmethod
+    def _rank_cursor(i, cursor):
+        for key, row in cursor:
+            yield key, (i, row)
+
+    def _scan_primary_key(self, memtables, sstables):
+        '''
+        Merge of cursors over memtables and sstables. Pruned sstables and
+        blocks are not read, but their rows still shadow older versions,
+        so matching rows of older cursors are checked against them.
+        '''
+        prefix, r = self._get_access(self.primary_key)
+        start = self._get_start(prefix, r)
+        where_clause = self.query.where_clause
+        pruned = self._prune(sstables)
+        cursors = []
+
+        # (rank, sstable) of sstables whose rows are not all read
+        shadowing = []
+
+        for rank, s in enumerate(memtables + sstables):
+            if s in pruned:
+                shadowing.append((rank, s))
+                continue
+
+            predicates = self._get_column_predicates(s)
+
+            if predicates:
+                shadowing.append((rank, s))
+                cursor = s.iter_where(start, predicates)
+            elif where_clause is not None and not isinstance(s, MemTable) and s.stats.has_blocks():
+                shadowing.append((rank, s))
+                cursor = s.iter_range(start, block_filter=self._get_block_filter(s))
+            else:
+                cursor = s.iter_range(start)
+
+            cursors.append(cursor)
+
+        ranked_cursors = [self._rank_cursor(i, cursor) for i, cursor in enumerate(cursors)]
+
+        # ranks of cursors are not ranks of structures when some are pruned
+        ranks = [rank for rank, s in enumerate(memtables + sstables) if s not in pruned]
+
+        try:
+            for i, row in self.table._merge_cursors(ranked_cursors):
+                key = tuple(row[c] for c in self.primary_key)
+
+                if self._is_past(key, prefix, r):
+                    break
+
+                if not self._match(where_clause, row):
+                    continue
+
+                newer = [s for rank, s in shadowing if rank < ranks[i]]
+
+                if newer and self._is_shadowed(key, newer):
+                    continue
+
+                yield row
+        finally:
+            for cursor in cursors:
+                cursor.close()
+
+    def _scan_primary_key_parallel(self, scanner, memtables, sstables):
+        prefix, r = self._get_access(self.primary_key)
+        start = self._get_start(prefix, r)
+        high = (r.high, r.high_inclusive) if r is not None and r.high is not None else None
+
+        return scanner.scan(
+            self.table,
+            memtables,
+            sstables,
+            start,
+            None,
+            prefix,
+            high,
+            self.query.where_clause,
+            self._get_selected_columns(),
+        )
+
+    def _is_shadowed(self, key, structures):
+        '''
+        Newer memtable or sstable has other version of row.
+        '''
+        for s in structures:
+            try:
+                s.get(key)
+            except KeyError as e:
+                continue
+
+            return True
+
+        return False
+
+    def _seek_index(self, columns, memtables, sstables):
+        prefix, r = self._get_access(columns)
+        start = self._get_start(prefix, r)
+        where_clause = self.query.where_clause
+        structures = memtables + sstables
+        seen = set()
+        found = []
+
+        pruned = self._prune(sstables)
+
+        for i, s in enumerate(structures):
+            if s in pruned:
+                # no row matches, but newer rows are still checked against it
+                continue
+            elif isinstance(s, MemTable):
+                candidates = self._iter_memtable(s, columns, start, prefix, r)
+            else:
+                candidates = self._iter_index(s, columns, start, prefix, r)
+
+            for row in candidates:
+                key = tuple(row[c] for c in self.primary_key)
+
+                if key in seen or not self._match(where_clause, row):
+                    continue
+
+                # newer matching version is already found, other is stale
+                if self._is_shadowed(key, structures[:i]):
+                    continue
+
+                seen.add(key)
+                found.append((key, row))
+
+        found.sort(key=lambda item: item[0])
+        return [row for key, row in found]
+
+    def _iter_memtable(self, memtable, columns, start, prefix, r):
+        '''
+        Rows of memtable, only those in range of access path if index
+        columns are prefix of primary key, else all.
+        '''
+        if not self._is_primary_key_prefix(columns):
+            for key, row in memtable.iter_range():
+                yield row
+
+            return
+
+        for key, row in memtable.iter_range(start):
+            if self._is_past(key, prefix, r):
+                break
+
+            yield row
+
+    def _iter_index(self, sst, columns, start, prefix, r):
+        covering = self.is_covering(sst.indexes[columns].stored_columns)
+        entries = sst.iter_index(columns, start, covering)
+
+        try:
+            for key, row in entries:
+                if self._is_past(key, prefix, r):
+                    break
+
+                yield row
+        finally:
+            entries.close()
+
+    def execute(self):
+        '''
+        Rows matching where clause ordered by primary key.
+        '''
+        # contradicting predicates
+        if self.ranges and any(r.empty for r in self.ranges.values()):
+            return []
+
+        with self.table.structures(self.snapshot) as (memtables, sstables):
+            columns = self.get_plan(sstables, memtables)
+            scanner = self.table.store.get_parallel_scanner()
+
+            if columns == self.primary_key and scanner is not None and scanner.is_worth(sstables):
+                rows = self._scan_primary_key_parallel(scanner, memtables, sstables)
+            elif columns == self.primary_key:
+                rows = list(self._scan_primary_key(memtables, sstables))
+            else:
+                rows = self._seek_index(columns, memtables, sstables)
+
+        return [self._project(row) for row in rows]
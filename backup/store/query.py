@@ -4,11 +4,12 @@ from .deferred import Deferred
 from .expr import Expr
 
 class Query(object):
-    def __init__(self, store, d):
+    def __init__(self, store, d=None):
         self.store = store
         self.d = d
         self.select_clauses = []
         self.where_clause = None
+        self.group_by_clauses = []
 
     def select(self, *args):
         for select_clause in args:
@@ -29,6 +30,16 @@ class Query(object):
         self.where_clause = last_expr
         return self
 
+    def group_by(self, *args):
+        for group_by_clause in args:
+            self.group_by_clauses.append(group_by_clause)
+
+        return self
+
+    def is_aggregate(self):
+        from .aggregate import Aggregate
+        return any(isinstance(c, Aggregate) for c in self.select_clauses)
+
     def one(self):
         return self.d
 
@@ -6,8 +6,12 @@ import yaml
 from collections import OrderedDict
 
 from .column import Column
+from .codec import RowCodec
 
 class Schema(object):
+    # table options stored together with columns
+    OPTIONS = ('primary_key', 'sstable_format', 'compression', 'indexes')
+
     def __init__(self, table, type_fields=None):
         self.table = table
         
@@ -20,7 +24,7 @@ class Schema(object):
             _type_fields = {}
 
             for c, t in type_fields.items():
-                if c == 'primary_key':
+                if c in self.OPTIONS:
                     _type_fields[c] = t
                 else:
                     _type_fields[c] = dict(t)
@@ -38,11 +42,13 @@ class Schema(object):
             type_fields = OrderedDict(
                 (c, Column(**t))
                 for c, t in sorted(_type_fields.items(), key=lambda n: n[0])
-                if c != 'primary_key'
+                if c not in self.OPTIONS
             )
 
-            # add primary_key at the end of dict
-            type_fields['primary_key'] = _type_fields['primary_key']
+            # add primary_key and other options at the end of dict
+            for c in self.OPTIONS:
+                if c in _type_fields:
+                    type_fields[c] = _type_fields[c]
         elif type_fields and os.path.exists(schema_path):
             # FIXME: compare given type_fields with schema's type_fields
             pass
@@ -51,6 +57,10 @@ class Schema(object):
 
         self.type_fields = type_fields
 
+        # compiled codecs
+        self.row_codec = RowCodec(t for c, t in self)
+        self.key_codecs = {}
+
     def __getitem__(self, key):
         return self.type_fields[key]
 
@@ -62,10 +72,44 @@ class Schema(object):
 
     def __iter__(self):
         for k, v in self.type_fields.items():
-            if k == 'primary_key':
+            if k in self.OPTIONS:
                 continue
 
             yield k, v
 
+    def get_option(self, name, default=None):
+        return self.type_fields.get(name, default)
+
+    def get_indexes(self):
+        '''
+        Secondary indexes as (columns, stored columns). Stored columns are
+        indexed columns followed by primary key and included columns.
+        '''
+        primary_key = list(self.type_fields['primary_key'])
+        indexes = []
+
+        for index in self.get_option('indexes', ()):
+            columns = tuple(index['columns'])
+            stored_columns = list(columns)
+
+            for c in primary_key + list(index.get('include', ())):
+                if c not in stored_columns:
+                    stored_columns.append(c)
+
+            indexes.append((columns, tuple(stored_columns)))
+
+        return indexes
+
+    def get_key_codec(self, columns):
+        columns = tuple(columns)
+
+        try:
+            codec = self.key_codecs[columns]
+        except KeyError as e:
+            codec = RowCodec(self.type_fields[c] for c in columns)
+            self.key_codecs[columns] = codec
+
+        return codec
+
     def get_path(self):
         return os.path.join(self.table.get_path(), 'schema.yaml')
@@ -0,0 +1,159 @@
+__all__ = ['SkipList']
+
+import random
+
+class SkipListNode(object):
+    __slots__ = ('key', 'value', 'next', 'prev')
+
+    def __init__(self, key, value, level):
+        self.key = key
+        self.value = value
+        self.next = [None] * level
+        self.prev = None
+
+class SkipList(object):
+    '''
+    Ordered map with O(log n) insert, lookup and seek.
+
+    Level 0 is doubly linked, so it can be iterated in both directions.
+    '''
+
+    MAX_LEVEL = 32
+    P = 0.25
+
+    def __init__(self):
+        self.head = SkipListNode(None, None, self.MAX_LEVEL)
+        self.level = 1
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        node = self.head.next[0]
+
+        while node is not None:
+            yield node.key, node.value
+            node = node.next[0]
+
+    def __contains__(self, key):
+        node = self.seek_ge(key)
+        return node is not None and node.key == key
+
+    def _random_level(self):
+        level = 1
+
+        while level < self.MAX_LEVEL and random.random() < self.P:
+            level += 1
+
+        return level
+
+    def _find_prevs(self, key):
+        '''
+        Last node with node.key < key on each level.
+        '''
+        prevs = [self.head] * self.MAX_LEVEL
+        node = self.head
+
+        for i in range(self.level - 1, -1, -1):
+            nxt = node.next[i]
+
+            while nxt is not None and nxt.key < key:
+                node = nxt
+                nxt = node.next[i]
+
+            prevs[i] = node
+
+        return prevs
+
+    def _find_lt(self, key):
+        node = self.head
+
+        for i in range(self.level - 1, -1, -1):
+            nxt = node.next[i]
+
+            while nxt is not None and nxt.key < key:
+                node = nxt
+                nxt = node.next[i]
+
+        return node
+
+    def _find_le(self, key):
+        node = self.head
+
+        for i in range(self.level - 1, -1, -1):
+            nxt = node.next[i]
+
+            while nxt is not None and nxt.key <= key:
+                node = nxt
+                nxt = node.next[i]
+
+        return node
+
+    def get(self, key):
+        node = self.seek_ge(key)
+
+        if node is None or node.key != key:
+            raise KeyError(key)
+
+        return node.value
+
+    def set(self, key, value):
+        '''
+        Insert or replace value, returns replaced value or None.
+        '''
+        prevs = self._find_prevs(key)
+        node = prevs[0].next[0]
+
+        if node is not None and node.key == key:
+            prev_value = node.value
+            node.value = value
+            return prev_value
+
+        level = self._random_level()
+
+        if level > self.level:
+            self.level = level
+
+        node = SkipListNode(key, value, level)
+
+        for i in range(level):
+            node.next[i] = prevs[i].next[i]
+            prevs[i].next[i] = node
+
+        # level 0 backward link
+        prev = prevs[0]
+        node.prev = prev if prev is not self.head else None
+        nxt = node.next[0]
+
+        if nxt is not None:
+            nxt.prev = node
+
+        self.length += 1
+        return None
+
+    def first(self):
+        return self.head.next[0]
+
+    def last(self):
+        node = self.head
+
+        for i in range(self.level - 1, -1, -1):
+            while node.next[i] is not None:
+                node = node.next[i]
+
+        return node if node is not self.head else None
+
+    def seek_lt(self, key):
+        node = self._find_lt(key)
+        return node if node is not self.head else None
+
+    def seek_le(self, key):
+        node = self._find_le(key)
+        return node if node is not self.head else None
+
+    def seek_gt(self, key):
+        return self._find_le(key).next[0]
+
+    def seek_ge(self, key):
+        return self._find_lt(key).next[0]
@@ -0,0 +1,99 @@
+__all__ = ['Snapshot']
+
+import threading
+
+class Snapshot(object):
+    '''
+    Snapshot is consistent view of all opened tables as of sequence
+    number of last committed transaction.
+
+    Memtables are read through views which skip rows set later, and
+    sstables are pinned, so flushes and compactions do not change what
+    snapshot sees. Sstables replaced by compaction stay readable until
+    snapshot is released. Reads do not take any locks.
+    '''
+
+    def __init__(self, store, seq):
+        self.store = store
+        self.seq = seq
+        self.released = False
+
+        # (memtables, sstables) by table, ordered from newest to oldest
+        self.structures = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
+
+    def __repr__(self):
+        return '<%s seq=%i>' % (self.__class__.__name__, self.seq)
+
+    def capture(self, table):
+        '''
+        Remember current memtables and sstables of table. Commits must
+        not be applied meanwhile, see Store.snapshot.
+        '''
+        cache = self.store.table_cache
+
+        with table.lock:
+            memtables = [table.memtable] + table.immutable_memtables[::-1]
+            memtables = [m.as_of(self.seq) for m in memtables]
+            sstables = table.sstables[::-1]
+
+            if cache:
+                for sst in sstables:
+                    cache.acquire(sst)
+
+        self.structures[table] = (memtables, sstables)
+
+    def get_structures(self, table):
+        '''
+        Memtables and sstables of table as of snapshot.
+        '''
+        if self.released:
+            raise Exception('snapshot is released')
+
+        try:
+            return self.structures[table]
+        except KeyError as e:
+            raise Exception('table %r was opened after snapshot' % table.table_name)
+
+    def get(self, table, *key):
+        '''
+        Row by primary key or None.
+        '''
+        try:
+            row, op, sp = table._get(key, snapshot=self)
+        except KeyError as e:
+            row = None
+
+        return row
+
+    def get_many(self, table, keys):
+        '''
+        List of rows in order of keys, None for missing key.
+        '''
+        keys = [table._get_scan_key(key) for key in keys]
+        rows = table._get_many(keys, snapshot=self)
+        return [rows.get(key) for key in keys]
+
+    def scan(self, table, start=None, end=None, reverse=False):
+        return table.scan(start, end, reverse, snapshot=self)
+
+    def release(self):
+        if self.released:
+            return
+
+        self.released = True
+        cache = self.store.table_cache
+
+        if cache:
+            for memtables, sstables in self.structures.values():
+                for sst in sstables:
+                    cache.release(sst)
+
+        self.structures = {}
+        self.store._release_snapshot(self)
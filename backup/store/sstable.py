@@ -4,39 +4,70 @@ import os
 import sys
 import mmap
 import time
+import heapq
 import struct
+import itertools
+import threading
+from contextlib import contextmanager
 
 from .index import Index
 from .offset import Offset
+from .bloom import BloomFilter
+from .stats import Stats
+from .expr import OPERATORS
+from .cache import get_row_size
 
 class SSTable(object):
+    # unique ids of sstables, used in cache keys
+    ids = itertools.count()
+
+    # positions of rows by row number are kept in offset file
+    HAS_OFFSET = True
+
     def __init__(self, table, t=None, rows=None):
         self.table = table
         if not t: t = '%.4f' % time.time()
         self.t = t
+        self.id = next(SSTable.ids)
         self.opened = False
 
+        # pinned by readers, see TableCache
+        self.refs = 0
+        self.removed = False
+        self.open_lock = threading.Lock()
+
         # offset
-        offset = Offset(self, t)
-        self.offset = offset
+        self.offset = Offset(self, t) if self.HAS_OFFSET else None
 
         # indexes
         self.indexes = {}
 
-        # index by primary key
-        indexed_columns = (tuple(table.schema.primary_key),)
-
-        # index each column in primary key
-        # used for ranged queries
-        indexed_columns += tuple((n,) for n in table.schema.primary_key)
-
-        for n in indexed_columns:
+        for n in self._get_indexed_columns():
             index = Index(self, t, n)
             self.indexes[n] = index
 
+        # secondary indexes declared in schema
+        for n, stored_columns in table.schema.get_indexes():
+            index = Index(self, t, n, stored_columns)
+            self.indexes[n] = index
+
+        # bloom filter by primary key
+        bits_per_key = table.BLOOM_BITS_PER_KEY
+
+        if bits_per_key:
+            self.bloom = BloomFilter(self, t, bits_per_key)
+        else:
+            self.bloom = None
+
+        # zone map, used to skip sstables which can not match query
+        self.stats = Stats(self, t)
+
         self.f = None
         self.mm = None
 
+        # first and last primary key, see get_key_range
+        self.key_range = None
+
         # rows
         if rows:
             self.w_open()
@@ -66,8 +97,84 @@ class SSTable(object):
         return False
 
     def __add__(self, other):
-        # FIXME:
-        pass
+        '''
+        Merge two sstables, rows of other shadow rows of self.
+        '''
+        return SSTable.merge(self.table, [self, other])
+
+    def __len__(self):
+        with self.pinned():
+            return self._get_offset().mm.size() // 8
+
+    def __iter__(self):
+        # bypass cache, whole sstable is read
+        with self.pinned():
+            offset = self._get_offset()
+
+            for i in range(len(self)):
+                yield self._decode_row(offset[i])
+
+    @classmethod
+    def merge(cls, table, sstables, t=None):
+        '''
+        K-way merge of sstables ordered from oldest to newest into new
+        sstable. Only newest version of each primary key is kept.
+        '''
+        if not t:
+            t = cls.get_merged_t(sstables)
+
+        primary_key = table.schema.primary_key
+        rows = cls._merge_rows(sstables, primary_key)
+        sst = cls(table, t, rows=rows)
+        return sst
+
+    @staticmethod
+    def get_merged_t(sstables):
+        '''
+        Merged sstable takes place of newest sstable it replaces.
+        '''
+        t = sstables[-1].t
+        base, gen = SSTable.get_sort_key(t)
+        return '%s-%i' % (t.split('-')[0], gen + 1)
+
+    @staticmethod
+    def get_sort_key(t):
+        if '-' in t:
+            base, gen = t.split('-')
+        else:
+            base, gen = t, 0
+
+        return float(base), int(gen)
+
+    @staticmethod
+    def _merge_rows(sstables, primary_key):
+        def iter_sstable(rank, sst):
+            for row in sst:
+                key = tuple(row[c] for c in primary_key)
+                yield key, -rank, row
+
+        iters = [iter_sstable(i, sst) for i, sst in enumerate(sstables)]
+        prev_key = None
+        first = True
+
+        for key, rank, row in heapq.merge(*iters):
+            # first row of key comes from newest sstable
+            if first or key != prev_key:
+                yield row
+
+            prev_key = key
+            first = False
+
+    def _get_indexed_columns(self):
+        primary_key = self.table.schema.primary_key
+
+        # index by primary key
+        indexed_columns = (tuple(primary_key),)
+
+        # index each column in primary key
+        # used for ranged queries
+        indexed_columns += tuple((n,) for n in primary_key)
+        return indexed_columns
 
     def get_path(self):
         filename = 'sstable-%s.data' % self.t
@@ -80,46 +187,210 @@ class SSTable(object):
     def open(self):
         '''
         Used only on data reading from file.
+        Files are opened lazily on first access.
         '''
-        self.f = open(self.get_path(), 'r+b')
-        self.mm = mmap.mmap(self.f.fileno(), 0)
-        self.offset.open()
-        
-        for column_names, index in self.indexes.items():
-            index.open()
-
         self.opened = True
 
     def close(self):
         '''
         Used only on data reading from file.
         '''
-        for column_names, index in self.indexes.items():
-            index.close()
+        n_files = self._close_files()
+        cache = self.table.store.table_cache
+
+        if cache:
+            cache.closed(self, n_files)
 
-        self.offset.close()
-        self.mm.close()
-        self.f.close()
         self.opened = False
 
+    @contextmanager
+    def pinned(self):
+        '''
+        Files of pinned sstable are not closed by table cache.
+        '''
+        cache = self.table.store.table_cache
+
+        if cache:
+            cache.acquire(self)
+
+        try:
+            yield self
+        finally:
+            if cache:
+                cache.release(self)
+
+    def _get_components(self):
+        components = [self.offset] if self.offset else []
+        components.extend(self.indexes.values())
+
+        if self.bloom:
+            components.append(self.bloom)
+
+        return components
+
+    def _opened_files(self, n_files):
+        cache = self.table.store.table_cache
+
+        if cache:
+            cache.opened(self, n_files)
+
+    def _open_component(self, component):
+        if component.is_opened():
+            return component
+
+        with self.open_lock:
+            opened = not component.is_opened()
+
+            if opened:
+                component.open()
+
+        if opened:
+            self._opened_files(1)
+
+        return component
+
+    def _get_mm(self):
+        if self.mm is not None:
+            return self.mm
+
+        with self.open_lock:
+            opened = self.mm is None
+
+            if opened:
+                self.f = open(self.get_path(), 'r+b')
+                self.mm = mmap.mmap(self.f.fileno(), 0)
+
+        if opened:
+            self._opened_files(1)
+
+        return self.mm
+
+    def _get_offset(self):
+        return self._open_component(self.offset)
+
+    def _get_index(self, columns):
+        return self._open_component(self.indexes[columns])
+
+    def _get_bloom(self):
+        if not self.bloom:
+            return None
+
+        return self._open_component(self.bloom)
+
+    def _open_files(self):
+        self._get_mm()
+
+        for component in self._get_components():
+            self._open_component(component)
+
+    def _close_files(self):
+        '''
+        Close opened files, returns their number.
+        '''
+        n_files = 0
+
+        for component in self._get_components():
+            if component.is_opened():
+                component.close()
+                n_files += 1
+
+        if self.mm is not None:
+            self.mm.close()
+            self.f.close()
+            self.mm = None
+            self.f = None
+            n_files += 1
+
+        return n_files
+
+    def get_paths(self):
+        paths = [self.get_path()]
+
+        if self.offset:
+            paths.append(self.offset.get_path())
+
+        for column_names, index in self.indexes.items():
+            paths.append(index.get_path())
+
+        if self.bloom:
+            paths.append(self.bloom.get_path())
+
+        paths.append(self.stats.get_path())
+        return paths
+
+    def get_size(self):
+        return os.path.getsize(self.get_path())
+
+    def sync(self):
+        '''
+        Flush written files to disk, before sstable is added to manifest.
+        '''
+        for path in self.get_paths():
+            if not os.path.exists(path):
+                continue
+
+            fd = os.open(path, os.O_RDONLY)
+
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def remove(self):
+        '''
+        Remove all files of sstable.
+        '''
+        self.removed = True
+
+        # invalidate cached rows and blocks
+        cache = self.table.store.cache
+
+        if cache:
+            cache.erase_id(self.id)
+
+        if self.refs:
+            # pinned readers keep using files after they are unlinked,
+            # sstable is closed when it is released
+            self._open_files()
+        elif self.is_opened():
+            self.close()
+
+        for path in self.get_paths():
+            if os.path.exists(path):
+                os.remove(path)
+
     def w_open(self):
         '''
         Open file for writing.
         '''
         self.f = open(self.get_path(), 'wb')
-        self.offset.w_open()
-        
+
+        if self.offset:
+            self.offset.w_open()
+
         for column_names, index in self.indexes.items():
             index.w_open()
 
+        if self.bloom:
+            self.bloom.w_open()
+
+        self.stats.w_open()
+
     def w_close(self):
         '''
         Close file for writing.
         '''
+        if self.bloom:
+            self.bloom.w_close()
+
+        self.stats.w_close()
+
         for column_names, index in self.indexes.items():
             index.w_close()
 
-        self.offset.w_close()
+        if self.offset:
+            self.offset.w_close()
+
         self.f.close()
 
     def _add_rows(self, rows):
@@ -138,82 +409,254 @@ class SSTable(object):
         for column_names, index in self.indexes.items():
             index._write_key(row, sstable_pos)
 
-    def _write_row(self, row):
-        table = self.table
-        row_blob_items = []
+        # bloom filter
+        if self.bloom:
+            key = tuple(row[c] for c in self.table.schema.primary_key)
+            self.bloom._add_key(key)
 
-        for c, t in table.schema:
-            v = row.get(c, None)
-            b = t._get_column_packed(v)
-            row_blob_items.append(b)
+        # zone map
+        self.stats._add_row(row)
 
-        _row_blob = b''.join(row_blob_items)
+    def _write_row(self, row):
+        codec = self.table.schema.row_codec
+        _row_blob = codec.pack([row.get(c, None) for c in codec.names])
         _row_size = struct.pack(b'!Q', len(_row_blob))
         self.f.write(_row_size)
         self.f.write(_row_blob)
 
     def _read_row(self, pos):
-        row_blob_len, = struct.unpack_from('!Q', self.mm, pos)
-        row = {}
-        p = pos + 8
+        '''
+        Read row through store's cache.
+        '''
+        cache = self.table.store.cache
+
+        if not cache:
+            return self._decode_row(pos)
+
+        key = (self.id, pos)
+        row = cache.get(key)
 
-        for c, t in self.table.schema:
-            v, p = t._get_column_unpacked(self.mm, p)
-            row[c] = v
+        if row is None:
+            row = self._decode_row(pos)
+            cache.set(key, row, get_row_size(row))
 
+        # callers may change row
+        return dict(row)
+
+    def _decode_row(self, pos):
+        mm = self._get_mm()
+        codec = self.table.schema.row_codec
+        values, p = codec.unpack_from(mm, pos + 8)
+        row = dict(zip(codec.names, values))
         return row
 
-    def get(self, key, columns=None):
-        if columns: 
-            columns = tuple(columns)
-        else:
-            columns = tuple(self.table.schema.primary_key)
+    def _get_row_at(self, i):
+        sstable_pos = self._get_offset()[i]
+        return self._read_row(sstable_pos)
 
-        index = self.indexes[columns]
-        offset_pos, sstable_pos = index.get_sstable_pos(key)
-        row = self._read_row(sstable_pos)
-        return row, offset_pos, sstable_pos
+    def _seek(self, key, upper=False):
+        '''
+        Row number of first row whose primary key prefix is >= key,
+        or > key if upper.
+        '''
+        index = self._get_index(tuple(self.table.schema.primary_key))
+        return index.seek(key, upper)
 
-    def get_lt(self, key, columns=None):
-        if columns: 
-            columns = tuple(columns)
-        else:
-            columns = tuple(self.table.schema.primary_key)
+    def iter_range(self, start=None, end=None, reverse=False):
+        '''
+        (key, row) pairs with start <= key < end ordered by primary key.
+        Rows are read one by one through offset file, bypassing cache.
+        '''
+        primary_key = self.table.schema.primary_key
 
-        index = self.indexes[columns]
-        offset_pos, sstable_pos = index.get_lt_sstable_pos(key)
-        row = self._read_row(sstable_pos)
-        return row, offset_pos, sstable_pos
+        with self.pinned():
+            low = self._seek(start) if start is not None else 0
+            high = self._seek(end) if end is not None else len(self)
+            offset = self._get_offset()
 
-    def get_le(self, key, columns=None):
-        if columns: 
-            columns = tuple(columns)
-        else:
-            columns = tuple(self.table.schema.primary_key)
+            if reverse:
+                i, stop, step = high - 1, low - 1, -1
+            else:
+                i, stop, step = low, high, 1
 
-        index = self.indexes[columns]
-        offset_pos, sstable_pos = index.get_le_sstable_pos(key)
-        row = self._read_row(sstable_pos)
-        return row, offset_pos, sstable_pos
+            while i != stop:
+                row = self._decode_row(offset[i])
+                yield tuple(row[c] for c in primary_key), row
+                i += step
 
-    def get_gt(self, key, columns=None):
+    def iter_values(self, columns):
+        '''
+        Tuples of values of columns of all rows, unpacked without
+        building row dicts, bypassing cache.
+        '''
+        codec = self.table.schema.row_codec
+        positions = [codec.names.index(c) for c in columns]
+
+        with self.pinned():
+            mm = self._get_mm()
+            offset = self._get_offset()
+
+            for i in range(len(self)):
+                values, p = codec.unpack_from(mm, offset[i] + 8)
+                yield tuple([values[j] for j in positions])
+
+    def iter_index(self, columns, start=None, covering=False):
+        '''
+        (index key, row) pairs ordered by index of columns, starting at
+        first key whose prefix is >= start. If covering, rows hold only
+        stored columns of index and are not read from sstable.
+        '''
+        with self.pinned():
+            index = self._get_index(columns)
+            stored_columns = index.stored_columns
+            i = index.seek(start) if start is not None else 0
+            n = len(index)
+
+            while i < n:
+                key, sstable_pos = index.read_entry(i)
+
+                if covering:
+                    row = dict(zip(stored_columns, key))
+                else:
+                    row = self._read_row(sstable_pos)
+
+                yield key, row
+                i += 1
+
+    def scan_column(self, column, op, value):
+        '''
+        Offset positions of rows whose column satisfies "column op value".
+        NULL values never satisfy it.
+        '''
+        f = OPERATORS[op]
+        positions = []
+
+        with self.pinned():
+            for i in range(len(self)):
+                v = self._get_row_at(i)[column]
+
+                if v is not None and f(v, value):
+                    positions.append(i)
+
+        return positions
+
+    def _get_columns(self, columns):
         if columns: 
             columns = tuple(columns)
         else:
             columns = tuple(self.table.schema.primary_key)
 
-        index = self.indexes[columns]
-        offset_pos, sstable_pos = index.get_gt_sstable_pos(key)
-        row = self._read_row(sstable_pos)
+        return columns
+
+    def get(self, key, columns=None):
+        columns = self._get_columns(columns)
+
+        with self.pinned():
+            # bloom filter is built only for whole primary key
+            bloom = self._get_bloom()
+
+            if bloom and columns == tuple(self.table.schema.primary_key) and \
+               len(key) == len(columns):
+                if not bloom.may_contain(key):
+                    raise KeyError(key)
+            else:
+                bloom = None
+
+            index = self._get_index(columns)
+            offset_pos, sstable_pos = index.get_sstable_pos(key)
+
+            if __debug__:
+                self.table.store.metrics.incr('sstable.index_gets')
+
+            if sstable_pos is None:
+                if bloom:
+                    bloom.n_false_positives += 1
+
+                raise KeyError(key)
+
+            row = self._read_row(sstable_pos)
+
         return row, offset_pos, sstable_pos
 
-    def get_ge(self, key, columns=None):
-        if columns: 
-            columns = tuple(columns)
-        else:
-            columns = tuple(self.table.schema.primary_key)
+    def get_key_range(self):
+        '''
+        First and last primary key, or None if sstable is empty.
+        '''
+        if self.key_range is None:
+            with self.pinned():
+                index = self._get_index(tuple(self.table.schema.primary_key))
+                n = len(index)
+
+                if n:
+                    self.key_range = (index.read_entry(0)[0], index.read_entry(n - 1)[0])
+                else:
+                    self.key_range = ()
+
+        return self.key_range or None
+
+    def get_split_keys(self, n):
+        '''
+        Up to n - 1 primary keys which split sstable into n parts of
+        about same number of rows.
+        '''
+        with self.pinned():
+            index = self._get_index(tuple(self.table.schema.primary_key))
+            n_keys = len(index)
+            positions = sorted(set(n_keys * i // n for i in range(1, n)))
+            return [index.read_entry(i)[0] for i in positions if 0 < i < n_keys]
+
+    def get_many(self, keys):
+        '''
+        Rows of sorted primary keys found in sstable, by key. Index is
+        walked once with monotonic cursor.
+        '''
+        rows = {}
+
+        with self.pinned():
+            bloom = self._get_bloom()
+            index = self._get_index(tuple(self.table.schema.primary_key))
+            n = len(index)
+            cursor = 0
+
+            for key in keys:
+                if bloom and not bloom.may_contain(key):
+                    continue
+
+                cursor = index.gallop(key, cursor)
+
+                if cursor < n:
+                    cur_key, sstable_pos = index.read_entry(cursor)
+
+                    if cur_key == key:
+                        rows[key] = self._read_row(sstable_pos)
+                        continue
+
+                if bloom:
+                    bloom.n_false_positives += 1
+
+                if cursor == n:
+                    break
+
+        return rows
+
+    def _get_by(self, name, key, columns=None):
+        columns = self._get_columns(columns)
+
+        with self.pinned():
+            index = self._get_index(columns)
+            offset_pos, sstable_pos = getattr(index, name)(key)
+            row = self._read_row(sstable_pos)
 
-        index = self.indexes[columns]
-        offset_pos, sstable_pos = index.get_ge_sstable_pos(key)
-        row = self._read_row(sstable_pos)
         return row, offset_pos, sstable_pos
+
+    def get_lt(self, key, columns=None):
+        return self._get_by('get_lt_sstable_pos', key, columns)
+
+    def get_le(self, key, columns=None):
+        return self._get_by('get_le_sstable_pos', key, columns)
+
+    def get_gt(self, key, columns=None):
+        return self._get_by('get_gt_sstable_pos', key, columns)
+
+    def get_ge(self, key, columns=None):
+        return self._get_by('get_ge_sstable_pos', key, columns)
@@ -0,0 +1,274 @@
+__all__ = ['Stats']
+
+import os
+import sys
+import heapq
+import marshal
+import threading
+
+class ColumnStatsBuilder(object):
+    '''
+    Min, max, null count and K minimum values sketch of distinct values
+    of one column.
+    '''
+
+    __slots__ = ('min', 'max', 'n_nulls', 'hashes', 'heap')
+
+    def __init__(self):
+        self.min = None
+        self.max = None
+        self.n_nulls = 0
+
+        # k smallest hashes, heap is max-heap of negated hashes
+        self.hashes = set()
+        self.heap = []
+
+    def add(self, value, k):
+        if value is None:
+            self.n_nulls += 1
+            return
+
+        if self.min is None or value < self.min:
+            self.min = value
+
+        if self.max is None or value > self.max:
+            self.max = value
+
+        if k:
+            # hashes of ints are ints, so they are mixed to spread evenly
+            h = ((hash(value) * 0x9E3779B97F4A7C15) >> 32) & 0xFFFFFFFF
+
+            if h in self.hashes:
+                return
+
+            if len(self.heap) < k:
+                heapq.heappush(self.heap, -h)
+                self.hashes.add(h)
+            elif h < -self.heap[0]:
+                old = -heapq.heapreplace(self.heap, -h)
+                self.hashes.discard(old)
+                self.hashes.add(h)
+
+    def get_distinct(self, k):
+        '''
+        Approximate number of distinct values, exact below k.
+        '''
+        n = len(self.heap)
+
+        if n < k:
+            return n
+
+        kth = -self.heap[0] + 1
+        return int((k - 1) * float(1 << 32) / kth)
+
+class Stats(object):
+    '''
+    Stats is zone map of sstable: number of rows and, for every column,
+    min, max, number of NULLs and approximate number of distinct values.
+    Block sstables also keep min, max and number of NULLs of every
+    column per block.
+
+    Stats are written with sstable into small file, loaded whole on
+    first use and kept in memory even when sstable files are closed.
+    '''
+
+    DISTINCT_K = 256
+
+    def __init__(self, sstable, t):
+        self.sstable = sstable
+        self.t = t
+        self.lock = threading.Lock()
+        self.f = None
+        self.loaded = False
+
+        # n_rows, columns: {column: (min, max, n_nulls, n_distinct)},
+        # blocks: [{column: (min, max, n_nulls, n_rows)}] or None
+        self.data = None
+
+        # builders while writing
+        self._columns = None
+        self._block = None
+        self._blocks = None
+        self._n_rows = 0
+        self._n_block_rows = 0
+
+    def get_path(self):
+        filename = 'stats-%s.data' % self.t
+        path = os.path.join(self.sstable.table.get_path(), filename)
+        return path
+
+    def load(self):
+        '''
+        Read stats file once, None if sstable was written without it.
+        '''
+        if self.loaded:
+            return self.data
+
+        with self.lock:
+            if not self.loaded:
+                path = self.get_path()
+
+                if os.path.exists(path):
+                    with open(path, 'rb') as f:
+                        self.data = marshal.load(f)
+
+                self.loaded = True
+
+        return self.data
+
+    def w_open(self):
+        '''
+        Open file for writing.
+        '''
+        self.f = open(self.get_path(), 'wb')
+        self._columns = dict((c, ColumnStatsBuilder()) for c, t in self.sstable.table.schema)
+        self._block = None
+        self._blocks = None
+        self._n_rows = 0
+        self._n_block_rows = 0
+
+    def w_close(self):
+        '''
+        Close file for writing.
+        '''
+        k = self.DISTINCT_K
+        columns = {}
+
+        for c, builder in self._columns.items():
+            columns[c] = (builder.min, builder.max, builder.n_nulls, builder.get_distinct(k))
+
+        data = {
+            'n_rows': self._n_rows,
+            'columns': columns,
+            'blocks': self._blocks,
+        }
+
+        marshal.dump(data, self.f)
+        self.f.close()
+        self.f = None
+        self._columns = None
+        self._block = None
+        self._blocks = None
+        self.data = data
+        self.loaded = True
+
+    def _add_row(self, row):
+        k = self.DISTINCT_K
+        self._n_rows += 1
+
+        for c, builder in self._columns.items():
+            builder.add(row.get(c), k)
+
+        if self._blocks is not None:
+            if self._block is None:
+                self._block = dict((c, ColumnStatsBuilder()) for c in self._columns)
+
+            self._n_block_rows += 1
+
+            for c, builder in self._block.items():
+                builder.add(row.get(c), 0)
+
+    def _begin_blocks(self):
+        '''
+        Keep stats per block, see _end_block.
+        '''
+        self._blocks = []
+
+    def _end_block(self):
+        if self._block is None:
+            return
+
+        block = {}
+
+        for c, builder in self._block.items():
+            block[c] = (builder.min, builder.max, builder.n_nulls, self._n_block_rows)
+
+        self._blocks.append(block)
+        self._block = None
+        self._n_block_rows = 0
+
+    def get_n_rows(self):
+        data = self.load()
+        return data['n_rows'] if data else None
+
+    def get_column(self, column):
+        '''
+        (min, max, n_nulls, n_distinct) of column, None if unknown.
+        '''
+        data = self.load()
+        return data['columns'].get(column) if data else None
+
+    def has_blocks(self):
+        data = self.load()
+        return bool(data and data['blocks'])
+
+    def may_match(self, expr):
+        '''
+        Some row of sstable may satisfy expression.
+        '''
+        data = self.load()
+
+        if data is None:
+            return True
+
+        zone = dict(
+            (c, (v[0], v[1], v[2], data['n_rows']))
+            for c, v in data['columns'].items()
+        )
+
+        return self._zone_may_match(expr, zone)
+
+    def block_may_match(self, block_no, expr):
+        '''
+        Some row of block may satisfy expression.
+        '''
+        data = self.load()
+
+        if not data or not data['blocks']:
+            return True
+
+        return self._zone_may_match(expr, data['blocks'][block_no])
+
+    def _zone_may_match(self, expr, zone):
+        if expr is None:
+            return True
+
+        if expr.op == 'and':
+            return self._zone_may_match(expr.left, zone) and self._zone_may_match(expr.right, zone)
+        elif expr.op == 'or':
+            return self._zone_may_match(expr.left, zone) or self._zone_may_match(expr.right, zone)
+
+        value = expr.right
+
+        # NULL never satisfies comparison
+        if value is None:
+            return False
+
+        try:
+            min_value, max_value, n_nulls, n_rows = zone[expr.left.name]
+        except (AttributeError, KeyError) as e:
+            return True
+
+        if n_nulls >= n_rows:
+            return False
+
+        op = expr.op
+
+        # values of other type than column are compared as python values
+        try:
+            if op == '==':
+                return min_value <= value <= max_value
+            elif op == '!=':
+                return not (min_value == max_value == value)
+            elif op == '<':
+                return min_value < value
+            elif op == '<=':
+                return min_value <= value
+            elif op == '>':
+                return max_value > value
+            elif op == '>=':
+                return max_value >= value
+        except TypeError as e:
+            return True
+
+        return True
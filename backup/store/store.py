@@ -2,21 +2,82 @@ __all__ = ['Store']
 
 import os
 import sys
+import time
 import thread
 import threading
 from collections import defaultdict, deque
 
 from .database import Database
 from .transaction import Transaction
+from .compaction import Compactor
+from .flush import Flusher
+from .wal import WAL
+from .table_cache import TableCache
+from .cache import Cache
+from .lock import LockManager, SharedLock
+from .snapshot import Snapshot
+from .executor import Executor, AsyncScan
+from .parallel import ParallelScanner
+from .metrics import Metrics, MetricsDumper
 
 class Store(object):
-    def __init__(self, data_path=None):
+    def __init__(self, data_path=None, compaction=True, flush=True, wal=True,
+                 wal_sync=WAL.SYNC_ALWAYS, wal_sync_interval=0.01,
+                 max_open_files=None, cache_size=8 * 1024 * 1024,
+                 cache_policy='lru', cache_shards=16, lock_timeout=None,
+                 executor_workers=None, executor_queue=None, parallelism=None,
+                 metrics=True, metrics_dump_interval=None, metrics_dump_path=None):
         self.data_path = data_path
+        self.max_open_files = max_open_files
+        self.table_cache = None
+        self.cache_size = cache_size
+        self.cache_policy = cache_policy
+        self.cache_shards = cache_shards
+        self.cache = None
+        self.flush = flush
+        self.flusher = None
+        self.compaction = compaction
+        self.compactor = None
+        self.wal_enabled = wal
+        self.wal_sync = wal_sync
+        self.wal_sync_interval = wal_sync_interval
+        self.wal = None
         self.opened = False
         self.databases = {}
         self.transactions = defaultdict(deque)
-        self.commiting_transactions = set()
-        self.check_lock = threading.Lock()
+        self.lock_manager = LockManager()
+        self.lock_timeout = lock_timeout
+
+        # sequence number of last committed transaction
+        self.sequence = 0
+        self.sequence_lock = threading.Lock()
+
+        # commits are applied in shared mode, snapshots are taken in
+        # exclusive mode, so they never see half applied transaction
+        self.commit_lock = SharedLock()
+
+        # numbers of live snapshots by sequence number
+        self.snapshots = defaultdict(int)
+
+        # sequence number of commit applied in current thread
+        self.local = threading.local()
+
+        # runs transactions and scans for async callers, started on first use
+        self.executor_workers = executor_workers
+        self.executor_queue = executor_queue
+        self.executor = None
+        self.executor_lock = threading.Lock()
+
+        # number of processes scanning sstables of large selects,
+        # pool is started on first use
+        self.parallelism = parallelism
+        self.parallel_scanner = None
+
+        # counters and histograms of hot paths, see Metrics
+        self.metrics = Metrics(metrics)
+        self.metrics_dump_interval = metrics_dump_interval
+        self.metrics_dump_path = metrics_dump_path
+        self.metrics_dumper = None
 
     def __enter__(self):
         # open self if not
@@ -38,15 +99,104 @@ class Store(object):
         return self.opened
 
     def open(self):
+        # bounds open sstable files
+        self.table_cache = TableCache(self, self.max_open_files)
+
+        # decoded rows and blocks shared by all sstables
+        if self.cache_size:
+            self.cache = Cache(self.cache_size, self.cache_shards, self.cache_policy)
+
+        # write-ahead log, replayed into memtables when tables are opened
+        if self.wal_enabled:
+            self.wal = WAL(self, self.wal_sync, self.wal_sync_interval)
+            self.wal.open()
+
+        # background flush of immutable memtables
+        if self.flush:
+            self.flusher = Flusher(self)
+            self.flusher.start()
+
+        # background compaction
+        if self.compaction:
+            self.compactor = Compactor(self)
+            self.compactor.start()
+
+        # periodic dump of stats
+        if self.metrics_dump_interval:
+            self.metrics_dumper = MetricsDumper(self, self.metrics_dump_interval, self.metrics_dump_path)
+            self.metrics_dumper.start()
+
         self.opened = True
 
     def close(self):
+        if self.metrics_dumper:
+            self.metrics_dumper.stop()
+            self.metrics_dumper = None
+
+        if self.executor:
+            self.executor.stop()
+            self.executor = None
+
+        if self.parallel_scanner:
+            self.parallel_scanner.close()
+            self.parallel_scanner = None
+
+        if self.flusher:
+            self.flusher.stop()
+            self.flusher = None
+
+        if self.compactor:
+            self.compactor.stop()
+            self.compactor = None
+
         for db_name, db in self.databases.items():
             if db.is_opened():
                 db.close()
 
+        if self.wal:
+            self.wal.close()
+            self.wal = None
+
         self.opened = False
 
+    def get_cache_stats(self):
+        if not self.cache:
+            return None
+
+        return self.cache.get_stats()
+
+    def stats(self):
+        '''
+        Snapshot of metrics and stats of store's components and tables.
+        '''
+        components = [
+            ('cache', self.cache),
+            ('table_cache', self.table_cache),
+            ('wal', self.wal),
+            ('flusher', self.flusher),
+            ('compactor', self.compactor),
+            ('executor', self.executor),
+            ('parallel_scanner', self.parallel_scanner),
+        ]
+
+        stats = {
+            'time': time.time(),
+            'sequence': self.sequence,
+            'snapshots': sum(self.snapshots.values()),
+            'metrics': self.metrics.get_stats(),
+            'locks': self.lock_manager.get_stats(),
+            'tables': {},
+        }
+
+        for name, component in components:
+            stats[name] = component.get_stats() if component else None
+
+        for db_name, db in self.databases.items():
+            for table in db.tables:
+                stats['tables']['%s.%s' % (db_name, table.table_name)] = table.get_stats()
+
+        return stats
+
     def database(self, db_name):
         # open self if not
         if not self.is_opened():
@@ -56,14 +206,119 @@ class Store(object):
         self.databases[db_name] = db
         return db
 
-    def transaction(self):
+    def transaction(self, snapshot=None):
         # open self if not
         if not self.is_opened():
             self.open()
 
-        tx = Transaction(self)
+        tx = Transaction(self, snapshot)
         return tx
 
+    def get_executor(self):
+        with self.executor_lock:
+            if self.executor is None:
+                self.executor = Executor(self.executor_workers, self.executor_queue)
+                self.executor.start()
+
+        return self.executor
+
+    def get_parallel_scanner(self):
+        '''
+        ParallelScanner, or None if parallelism is not enabled.
+        '''
+        if not self.parallelism or self.parallelism < 2:
+            return None
+
+        with self.executor_lock:
+            if self.parallel_scanner is None:
+                self.parallel_scanner = ParallelScanner(self, self.parallelism)
+
+        return self.parallel_scanner
+
+    def submit(self, f, *args, **kwargs):
+        '''
+        Run f on executor, returns Future of its result.
+        '''
+        return self.get_executor().submit(f, *args, **kwargs)
+
+    def atransaction(self, f, *args, **kwargs):
+        '''
+        Run f(tx, *args, **kwargs) in transaction on executor. Returns
+        Future of result of f, done after transaction commits, so
+        deferreds returned by f are already set.
+        '''
+        # open self if not
+        if not self.is_opened():
+            self.open()
+
+        return self.submit(self._run_transaction, f, args, kwargs)
+
+    def _run_transaction(self, f, args, kwargs):
+        with self.transaction() as tx:
+            result = f(tx, *args, **kwargs)
+
+        return result
+
+    def ascan(self, table, start=None, end=None, reverse=False,
+              snapshot=None, batch_size=None):
+        '''
+        Scan of table read on executor in batches, see AsyncScan.
+        '''
+        rows = table.scan(start, end, reverse, snapshot)
+        return AsyncScan(self.get_executor(), rows, batch_size)
+
+    def next_sequence(self):
+        with self.sequence_lock:
+            self.sequence += 1
+            return self.sequence
+
+    def get_commit_sequence(self):
+        '''
+        Sequence number of transaction being applied in current thread,
+        0 outside of transactions.
+        '''
+        return getattr(self.local, 'seq', 0)
+
+    def snapshot(self):
+        '''
+        Snapshot of all opened tables as of last committed transaction.
+        Snapshot should be released when it is not used anymore.
+        '''
+        # open self if not
+        if not self.is_opened():
+            self.open()
+
+        with self.commit_lock.exclusive():
+            snapshot = Snapshot(self, self.sequence)
+
+            with self.sequence_lock:
+                self.snapshots[snapshot.seq] += 1
+
+            for db_name, db in self.databases.items():
+                for table in db.tables:
+                    snapshot.capture(table)
+
+        return snapshot
+
+    def _release_snapshot(self, snapshot):
+        with self.sequence_lock:
+            self.snapshots[snapshot.seq] -= 1
+
+            if not self.snapshots[snapshot.seq]:
+                del self.snapshots[snapshot.seq]
+
+    def get_oldest_snapshot_seq(self):
+        '''
+        Sequence number of oldest live snapshot, None if there is none.
+        '''
+        snapshots = self.snapshots
+
+        if not snapshots:
+            return None
+
+        with self.sequence_lock:
+            return min(snapshots) if snapshots else None
+
     def get_current_transaction(self):
         # currently running transaction in current thread
         tx_queue = self.transactions[thread.get_ident()]
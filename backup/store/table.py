@@ -2,53 +2,199 @@ __all__ = ['Table']
 
 import os
 import sys
+import time
+import heapq
+import bisect
+import marshal
+import tempfile
+import itertools
+import threading
 from pprint import pprint
+from contextlib import contextmanager
 from collections import defaultdict
 
 from .column import Column
 from .schema import Schema
-from .memtable import MemTable
+from .memtable import MemTable, SkipListMemTable
 from .sstable import SSTable
+from .columnar import ColumnarSSTable
+from .block import BlockSSTable
 from .query import Query
+from .planner import Planner
+from .aggregate import Aggregator
+from .manifest import Manifest
 from .deferred import Deferred
 from .expr import Expr
 
-class Table(object):
-    MEMTABLE_LIMIT_N_ITEMS = 100
+class ReversedKey(object):
+    '''
+    Key with reversed ordering, used to merge cursors in descending order.
+    '''
+
+    __slots__ = ('key',)
+
+    def __init__(self, key):
+        self.key = key
+
+    def __lt__(self, other):
+        return other.key < self.key
 
-    def __init__(self, db, table_name, type_fields=None):
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __ne__(self, other):
+        return self.key != other.key
+
+class Table(object):
+    MEMTABLE_CLASS = SkipListMemTable
+    MEMTABLE_LIMIT_N_ITEMS = None
+    MEMTABLE_LIMIT_SIZE = 4 * 1024 * 1024
+    MAX_IMMUTABLE_MEMTABLES = 4
+    BLOOM_BITS_PER_KEY = 10
+    BULK_LOAD_RUN_N_ITEMS = 100000
+    BULK_LOAD_SSTABLE_N_ITEMS = 1000000
+    SSTABLE_FORMATS = {
+        'row': SSTable,
+        'columnar': ColumnarSSTable,
+        'block': BlockSSTable,
+    }
+
+    def __init__(self, db, table_name, type_fields=None, readonly=False):
         self.store = db.store
         self.db = db
         self.table_name = table_name
         self.opened = False
 
+        # table dir
+        dirpath = self.get_path()
+
+        if not os.path.exists(dirpath):
+            try:
+                os.makedirs(dirpath)
+            except OSError as e:
+                raise Exception('could not create table %r' % table_name)
+
         # schema
         self.schema = Schema(self, type_fields)
+        sstable_format = self.schema.get_option('sstable_format', 'row')
+        self.sstable_class = self.SSTABLE_FORMATS[sstable_format]
 
         # memtable
-        self.memtable = MemTable(self)
+        self.memtable = self.MEMTABLE_CLASS(self)
+
+        # memtables waiting to be flushed, from oldest to newest
+        self.immutable_memtables = []
+
+        # guards memtable and sstables swaps
+        self.lock = threading.RLock()
+
+        # signaled when immutable memtable is flushed
+        self.flush_cond = threading.Condition(self.lock)
+
+        # flushes immutable memtables in order
+        self.flush_lock = threading.Lock()
+
+        # sys.exc_info() of last failed flush by flusher, raised to
+        # writers which wait for flush when it fails
+        self.flush_error = None
+
+        # counters
+        self.n_write_stalls = 0
+        self.n_flush_errors = 0
+        self.n_pruned_sstables = 0
+        self.n_pruned_blocks = 0
 
         # sstables
         self.sstables = []
-        table_path = self.get_path()
+        self.manifest = None
 
-        for filename in os.listdir(table_path):
-            if not filename.startswith('sstable-'):
-                continue
+        # table of parallel scan worker, which opens sstables by name and
+        # leaves files and write-ahead log to store which owns table
+        if readonly:
+            return
 
-            s = filename.index('sstable-') + len('sstable-')
-            e = filename.index('.data')
-            t = filename[s:e]
+        self.manifest = Manifest(self)
 
-            # sstable
-            sst = SSTable(self, t)
-            sst.open() # FIXME: lazy open in SSTable only if required
+        if self.manifest.exists():
+            ts = self.manifest.open()
+        else:
+            ts = self._find_sstables()
+            self.manifest.create(ts)
+
+        # order from oldest to newest
+        for t in ts:
+            sst = self.sstable_class(self, t)
+            sst.open()
             self.sstables.append(sst)
 
+        self._remove_orphans()
+
+        # rows recovered from write-ahead log
+        wal = self.store.wal
+
+        if wal:
+            rows, segment = wal.pop_recovered(db.db_name, table_name)
+
+            for row in rows:
+                # rows are checked as on insert, rows of older logs could
+                # be logged before they were checked
+                try:
+                    key = self._prepare_row(row)
+                except Exception as e:
+                    continue
+
+                self.memtable.set(key, row)
+
+            self.memtable.wal_segment = segment
+            self.commit_if_required()
+
     def __getattr__(self, attr):
         c = getattr(self.schema, attr)
         return c
 
+    def _find_sstables(self):
+        '''
+        Names of sstables in table's directory ordered from oldest to
+        newest, for table created before manifests.
+        '''
+        ts = []
+
+        for filename in os.listdir(self.get_path()):
+            # leftovers of interrupted bulk load
+            if filename.split('-')[1:2] and filename.split('-')[1].startswith('tmp'):
+                continue
+
+            if not filename.startswith('sstable-'):
+                continue
+
+            s = filename.index('sstable-') + len('sstable-')
+            e = filename.index('.data')
+            ts.append(filename[s:e])
+
+        ts.sort(key=SSTable.get_sort_key)
+        return ts
+
+    def _remove_orphans(self):
+        '''
+        Remove files of sstables which are not in manifest, left by
+        interrupted flush, compaction or bulk load, and old manifests.
+        '''
+        table_path = self.get_path()
+        paths = set(self.manifest.get_paths())
+        paths.add(self.schema.get_path())
+
+        for sst in self.sstables:
+            paths.update(sst.get_paths())
+
+        for filename in os.listdir(table_path):
+            path = os.path.join(table_path, filename)
+
+            if path in paths:
+                continue
+
+            if filename.endswith('.data') or filename.startswith('manifest-') or filename.startswith('CURRENT'):
+                os.remove(path)
+
     def get_path(self):
         return os.path.join(self.db.get_path(), self.table_name)
 
@@ -59,28 +205,224 @@ class Table(object):
         self.opened = True
 
     def close(self):
-        for sst in self.sstables:
-            if sst.is_opened():
-                sst.close()
+        with self.lock:
+            for sst in self.sstables:
+                if sst.is_opened():
+                    sst.close()
+
+        if self.manifest:
+            self.manifest.close()
 
         self.opened = False
 
+    def get_bloom_stats(self):
+        stats = {
+            'checks': 0,
+            'negatives': 0,
+            'false_positives': 0,
+        }
+
+        for sst in self.sstables:
+            if not sst.bloom:
+                continue
+
+            for k, v in sst.bloom.get_stats().items():
+                stats[k] += v
+
+        return stats
+
+    def get_stats(self):
+        with self.lock:
+            memtables = [self.memtable] + self.immutable_memtables
+            sstables = self.sstables
+
+        return {
+            'sstables': len(sstables),
+            'sstables_size': sum(sst.get_size() for sst in sstables),
+            'immutable_memtables': len(memtables) - 1,
+            'memtable_rows': sum(len(m) for m in memtables),
+            'memtable_size': sum(m.size for m in memtables),
+            'write_stalls': self.n_write_stalls,
+            'flush_errors': self.n_flush_errors,
+            'bloom': self.get_bloom_stats(),
+            'prune': self.get_prune_stats(),
+            'manifest': self.manifest.get_stats() if self.manifest else None,
+        }
+
+    def get_prune_stats(self):
+        '''
+        Numbers of sstables and blocks skipped by selects thanks to
+        zone maps.
+        '''
+        return {
+            'pruned_sstables': self.n_pruned_sstables,
+            'pruned_blocks': self.n_pruned_blocks,
+        }
+
+    def is_memtable_full(self):
+        memtable = self.memtable
+
+        if self.MEMTABLE_LIMIT_N_ITEMS and len(memtable) >= self.MEMTABLE_LIMIT_N_ITEMS:
+            return True
+
+        if self.MEMTABLE_LIMIT_SIZE and memtable.size >= self.MEMTABLE_LIMIT_SIZE:
+            return True
+
+        return False
+
     def commit_if_required(self):
-        if len(self.memtable) >= self.MEMTABLE_LIMIT_N_ITEMS:
-            self.commit()
+        if not self.is_memtable_full():
+            return
+
+        flusher = self.store.flusher
+
+        with self.lock:
+            # write stall, wait for flusher to catch up
+            if flusher and len(self.immutable_memtables) >= self.MAX_IMMUTABLE_MEMTABLES:
+                self.n_write_stalls += 1
+
+                if __debug__:
+                    t0 = self.store.metrics.now()
+
+                # flusher retries failed flushes, so wait is bounded by
+                # next attempt, whose failure is raised
+                n_flush_errors = self.n_flush_errors
+
+                while len(self.immutable_memtables) >= self.MAX_IMMUTABLE_MEMTABLES:
+                    if self.n_flush_errors != n_flush_errors:
+                        exc_type, exc_value, exc_tb = self.flush_error
+                        raise exc_type, exc_value, exc_tb
+
+                    self.flush_cond.wait()
+
+                if __debug__:
+                    self.store.metrics.observe('table.write_stall_us', t0)
+
+            # other writer could switch memtable meanwhile
+            if not self.is_memtable_full():
+                return
+
+            self._switch_memtable()
+
+        if flusher:
+            flusher.schedule(self)
+        else:
+            self.flush_immutable_memtables()
+
+    def _set_flush_error(self, exc_info):
+        with self.lock:
+            self.flush_error = exc_info
+
+            if exc_info is not None:
+                self.n_flush_errors += 1
+
+            self.flush_cond.notify_all()
+
+    def get_wal_segment(self):
+        '''
+        Oldest wal segment still required by table's memtables.
+        '''
+        segments = [
+            memtable.wal_segment
+            for memtable in [self.memtable] + self.immutable_memtables
+            if memtable.wal_segment is not None
+        ]
+
+        return min(segments) if segments else None
+
+    def _switch_memtable(self):
+        '''
+        Current memtable becomes immutable and new writes go to new memtable.
+        '''
+        with self.lock:
+            if not len(self.memtable):
+                return
+
+            self.immutable_memtables = self.immutable_memtables + [self.memtable]
+            self.memtable = self.MEMTABLE_CLASS(self)
+
+        # rows of immutable memtable stay in older wal segments
+        wal = self.store.wal
+
+        if wal:
+            wal.rotate()
+
+    def flush_immutable_memtables(self):
+        '''
+        Write immutable memtables to sstables, returns number of flushes.
+        '''
+        n = 0
+
+        with self.flush_lock:
+            while True:
+                with self.lock:
+                    if not self.immutable_memtables:
+                        break
+
+                    memtable = self.immutable_memtables[0]
+
+                if __debug__:
+                    metrics = self.store.metrics
+                    t0 = metrics.now()
+
+                # get sorted rows by primary_key
+                columns = self.schema.primary_key
+                rows = memtable.get_sorted_rows(columns)
+
+                # create new sstable, memtable is still readable meanwhile
+                t, = self._get_next_ts(1)
+                sst = self.sstable_class(self, t, rows=rows)
+                sst.open()
+                self.manifest.apply([], [sst])
+
+                with self.lock:
+                    # sstables list is replaced, never changed in place,
+                    # so compaction can swap its part of list
+                    self.sstables = self.sstables + [sst]
+                    self.immutable_memtables = self.immutable_memtables[1:]
+                    self.flush_cond.notify_all()
+
+                n += 1
+
+                if __debug__:
+                    metrics.observe('table.flush_us', t0)
+                    metrics.add('table.flush_rows', len(memtable))
+
+        if n:
+            # write-ahead log
+            wal = self.store.wal
+
+            if wal:
+                wal.collect()
+
+            # compaction
+            compactor = self.store.compactor
+
+            if compactor:
+                compactor.notify(self)
+
+        return n
+
+    def _get_next_ts(self, n):
+        '''
+        Names of n new sstables, ordered after all sstables of table
+        even if clock went backwards.
+        '''
+        t = time.time()
+
+        with self.lock:
+            if self.sstables:
+                base, gen = SSTable.get_sort_key(self.sstables[-1].t)
+                t = max(t, base + 0.0001)
+
+        return ['%.4f' % (t + i * 0.0001) for i in range(n)]
 
     def commit(self):
-        # get sorted rows by primary_key
-        columns = self.schema.primary_key
-        rows = self.memtable.get_sorted_rows(columns)
-        
-        # create new sstable
-        sst = SSTable(self, rows=rows)
-        sst.open()
-        self.sstables.append(sst)
-
-        # clear memtable
-        self.memtable = MemTable(self)
+        '''
+        Flush memtable and all immutable memtables now.
+        '''
+        self._switch_memtable()
+        self.flush_immutable_memtables()
 
     @property
     def query(self):
@@ -89,10 +431,37 @@ class Table(object):
 
     def insert(self, **row):
         # tx
+        # row is checked and completed before it is logged, so
+        # write-ahead log has only rows which are applied
+        self._prepare_row(row)
+
         tx = self.store.get_current_transaction()
         tx.log((self.db, self, Table._commit_insert, (self,), row))
 
     def _commit_insert(self, **row):
+        key = self._prepare_row(row)
+
+        # insert key
+        wal = self.store.wal
+
+        with self.lock:
+            if wal:
+                segment = wal.get_last_segment()
+                memtable_segment = self.memtable.wal_segment
+
+                if memtable_segment is None or segment < memtable_segment:
+                    self.memtable.wal_segment = segment
+
+            self.memtable.set(key, row, self.store.get_commit_sequence())
+
+        # commit if required
+        self.commit_if_required()
+
+    def _prepare_row(self, row):
+        '''
+        Check row against schema, set missing columns to None and
+        return primary key of row.
+        '''
         # check if all columns exist in table's schema
         # compare against schema
         for k, v in row.items():
@@ -111,366 +480,433 @@ class Table(object):
 
         # build key
         key = tuple(row[k] for k in self.schema.primary_key)
+        return key
+
+    def bulk_load(self, rows, presorted=False):
+        '''
+        Load rows directly into new sstables, bypassing transactions,
+        write-ahead log and memtable. Rows are sorted externally in runs
+        of BULK_LOAD_RUN_N_ITEMS rows spilled to temporary files, unless
+        presorted. For equal primary keys last row wins.
+
+        Sstables are written under temporary names and registered at
+        once as newest sstables of table. Returns number of rows loaded.
+        '''
+        if presorted:
+            items = self._iter_presorted(rows)
+        else:
+            items = self._iter_sorted(rows)
 
-        # insert key
-        self.memtable.set(key, row)
+        n_rows = [0]
 
-        # commit if required
-        self.commit_if_required()
+        def iter_rows():
+            for key, row in self._iter_last_by_key(items):
+                n_rows[0] += 1
+                yield row
+
+        # write sstables under temporary names
+        sstables = []
+        rows = iter_rows()
+
+        try:
+            for row in rows:
+                chunk = itertools.chain([row], itertools.islice(rows, self.BULK_LOAD_SSTABLE_N_ITEMS - 1))
+                t = 'tmp%i_%i' % (os.getpid(), next(SSTable.ids))
+                sst = self.sstable_class(self, t, rows=chunk)
+                sstables.append(sst)
+        except:
+            for sst in sstables:
+                sst.remove()
+
+            raise
+
+        self._register_sstables(sstables)
+        return n_rows[0]
+
+    def _register_sstables(self, sstables):
+        '''
+        Rename sstables written under temporary names and add them as
+        newest sstables of table.
+        '''
+        if not sstables:
+            return
+
+        # rows in memtables are older than loaded rows
+        self.commit()
+
+        with self.flush_lock:
+            ts = self._get_next_ts(len(sstables))
+            new_sstables = []
+
+            for sst, t in zip(sstables, ts):
+                new_sst = self.sstable_class(self, t)
+
+                # data file is renamed last, so it exists only with all components
+                for path, new_path in reversed(zip(sst.get_paths(), new_sst.get_paths())):
+                    os.rename(path, new_path)
+
+                new_sst.open()
+                new_sstables.append(new_sst)
+
+            # all sstables are published by one manifest edit
+            self.manifest.apply([], new_sstables)
+
+            with self.lock:
+                self.sstables = self.sstables + new_sstables
+
+        compactor = self.store.compactor
+
+        if compactor:
+            compactor.notify(self)
+
+    def _iter_presorted(self, rows):
+        prev_key = None
+
+        for seq, row in enumerate(rows):
+            row = dict(row)
+            key = self._prepare_row(row)
+
+            if prev_key is not None and key < prev_key:
+                raise Exception('rows are not sorted by primary key at %r' % (key,))
+
+            prev_key = key
+            yield key, seq, row
+
+    def _iter_sorted(self, rows):
+        '''
+        External merge sort of rows by primary key and input order.
+        '''
+        runs = []
+        run = []
+
+        try:
+            for seq, row in enumerate(rows):
+                row = dict(row)
+                key = self._prepare_row(row)
+                run.append((key, seq, row))
+
+                if len(run) >= self.BULK_LOAD_RUN_N_ITEMS:
+                    runs.append(self._spill_run(run))
+                    run = []
+
+            run.sort()
+
+            if not runs:
+                for item in run:
+                    yield item
+
+                return
+
+            iters = [self._iter_run(f) for f in runs]
+            iters.append(iter(run))
+
+            for item in heapq.merge(*iters):
+                yield item
+        finally:
+            for f in runs:
+                f.close()
+
+    def _spill_run(self, run):
+        run.sort()
+        f = tempfile.TemporaryFile(dir=self.get_path())
 
-    def get(self, *args):
+        for item in run:
+            marshal.dump(item, f)
+
+        f.seek(0)
+        return f
+
+    def _iter_run(self, f):
+        while True:
+            try:
+                yield marshal.load(f)
+            except EOFError as e:
+                break
+
+    def _iter_last_by_key(self, items):
+        prev_key = None
+        prev_row = None
+
+        for key, seq, row in items:
+            if prev_row is not None and key != prev_key:
+                yield prev_key, prev_row
+
+            prev_key = key
+            prev_row = row
+
+        if prev_row is not None:
+            yield prev_key, prev_row
+
+    def get(self, *args, **kwargs):
         # key
         key = args
 
         # deferred
         d = Deferred()
 
-        # tx
+        # tx, read as of snapshot if given
         tx = self.store.get_current_transaction()
-        tx.log((self.db, self.table, Table._commit_get, (self, d, key), {}))
+        snapshot = kwargs.get('snapshot') or tx.snapshot
+        tx.log((self.db, self.table, Table._commit_get, (self, d, key), {'snapshot': snapshot}))
 
         return d
     
-    def _commit_get(self, d, key):
-        v, op, sp = self._get(key)
+    def _commit_get(self, d, key, snapshot=None):
+        try:
+            v, op, sp = self._get(key, snapshot=snapshot)
+        except KeyError as e:
+            v = None
+
         d.set(v)
 
-    def select(self, *args):
-        # deferred, queue
+    def get_many(self, keys, snapshot=None):
+        # deferred list of rows in order of keys, None for missing key
+        keys = [self._get_scan_key(key) for key in keys]
         d = Deferred()
-        q = Query(self.store, d)
 
-        # tx
+        # tx, read as of snapshot if given
         tx = self.store.get_current_transaction()
-        tx.log((self.db, self.table, Table._commit_select, (self, d, q), {}))
+        snapshot = snapshot or tx.snapshot
+        tx.log((self.db, self.table, Table._commit_get_many, (self, d, keys), {'snapshot': snapshot}))
 
-        return q
+        return d
 
-    def _cmp_ranges(self, a, b):
-        ac, aop, av = a
-        bc, bop, bv = b
-
-        if ac == bc:
-            if aop in ('<', '<=') and bop in ('<', '<='):
-                return cmp(av, bv)
-            elif aop in ('>=', '>') and bop in ('>', '>='):
-                return cmp(av, bv)
-            elif aop in ('>=', '>') and bop in ('<', '<='):
-                if av < bv:
-                    return -1
-                elif av > bv:
-                    return 1
-                else:
-                    return 0
-            elif aop in ('<', '<=') and bop in ('>=', '>'):
-                if av < bv:
-                    return 0
-                elif av > bv:
-                    return 1
-                else:
-                    return 0
-            else:
-                return 0
-        else:
-            return cmp(ac, bc)
-
-    def _eval_expr(self, expr):
-        # print '_eval_expr:', expr
-        ranges = []
-        
-        if expr.op == 'and':
-            l_ranges = self._eval_expr(expr.left)
-            r_ranges = self._eval_expr(expr.right)
-            _ranges = list(set(l_ranges + r_ranges))
-            _ranges.sort(cmp=lambda a, b: self._cmp_ranges(a, b))
-            # print '_ranges[0]:', _ranges
-
-            # group by column name
-            ranges_by_column = {}
-
-            for r in _ranges:
-                c, op, v = r
-
-                if c in ranges_by_column:
-                    rs = ranges_by_column[c]
-                    rs.append(r)
-                else:
-                    ranges_by_column[c] = [r]
+    def _commit_get_many(self, d, keys, snapshot=None):
+        rows = self._get_many(keys, snapshot)
+        d.set([rows.get(key) for key in keys])
+
+    def _get_many(self, keys, snapshot=None):
+        '''
+        Rows by primary key. Keys are sorted once and each sstable is
+        searched only for remaining keys within its key range.
+        '''
+        remaining = sorted(set(keys))
+        rows = {}
+
+        with self.structures(snapshot) as (memtables, sstables):
+            for memtable in memtables:
+                for key in remaining:
+                    try:
+                        rows[key], op, sp = memtable.get(key)
+                    except KeyError as e:
+                        pass
+
+                remaining = [key for key in remaining if key not in rows]
+
+            for sst in sstables:
+                if not remaining:
+                    break
 
-            # print 'ranges_by_column[0]:', ranges_by_column
+                key_range = sst.get_key_range()
 
-            # optimize ranges by column
-            for c, rs in ranges_by_column.items():
-                if len(rs) == 1:
+                if key_range is None:
                     continue
 
-                _rs = []
-
-                for a, b in zip(rs[:-1], rs[1:]):
-                    ac, aop, av = a
-                    bc, bop, bv = b
-
-                    if aop == '<':
-                        if bop == '<':
-                            r = (ac, '<', min(av, bv))
-                            _rs.append(r)
-                        elif bop == '<=':
-                            if av <= bv:
-                                _rs.append(a)
-                            else:
-                                _rs.append(b)
-                        elif bop == '==':
-                            if av > bv:
-                                _rs.append(b)
-                        elif bop == '>=':
-                            if av > bv:
-                                _rs.append(b)
-                                _rs.append(a)
-                        elif bop == '>':
-                            if av > bv:
-                                _rs.append(b)
-                                _rs.append(a)
-                    elif aop == '<=':
-                        if bop == '<':
-                            if av < bv:
-                                _rs.append(a)
-                            else:
-                                _rs.append(b)
-                        elif bop == '<=':
-                            r = (ac, '<=', min(av, bv))
-                            _rs.append(r)
-                        elif bop == '==':
-                            if av >= bv:
-                                _rs.append(b)
-                        elif bop == '>=':
-                            if av == bv:
-                                r = (ac, '==', av)
-                                _rs.append(r)
-                            elif av > bv:
-                                _rs.append(b)
-                                _rs.append(a)
-                        elif bop == '>':
-                            if av > bv:
-                                _rs.append(b)
-                                _rs.append(a)
-                    elif aop == '==':
-                        if bop == '<':
-                            if av < bv:
-                                _rs.append(a)
-                        elif bop == '<=':
-                            if av <= bv:
-                                _rs.append(a)
-                        elif bop == '==':
-                            if av == bv:
-                                _rs.append(a)
-                        elif bop == '>=':
-                            if av >= bv:
-                                _rs.append(a)
-                        elif bop == '>':
-                            if av > bv:
-                                _rs.append(a)
-                    elif aop == '>=':
-                        if bop == '<':
-                            if av < bv:
-                                _rs.append(a)
-                                _rs.append(b)
-                        elif bop == '<=':
-                            if av == bv:
-                                r = (ac, '==', av)
-                                _rs.append(r)
-                            elif av < bv:
-                                _rs.append(a)
-                                _rs.append(b)
-                        elif bop == '==':
-                            if av == bv:
-                                _rs.append(b)
-                        elif bop == '>=':
-                            r = (ac, '>=', max(av, bv))
-                            _rs.append(r)
-                        elif bop == '>':
-                            if av <= bv:
-                                _rs.append(b)
-                            else:
-                                _rs.append(a)
-                    elif aop == '>':
-                        if bop == '<':
-                            if av < bv:
-                                _rs.append(a)
-                                _rs.append(b)
-                        elif bop == '<=':
-                            if av < bv:
-                                _rs.append(a)
-                                _rs.append(b)
-                        elif bop == '==':
-                            if av < bv:
-                                _rs.append(b)
-                        elif bop == '>=':
-                            if av < bv:
-                                _rs.append(b)
-                            else:
-                                _rs.append(a)
-                        elif bop == '>':
-                            r = (ac, '>=', max(av, bv))
-                            _rs.append(r)
-
-                ranges_by_column[c] = _rs
-
-            # print 'ranges_by_column[1]:', ranges_by_column
-            
-            _ranges = []
-            
-            for c in sorted(ranges_by_column.keys()):
-                rs = ranges_by_column[c]
-                _ranges.extend(rs)
-            
-            # print '_ranges[1]:', _ranges
-            ranges.extend(_ranges)
-        elif expr.op == 'or':
-            # FIXME: OR is not planned for now, but have it in mind
-            pass
-        else:
-            k = (expr.right,)
-            cs = (expr.left.name,)
-
-            if expr.op == '==':
-                v, op, sp = self._get(k, cs)
-            elif expr.op == '<':
-                v, op, sp = self._get_lt(k, cs)
-            elif expr.op == '<=':
-                v, op, sp = self._get_le(k, cs)
-            elif expr.op == '>':
-                v, op, sp = self._get_gt(k, cs)
-            elif expr.op == '>=':
-                v, op, sp = self._get_ge(k, cs)
-            
-            ranges.append((cs[0], expr.op, k[0]))
-
-        return ranges
-
-    def _commit_select(self, d, q):
-        rows = []   # get from keys
-        keys = []   # get from ranges
-        ranges = self._eval_expr(q.where_clause)
-        print 'ranges:', ranges
-
-        ranges_by_column = {}
-
-        for r in ranges:
-            c, op, v = r
-
-            if c in ranges_by_column:
-                rs = ranges_by_column[c]
-                rs.append(r)
-            else:
-                ranges_by_column[c] = [r]
+                # only keys within key range of sstable
+                first_key, last_key = key_range
+                low = bisect.bisect_left(remaining, first_key)
+                high = bisect.bisect_right(remaining, last_key)
 
-        print 'ranges_by_column:', ranges_by_column
+                if low == high:
+                    continue
 
-        keys_by_column = {}
+                found = sst.get_many(remaining[low:high])
 
-        for c in sorted(ranges_by_column.keys()):
-            rs = ranges_by_column[c]
+                if found:
+                    rows.update(found)
+                    remaining = [key for key in remaining if key not in found]
 
-            if len(rs) == 1:
-                c, op, v = rs[0]
-                key = (v,)
-                columns = (c,)
-                # row, offset_pos, sstable_pos = self._get(key, columns)
-            elif len(rs) == 2:
-                a, b = rs
-                ac, aop, av = a
-                bc, bop, bv = b
-            else:
-                raise ValueError
+        return rows
+
+    def select(self, *args, **kwargs):
+        # deferred, queue
+        d = Deferred()
+        q = Query(self.store, d)
+        q.select(*args)
+
+        # tx, read as of snapshot if given
+        tx = self.store.get_current_transaction()
+        snapshot = kwargs.get('snapshot') or tx.snapshot
+        tx.log((self.db, self.table, Table._commit_select, (self, d, q), {'snapshot': snapshot}))
+
+        return q
+
+    def _commit_select(self, d, q, snapshot=None):
+        if q.is_aggregate():
+            rows = Aggregator(self, q, snapshot).execute()
+        else:
+            rows = Planner(self, q, snapshot).execute()
 
         d.set(rows)
 
-    def _get(self, key, columns=None):
-        try:
-            v, op, sp = self.memtable.get(key, columns)
-        except KeyError as e:
-            for sst in reversed(self.sstables):
-                try:
-                    v, op, sp = sst.get(key, columns)
-                    break
-                except KeyError as e:
-                    pass
-            else:
-                raise KeyError
+    @contextmanager
+    def structures(self, snapshot=None):
+        '''
+        Memtables and sstables ordered from newest to oldest, current or
+        as of snapshot. Sstables are pinned, so compaction does not close
+        them while they are used.
+        '''
+        if snapshot is not None:
+            yield snapshot.get_structures(self)
+            return
 
-        return v, op, sp
+        cache = self.store.table_cache
 
-    def _get_eq(self, key, columns=None):
-        try:
-            v, op, sp = self.memtable.get(key, columns)
-        except KeyError as e:
-            for sst in reversed(self.sstables):
-                try:
-                    v, op, sp = sst.get(key, columns)
-                    break
-                except KeyError as e:
-                    pass
-            else:
-                raise KeyError
+        with self.lock:
+            memtables = [self.memtable] + self.immutable_memtables[::-1]
+            sstables = self.sstables[::-1]
 
-        return v, op, sp
+            if cache:
+                for sst in sstables:
+                    cache.acquire(sst)
 
-    def _get_lt(self, key, columns=None):
         try:
-            v, op, sp = self.memtable.get_lt(key, columns)
-        except KeyError as e:
-            for sst in reversed(self.sstables):
-                try:
-                    v, op, sp = sst.get_lt(key, columns)
-                    break
-                except KeyError as e:
-                    pass
+            yield memtables, sstables
+        finally:
+            if cache:
+                for sst in sstables:
+                    cache.release(sst)
+
+    def _get_scan_key(self, key):
+        if key is None or isinstance(key, tuple):
+            return key
+
+        return (key,)
+
+    def scan(self, start=None, end=None, reverse=False, snapshot=None):
+        '''
+        Generator of rows whose primary key is in [start, end), ordered by
+        primary key, or in descending order if reverse. Keys can be
+        prefixes of primary key, None means unbounded.
+
+        Cursors over memtables and sstables are merged lazily and only
+        newest version of each primary key is yielded, as of snapshot
+        if given.
+        '''
+        start = self._get_scan_key(start)
+        end = self._get_scan_key(end)
+
+        with self.structures(snapshot) as (memtables, sstables):
+            # cursors ordered from newest to oldest
+            cursors = [m.iter_range(start, end, reverse) for m in memtables]
+            cursors.extend(sst.iter_range(start, end, reverse) for sst in sstables)
+
+            for row in self._merge_cursors(cursors, reverse):
+                yield row
+
+    def scan_parallel(self, start=None, end=None, snapshot=None):
+        '''
+        List of rows whose primary key is in [start, end), ordered by
+        primary key. Sstables are scanned on store's process pool if
+        it is enabled and scan is large enough, otherwise as scan.
+        '''
+        start = self._get_scan_key(start)
+        end = self._get_scan_key(end)
+        scanner = self.store.get_parallel_scanner()
+
+        with self.structures(snapshot) as (memtables, sstables):
+            if scanner is not None and scanner.is_worth(sstables):
+                return scanner.scan(self, memtables, sstables, start, end)
+
+            cursors = [m.iter_range(start, end) for m in memtables]
+            cursors.extend(sst.iter_range(start, end) for sst in sstables)
+            return list(self._merge_cursors(cursors))
+
+    @staticmethod
+    def _merge_cursors(cursors, reverse=False):
+        '''
+        Heap merge of cursors yielding (key, row) ordered by key. Cursors
+        are ordered from newest to oldest, and for each key only row of
+        newest cursor is yielded.
+        '''
+        heap = []
+
+        for rank, cursor in enumerate(cursors):
+            for key, row in cursor:
+                sort_key = ReversedKey(key) if reverse else key
+                heap.append((sort_key, rank, key, row, cursor))
+                break
+
+        heapq.heapify(heap)
+        prev_key = None
+        first = True
+
+        while heap:
+            sort_key, rank, key, row, cursor = heap[0]
+
+            if first or key != prev_key:
+                yield row
+
+            prev_key = key
+            first = False
+
+            for key, row in cursor:
+                sort_key = ReversedKey(key) if reverse else key
+                heapq.heapreplace(heap, (sort_key, rank, key, row, cursor))
+                break
             else:
-                raise KeyError
+                heapq.heappop(heap)
+
+    def _get_from(self, name, key, columns=None, snapshot=None):
+        '''
+        Find row in newest memtable or sstable that has it, as of
+        snapshot if given. Snapshot reads do not lock table, other reads
+        lock it only to list structures and to probe active memtable.
+        '''
+        if snapshot is not None:
+            memtables, sstables = snapshot.get_structures(self)
+            return self._get_from_structures(name, key, columns, memtables + sstables)
+
+        with self.structures() as (memtables, sstables):
+            return self._get_from_structures(name, key, columns, memtables + sstables, self.lock)
+
+    def _get_from_structures(self, name, key, columns, structures, lock=None):
+        if __debug__:
+            metrics = self.store.metrics
+            n_sstables = 0
+
+        for s in structures:
+            if __debug__:
+                if not isinstance(s, MemTable):
+                    n_sstables += 1
+
+            try:
+                # active memtable is changed under table lock, others
+                # do not change
+                if lock is not None and s is self.memtable:
+                    with lock:
+                        r = getattr(s, name)(key, columns)
+                else:
+                    r = getattr(s, name)(key, columns)
+            except KeyError as e:
+                continue
 
-        return v, op, sp
+            if __debug__:
+                metrics.incr('table.get.memtable_hits' if not n_sstables else 'table.get.sstable_hits')
+                metrics.add('table.get.sstables_probed', n_sstables)
+
+            return r
+
+        if __debug__:
+            metrics.incr('table.get.misses')
+            metrics.add('table.get.sstables_probed', n_sstables)
+
+        raise KeyError(key)
+
+    def _get(self, key, columns=None, snapshot=None):
+        return self._get_from('get', key, columns, snapshot)
+
+    def _get_eq(self, key, columns=None):
+        return self._get_from('get', key, columns)
+
+    def _get_lt(self, key, columns=None):
+        return self._get_from('get_lt', key, columns)
 
     def _get_le(self, key, columns=None):
-        try:
-            v, op, sp = self.memtable.get_le(key, columns)
-        except KeyError as e:
-            for sst in reversed(self.sstables):
-                try:
-                    v, op, sp = sst.get_le(key, columns)
-                    break
-                except KeyError as e:
-                    pass
-            else:
-                raise KeyError
+        return self._get_from('get_le', key, columns)
 
-        return v, op, sp
-    
     def _get_gt(self, key, columns=None):
-        try:
-            v, op, sp = self.memtable.get_gt(key, columns)
-        except KeyError as e:
-            for sst in reversed(self.sstables):
-                try:
-                    v, op, sp = sst.get_gt(key, columns)
-                    break
-                except KeyError as e:
-                    pass
-            else:
-                raise KeyError
+        return self._get_from('get_gt', key, columns)
 
-        return v, op, sp
-    
     def _get_ge(self, key, columns=None):
-        try:
-            v, op, sp = self.memtable.get_ge(key, columns)
-        except KeyError as e:
-            for sst in reversed(self.sstables):
-                try:
-                    v, op, sp = sst.get_ge(key, columns)
-                    break
-                except KeyError as e:
-                    pass
-            else:
-                raise KeyError
-
-        return v, op, sp
+        return self._get_from('get_ge', key, columns)
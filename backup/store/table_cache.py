@@ -0,0 +1,105 @@
+__all__ = ['TableCache']
+
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+class TableCache(object):
+    '''
+    TableCache bounds number of files held open by sstables in store.
+
+    SSTables open their files lazily, only while pinned, and report them
+    here. When there are more than max_open_files, least recently used
+    sstables that are not pinned have their files closed. They are
+    reopened on next access.
+    '''
+
+    MAX_OPEN_FILES = 1000
+
+    def __init__(self, store, max_open_files=None):
+        self.store = store
+        self.max_open_files = max_open_files or self.MAX_OPEN_FILES
+        self.lock = threading.Lock()
+        self.sstables = OrderedDict()
+        self.n_open_files = 0
+
+        # counters
+        self.n_opens = 0
+        self.n_evictions = 0
+
+    def acquire(self, sst):
+        '''
+        Pin sstable, so its files are not closed while it is being read.
+        '''
+        with self.lock:
+            sst.refs += 1
+
+            # most recently used at the end
+            if sst in self.sstables:
+                del self.sstables[sst]
+                self.sstables[sst] = None
+
+    def release(self, sst):
+        close = False
+        evict = False
+
+        with self.lock:
+            sst.refs -= 1
+
+            if not sst.refs and sst.removed:
+                close = True
+
+            # files opened while sstables were pinned are closed now
+            if not sst.refs and self.n_open_files > self.max_open_files:
+                evict = True
+
+        if close:
+            sst.close()
+
+        if evict:
+            self.evict()
+
+    def opened(self, sst, n_files=1):
+        '''
+        SSTable opened n_files files.
+        '''
+        with self.lock:
+            self.n_open_files += n_files
+            self.n_opens += n_files
+
+            if sst not in self.sstables:
+                self.sstables[sst] = None
+
+        self.evict()
+
+    def closed(self, sst, n_files):
+        '''
+        SSTable closed all its files.
+        '''
+        with self.lock:
+            self.n_open_files -= n_files
+            self.sstables.pop(sst, None)
+
+    def evict(self):
+        with self.lock:
+            while self.n_open_files > self.max_open_files:
+                # least recently used sstable which is not pinned,
+                # pinning is done under lock so it can not be pinned now
+                for sst in self.sstables:
+                    if not sst.refs:
+                        break
+                else:
+                    break
+
+                del self.sstables[sst]
+                self.n_open_files -= sst._close_files()
+                self.n_evictions += 1
+
+    def get_stats(self):
+        return {
+            'open_files': self.n_open_files,
+            'max_open_files': self.max_open_files,
+            'opens': self.n_opens,
+            'evictions': self.n_evictions,
+        }
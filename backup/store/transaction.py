@@ -4,11 +4,17 @@ import time
 import thread
 import threading
 
+from .table import Table
+from .lock import LockManager
+
 class Transaction(object):
-    def __init__(self, store):
+    def __init__(self, store, snapshot=None):
         self.store = store
         self._log = []
 
+        # reads of transaction are done as of snapshot, without locks
+        self.snapshot = snapshot
+
     def __enter__(self):
         self.begin()
         return self
@@ -30,30 +36,39 @@ class Transaction(object):
     def log(self, inst):
         self._log.append(inst)
 
-    def check(self):
-        # print 'check:', self
-        conflict = False
+    def get_lock_requests(self):
+        '''
+        Locks required by logged operations: intent lock on table and
+        lock on each key, or shared lock on whole table for selects.
+        Reads as of snapshot do not lock.
+        '''
+        requests = []
+
+        for inst in self._log:
+            db, table, f, args, kwargs = inst
+            resource = (db.db_name, table.table_name)
 
-        with self.store.check_lock:
-            for tx in self.store.commiting_transactions:
-                for a in self._log:
-                    for b in tx._log:
-                        # detect conflict
-                        # compare databases and tables
-                        if a[0] == b[0] and a[1] == b[1]:
-                            # compare operation's method/function
-                            if a[3] == b[3] == Table._commit_insert:
-                                conflict = True
-                                break
+            if f != Table._commit_insert and kwargs.get('snapshot'):
+                continue
 
-                    if conflict:
-                        break
+            if f == Table._commit_insert:
+                key = tuple(kwargs.get(c) for c in table.schema.primary_key)
+                requests.append((resource, LockManager.IX))
+                requests.append((resource + (key,), LockManager.X))
+            elif f == Table._commit_get:
+                self_, d, key = args
+                requests.append((resource, LockManager.IS))
+                requests.append((resource + (key,), LockManager.S))
+            elif f == Table._commit_get_many:
+                self_, d, keys = args
+                requests.append((resource, LockManager.IS))
 
-                if conflict:
-                    break
+                for key in keys:
+                    requests.append((resource + (key,), LockManager.S))
+            else:
+                requests.append((resource, LockManager.S))
 
-        passed = not conflict
-        return passed
+        return requests
 
     def commit(self):
         # print 'commit:', self
@@ -61,9 +76,67 @@ class Transaction(object):
             db, table, f, args, kwargs = inst
             f(*args, **kwargs)
 
+    def has_writes(self):
+        return any(inst[2] == Table._commit_insert for inst in self._log)
+
+    def get_wal_ops(self):
+        ops = []
+
+        for inst in self._log:
+            db, table, f, args, kwargs = inst
+
+            if f == Table._commit_insert:
+                ops.append((db.db_name, table.table_name, kwargs))
+
+        return ops
+
     def execute(self):
         # print 'execute:', self
-        while not self.check():
-            time.sleep(0.001)
+        if __debug__:
+            metrics = self.store.metrics
+            t0 = metrics.now()
+
+        lock_manager = self.store.lock_manager
+        requests = self.get_lock_requests()
+        lock_manager.acquire_all(self, requests, self.store.lock_timeout)
+
+        if __debug__:
+            metrics.observe('transaction.lock_wait_us', t0)
+            t1 = metrics.now()
+
+        try:
+            with self.store.commit_lock.shared():
+                if __debug__:
+                    metrics.observe('transaction.commit_wait_us', t1)
+
+                # rows of transaction are set with its sequence number
+                if self.has_writes():
+                    self.store.local.seq = self.store.next_sequence()
+
+                # write-ahead log
+                wal = self.store.wal
+                ops = self.get_wal_ops() if wal else None
+
+                if __debug__:
+                    t2 = metrics.now()
+
+                segment = wal.append(ops) if ops else None
+
+                if __debug__:
+                    if ops:
+                        metrics.observe('transaction.wal_us', t2)
+
+                try:
+                    self.commit()
+                finally:
+                    self.store.local.seq = 0
+
+                    if segment is not None:
+                        wal.release(segment)
+        finally:
+            lock_manager.release_all(self)
 
-        self.commit()
+        if __debug__:
+            metrics.incr('transaction.commits')
+            metrics.add('transaction.ops', len(self._log))
+            metrics.observe('transaction.execute_us', t0)
@@ -0,0 +1,357 @@
+__all__ = ['WAL']
+
+import os
+import sys
+import zlib
+import struct
+import marshal
+import threading
+from collections import defaultdict
+
+class WAL(object):
+    '''
+    Write-ahead log of committed transactions shared by all tables in store.
+
+    Concurrent transactions are grouped, so one write and one fsync
+    are shared by all transactions waiting at that moment. When write or
+    fsync of group fails, all its transactions get the error.
+    '''
+
+    SYNC_ALWAYS = 'always'
+    SYNC_INTERVAL = 'interval'
+    SYNC_NONE = 'none'
+
+    RECORD_HEADER_FORMAT = b'!II'
+    RECORD_HEADER_SIZE = struct.calcsize(RECORD_HEADER_FORMAT)
+
+    def __init__(self, store, sync_mode=SYNC_ALWAYS, sync_interval=0.01):
+        if sync_mode not in (self.SYNC_ALWAYS, self.SYNC_INTERVAL, self.SYNC_NONE):
+            raise Exception('unsupported wal sync mode %r' % sync_mode)
+
+        self.store = store
+        self.sync_mode = sync_mode
+        self.sync_interval = sync_interval
+        self.f = None
+        self.segment = None
+        self.segments = []
+        self.opened = False
+
+        # group commit
+        self.cond = threading.Condition(threading.Lock())
+        self.buffer = []
+        self.writing = False
+        self.next_batch = 0
+        self.written_batch = -1
+        self.written_segment = None
+
+        # failed batch -> [sys.exc_info(), number of followers to raise it]
+        self.failed_batches = {}
+
+        # segment of last append in current thread
+        self.local = threading.local()
+
+        # appends not yet applied to memtables, by segment
+        self.pending = defaultdict(int)
+
+        # recovered rows by (db_name, table_name) and their oldest segment
+        self.recovered = defaultdict(list)
+        self.recovered_segments = {}
+
+        # interval sync
+        self.dirty = False
+        self.sync_thread = None
+        self.sync_event = threading.Event()
+
+        # counters
+        self.n_records = 0
+        self.n_writes = 0
+        self.n_syncs = 0
+        self.n_errors = 0
+
+    def get_path(self):
+        return os.path.join(self.store.get_path(), 'wal')
+
+    def get_segment_path(self, segment):
+        filename = 'wal-%020i.log' % segment
+        return os.path.join(self.get_path(), filename)
+
+    def is_opened(self):
+        return self.opened
+
+    def open(self):
+        dirpath = self.get_path()
+
+        if not os.path.exists(dirpath):
+            try:
+                os.makedirs(dirpath)
+            except OSError as e:
+                raise Exception('could not create wal %r' % dirpath)
+
+        # existing segments
+        for filename in os.listdir(dirpath):
+            if not filename.startswith('wal-'):
+                continue
+
+            s = filename.index('wal-') + len('wal-')
+            e = filename.index('.log')
+            segment = int(filename[s:e])
+            self.segments.append(segment)
+
+        self.segments.sort()
+
+        for segment in self.segments:
+            self._replay_segment(segment)
+
+        # new segment for writing
+        segment = self.segments[-1] + 1 if self.segments else 0
+        self._open_segment(segment)
+
+        if self.sync_mode == self.SYNC_INTERVAL:
+            self.sync_thread = threading.Thread(target=self._run_sync)
+            self.sync_thread.daemon = True
+            self.sync_thread.start()
+
+        self.opened = True
+
+    def close(self):
+        self.opened = False
+
+        if self.sync_thread:
+            self.sync_event.set()
+            self.sync_thread.join()
+            self.sync_thread = None
+
+        with self.cond:
+            while self.writing:
+                self.cond.wait()
+
+            if self.sync_mode != self.SYNC_NONE:
+                self._sync()
+
+            self.f.close()
+            self.f = None
+
+    def _open_segment(self, segment):
+        self.f = open(self.get_segment_path(segment), 'ab')
+        self.segment = segment
+
+        if segment not in self.segments:
+            self.segments.append(segment)
+
+    def _replay_segment(self, segment):
+        with open(self.get_segment_path(segment), 'rb') as f:
+            data = f.read()
+
+        pos = 0
+
+        while pos + self.RECORD_HEADER_SIZE <= len(data):
+            size, crc = struct.unpack_from(self.RECORD_HEADER_FORMAT, data, pos)
+            pos += self.RECORD_HEADER_SIZE
+            blob = data[pos:pos + size]
+
+            # torn write at the end of log
+            if len(blob) != size or zlib.crc32(blob) & 0xffffffff != crc:
+                break
+
+            pos += size
+
+            for db_name, table_name, row in marshal.loads(blob):
+                table_id = (db_name, table_name)
+                self.recovered[table_id].append(row)
+                self.recovered_segments.setdefault(table_id, segment)
+
+    def pop_recovered(self, db_name, table_name):
+        '''
+        Rows recovered for table and oldest wal segment they came from.
+        '''
+        table_id = (db_name, table_name)
+        rows = self.recovered.pop(table_id, [])
+        segment = self.recovered_segments.pop(table_id, None)
+        return rows, segment
+
+    def append(self, ops):
+        '''
+        Append transaction's ops, returns when they are written
+        (and synced if sync mode is "always").
+        '''
+        blob = marshal.dumps(ops)
+        header = struct.pack(self.RECORD_HEADER_FORMAT, len(blob), zlib.crc32(blob) & 0xffffffff)
+
+        with self.cond:
+            self.buffer.append(header)
+            self.buffer.append(blob)
+            batch = self.next_batch
+
+            # wait for leader of earlier batch
+            while self.writing and self.written_batch < batch and batch not in self.failed_batches:
+                self.cond.wait()
+
+            if batch in self.failed_batches:
+                failed = self.failed_batches[batch]
+                failed[1] -= 1
+
+                if not failed[1]:
+                    del self.failed_batches[batch]
+
+                exc_type, exc_value, exc_tb = failed[0]
+                raise exc_type, exc_value, exc_tb
+
+            if self.written_batch >= batch:
+                segment = self.written_segment
+                self.pending[segment] += 1
+                self.local.segment = segment
+                return segment
+
+            # become leader of batch
+            self.writing = True
+            buffer = self.buffer
+            self.buffer = []
+            self.next_batch += 1
+            f = self.f
+            segment = self.segment
+
+        pos = None
+
+        try:
+            pos = f.tell()
+            f.write(b''.join(buffer))
+            f.flush()
+
+            if self.sync_mode == self.SYNC_ALWAYS:
+                os.fsync(f.fileno())
+                self.n_syncs += 1
+            else:
+                self.dirty = True
+        except Exception as e:
+            exc_info = sys.exc_info()
+            self._truncate(f, pos)
+
+            # batch is not durable, followers raise error too
+            with self.cond:
+                self.writing = False
+                self.n_errors += 1
+                n_followers = len(buffer) // 2 - 1
+
+                if n_followers:
+                    self.failed_batches[batch] = [exc_info, n_followers]
+
+                self.cond.notify_all()
+
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+        with self.cond:
+            self.writing = False
+            self.written_batch = batch
+            self.written_segment = segment
+            self.n_records += len(buffer) // 2
+            self.n_writes += 1
+            self.pending[segment] += 1
+            self.cond.notify_all()
+
+        self.local.segment = segment
+        return segment
+
+    def _truncate(self, f, pos):
+        '''
+        Cut off part of failed write, so later records follow last
+        complete record and are replayed.
+        '''
+        if pos is None:
+            return
+
+        try:
+            f.seek(pos)
+            f.truncate()
+        except (IOError, OSError) as e:
+            pass
+
+    def release(self, segment):
+        '''
+        Ops appended to segment were applied to memtables.
+        '''
+        with self.cond:
+            self.pending[segment] -= 1
+
+            if not self.pending[segment]:
+                del self.pending[segment]
+
+    def get_last_segment(self):
+        '''
+        Segment of last append in current thread.
+        '''
+        return getattr(self.local, 'segment', None)
+
+    def rotate(self):
+        '''
+        Start new segment, returns its number.
+        '''
+        with self.cond:
+            while self.writing:
+                self.cond.wait()
+
+            if self.sync_mode != self.SYNC_NONE:
+                self._sync()
+
+            self.f.close()
+            self._open_segment(self.segment + 1)
+            return self.segment
+
+    def collect(self):
+        '''
+        Remove segments which have no rows left in any memtable.
+        '''
+        with self.cond:
+            min_segment = self.segment
+
+            for segment in self.pending:
+                min_segment = min(min_segment, segment)
+
+        for segment in self.recovered_segments.values():
+            min_segment = min(min_segment, segment)
+
+        for db in list(self.store.databases.values()):
+            for table in list(db.tables):
+                segment = table.get_wal_segment()
+
+                if segment is not None:
+                    min_segment = min(min_segment, segment)
+
+        with self.cond:
+            for segment in list(self.segments):
+                if segment >= min_segment:
+                    continue
+
+                path = self.get_segment_path(segment)
+
+                if os.path.exists(path):
+                    os.remove(path)
+
+                self.segments.remove(segment)
+
+    def _sync(self):
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.dirty = False
+        self.n_syncs += 1
+
+    def _run_sync(self):
+        while not self.sync_event.is_set():
+            self.sync_event.wait(self.sync_interval)
+
+            if self.sync_event.is_set() or not self.dirty:
+                continue
+
+            with self.cond:
+                while self.writing:
+                    self.cond.wait()
+
+                self._sync()
+
+    def get_stats(self):
+        return {
+            'records': self.n_records,
+            'writes': self.n_writes,
+            'syncs': self.n_syncs,
+            'errors': self.n_errors,
+            'segments': len(self.segments),
+        }
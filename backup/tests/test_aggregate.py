@@ -0,0 +1,95 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+BACKUP_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKUP_PATH)
+
+from store import Store
+from store.query import Query
+from store.aggregate import Count, Sum, Min, Max, Avg, Aggregator
+
+COLUMNS = dict(a='int', d='int', f='float', e='bool', one='bool', none='bool')
+
+def get_row(a):
+    return dict(
+        a=a,
+        d=None if a % 7 == 0 else a - 50,
+        f=None if a % 5 == 0 else a * 0.5,
+        e=None if a % 3 == 0 else a % 2 == 0,
+        one=True if a == 10 else None,
+        none=None,
+    )
+
+class AggregatePathsTest(unittest.TestCase):
+    '''
+    Aggregates of sstable computed per sstable (from stats and columns)
+    equal aggregates of the same rows streamed from memtable.
+    '''
+
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.s = Store(self.path, compaction=False)
+
+    def tearDown(self):
+        self.s.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def create_table(self, name, sstable_format, flush):
+        t = self.s.database('db').table(name, primary_key=['a'], sstable_format=sstable_format, **COLUMNS)
+
+        with self.s.transaction():
+            for a in range(100):
+                t.insert(**get_row(a))
+
+        if flush:
+            t.commit()
+
+        return t
+
+    def aggregate(self, t, aggregates):
+        aggregator = Aggregator(t, Query(self.s).select(*aggregates))
+        return aggregator, aggregator.execute()
+
+    def check_format(self, sstable_format):
+        streamed = self.create_table('m_' + sstable_format, sstable_format, False)
+        flushed = self.create_table('s_' + sstable_format, sstable_format, True)
+        self.assertEqual(len(streamed.sstables), 0)
+        self.assertEqual(len(flushed.sstables), 1)
+
+        all_aggregates = [Count()]
+
+        for c in ('d', 'f', 'e', 'one', 'none'):
+            all_aggregates.extend([Count(c), Sum(c), Min(c), Max(c), Avg(c)])
+
+        aggregators = []
+
+        for aggregates in (all_aggregates, [Sum('e'), Sum('one'), Sum('none')]):
+            aggregator, expected = self.aggregate(streamed, aggregates)
+            self.assertEqual(aggregator.n_merged, 1)
+            aggregator, rows = self.aggregate(flushed, aggregates)
+            self.assertEqual(aggregator.n_merged, 0)
+            self.assertEqual(rows, expected)
+
+            # types as well, e.g. sum of bools is int
+            for name, value in expected[0].items():
+                self.assertEqual(type(rows[0][name]), type(value), name)
+
+            aggregators.append(aggregator)
+
+        return aggregators
+
+    def test_row(self):
+        self.check_format('row')
+
+    def test_block(self):
+        self.check_format('block')
+
+    def test_columnar(self):
+        for aggregator in self.check_format('columnar'):
+            self.assertEqual(aggregator.n_from_columns, 1)
+
+if __name__ == '__main__':
+    unittest.main()
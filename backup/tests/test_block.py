@@ -0,0 +1,66 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+BACKUP_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKUP_PATH)
+
+from store import Store
+
+class BlockSSTableTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        s = Store(self.path)
+        t = s.database('db').table('t', a='int', c='float', b='str', primary_key=['a', 'c'], sstable_format='block')
+
+        with s.transaction():
+            for a in range(200):
+                for c in range(10):
+                    t.insert(a=a, c=float(c), b='v%i' % a)
+
+        t.commit()
+        s.close()
+        self.s = Store(self.path, compaction=False)
+        self.t = self.s.database('db').table('t')
+
+    def tearDown(self):
+        self.s.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def test_no_offset_file(self):
+        for sst in self.t.sstables:
+            self.assertEqual(sst.offset, None)
+            self.assertEqual(len(sst.get_paths()), len(set(sst.get_paths())))
+
+        filenames = os.listdir(os.path.dirname(self.t.sstables[0].get_path()))
+        self.assertEqual([f for f in filenames if f.startswith('offset')], [])
+
+    def test_rows_by_row_number(self):
+        sst = self.t.sstables[0]
+        rows = list(sst)
+        self.assertEqual(len(sst), len(rows))
+        self.assertEqual([sst._get_row_at(i) for i in (0, 11, len(rows) - 1)], [rows[0], rows[11], rows[-1]])
+
+    def test_primary_key_prefix(self):
+        sst = self.t.sstables[0]
+        first = sst.get_key_range()[0]
+        row, pos, end = sst.get(first[:1])
+        self.assertEqual((row['a'], row['c']), first)
+        self.assertRaises(KeyError, sst.get, (100000,))
+
+    def test_missing_index(self):
+        sst = self.t.sstables[0]
+
+        try:
+            sst.get(('v1',), ['b'])
+        except KeyError as e:
+            self.fail('missing index reported as missing key')
+        except Exception as e:
+            self.assertTrue('has no index' in str(e))
+        else:
+            self.fail('missing index not reported')
+
+if __name__ == '__main__':
+    unittest.main()
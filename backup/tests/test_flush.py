@@ -0,0 +1,95 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import threading
+
+BACKUP_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKUP_PATH)
+
+from store import Store
+
+class FlusherErrorTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.s = Store(self.path, compaction=False)
+        self.t = self.s.database('db').table('t', a='int', b='str', primary_key=['a'])
+        self.s.flusher.RETRY_DELAY = 0.01
+        self.s.flusher.MAX_RETRY_DELAY = 0.1
+        self.t.MEMTABLE_LIMIT_N_ITEMS = 100
+
+        # flush fails n_failures times, then succeeds
+        self.n_failures = 0
+        flush_immutable_memtables = self.t.flush_immutable_memtables
+
+        def flush():
+            if self.n_failures:
+                self.n_failures -= 1
+                raise IOError('disk full')
+
+            return flush_immutable_memtables()
+
+        self.t.flush_immutable_memtables = flush
+        self.stderr = sys.stderr
+        sys.stderr = open(os.devnull, 'w')
+
+    def tearDown(self):
+        self.n_failures = 0
+        self.s.close()
+        sys.stderr.close()
+        sys.stderr = self.stderr
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def insert(self, start, n):
+        errors = []
+
+        def write():
+            try:
+                for i in range(start, start + n):
+                    with self.s.transaction():
+                        self.t.insert(a=i, b='x')
+            except IOError as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=write)
+        thread.daemon = True
+        thread.start()
+        thread.join(10)
+        self.assertFalse(thread.is_alive(), 'writer hangs')
+        return errors
+
+    def test_retry(self):
+        # writer does not stall while flush is retried
+        self.t.MAX_IMMUTABLE_MEMTABLES = 100
+        self.n_failures = 3
+        self.assertEqual(self.insert(0, 1000), [])
+        self.s.flusher.stop()
+
+        self.assertEqual(self.s.flusher.n_errors, 3)
+        self.assertEqual(self.s.flusher.retries, {})
+        self.assertEqual(self.t.flush_error, None)
+        self.assertEqual(self.t.immutable_memtables, [])
+        self.assertEqual(sum(len(sst) for sst in self.t.sstables) + len(self.t.memtable), 1000)
+
+    def test_error_raised_to_stalled_writer(self):
+        self.n_failures = 10 ** 6
+        errors = self.insert(0, 1000)
+        self.assertEqual([str(e) for e in errors], ['disk full'])
+        self.assertEqual(len(self.t.immutable_memtables), self.t.MAX_IMMUTABLE_MEMTABLES)
+        self.assertTrue(self.s.flusher.thread.is_alive())
+
+        # stalled writer gets error of next attempt
+        self.assertEqual([str(e) for e in self.insert(1000, 1)], ['disk full'])
+
+        # flushes succeed again, writers do not stall
+        self.n_failures = 0
+        self.assertEqual(self.insert(1000, 1000), [])
+
+        with self.s.transaction():
+            d = self.t.get(1999)
+
+        self.assertEqual(d.get(), {'a': 1999, 'b': 'x'})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import os
+import sys
+import time
+import unittest
+import threading
+
+BACKUP_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKUP_PATH)
+
+from store.lock import LockManager, DeadlockError, LockTimeoutError
+
+class Owner(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return '<Owner %s>' % self.name
+
+class LockManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.lock_manager = LockManager()
+
+    def start(self, f, *args):
+        thread = threading.Thread(target=f, args=args)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def wait_for(self, owner):
+        '''
+        Wait until owner waits for lock.
+        '''
+        deadline = time.time() + 10
+
+        while owner not in self.lock_manager.waiting:
+            self.assertTrue(time.time() < deadline, '%r does not wait' % owner)
+            time.sleep(0.001)
+
+    def assert_empty(self):
+        lock_manager = self.lock_manager
+        self.assertEqual(lock_manager.states, {})
+        self.assertEqual(lock_manager.waiting, {})
+        self.assertEqual(lock_manager.owned, {})
+
+    def test_upgrade_bypasses_waiter(self):
+        lock_manager = self.lock_manager
+        a, b, c = Owner('a'), Owner('b'), Owner('c')
+        events = []
+
+        lock_manager.acquire(a, 'r', LockManager.S)
+        lock_manager.acquire(b, 'r', LockManager.S)
+
+        def acquire(owner, mode):
+            lock_manager.acquire(owner, 'r', mode)
+            events.append(owner)
+
+        # c waits for both shared owners
+        thread_c = self.start(acquire, c, LockManager.X)
+        self.wait_for(c)
+
+        # upgrade waits for b only, not for c queued before it
+        thread_a = self.start(acquire, a, LockManager.X)
+        self.wait_for(a)
+        self.assertEqual(lock_manager.n_deadlocks, 0)
+
+        lock_manager.release_all(b)
+        thread_a.join(10)
+        self.assertEqual(events, [a])
+        self.assertEqual(lock_manager.states['r'].granted, {a: LockManager.X})
+
+        lock_manager.release_all(a)
+        thread_c.join(10)
+        self.assertEqual(events, [a, c])
+
+        lock_manager.release_all(c)
+        self.assert_empty()
+
+    def test_deadlock(self):
+        lock_manager = self.lock_manager
+        a, b = Owner('a'), Owner('b')
+        lock_manager.acquire(a, 'r1', LockManager.X)
+        lock_manager.acquire(b, 'r2', LockManager.X)
+        results = {}
+
+        def acquire(owner, resource):
+            try:
+                lock_manager.acquire(owner, resource, LockManager.X)
+            except DeadlockError as e:
+                results[owner] = 'victim'
+            else:
+                results[owner] = 'granted'
+
+            lock_manager.release_all(owner)
+
+        thread_a = self.start(acquire, a, 'r2')
+        self.wait_for(a)
+        thread_b = self.start(acquire, b, 'r1')
+        thread_a.join(10)
+        thread_b.join(10)
+
+        # b closes cycle, so it is victim and a gets lock b released
+        self.assertEqual(results, {a: 'granted', b: 'victim'})
+        self.assertEqual(lock_manager.n_deadlocks, 1)
+        self.assert_empty()
+
+    def test_timeout(self):
+        lock_manager = self.lock_manager
+        a, b = Owner('a'), Owner('b')
+        lock_manager.acquire(a, 'r', LockManager.X)
+
+        self.assertRaises(LockTimeoutError, lock_manager.acquire, b, 'r', LockManager.S, 0.01)
+        self.assertEqual(lock_manager.waiting, {})
+        self.assertEqual(list(lock_manager.states['r'].waiters), [])
+        self.assertEqual(lock_manager.n_timeouts, 1)
+
+        lock_manager.release_all(b)
+        lock_manager.release_all(a)
+        self.assert_empty()
+
+        # timed out request left no state behind which blocks others
+        lock_manager.acquire(b, 'r', LockManager.X, 0.01)
+        lock_manager.release_all(b)
+        self.assert_empty()
+
+if __name__ == '__main__':
+    unittest.main()
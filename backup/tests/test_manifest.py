@@ -0,0 +1,139 @@
+import os
+import sys
+import glob
+import shutil
+import tempfile
+import unittest
+
+BACKUP_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKUP_PATH)
+
+from store import Store
+from store.manifest import Manifest
+
+class ManifestRecoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.max_edits = Manifest.MAX_EDITS
+        self.model = {}
+        self.s, self.t = self.open()
+
+    def tearDown(self):
+        Manifest.MAX_EDITS = self.max_edits
+
+        if self.s is not None:
+            self.s.close()
+
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def open(self):
+        s = Store(self.path, compaction=False, wal=False)
+        t = s.database('db').table('t', a='int', b='str', primary_key=['a'])
+        return s, t
+
+    def reopen(self):
+        self.s.close()
+        self.s = None
+        self.s, self.t = self.open()
+
+    def flush(self, n):
+        for r in range(n):
+            with self.s.transaction():
+                for i in range(10):
+                    a = len(self.model) % 25
+                    self.t.insert(a=a, b='v%i' % r)
+                    self.model[a] = 'v%i' % r
+
+            self.t.commit()
+
+    def get_rows(self):
+        with self.s.transaction():
+            q = self.t.select()
+
+        return [(row['a'], row['b']) for row in q.all().get()]
+
+    def get_log_paths(self):
+        return sorted(glob.glob(os.path.join(self.t.get_path(), 'manifest-*.log')))
+
+    def test_torn_tail_is_truncated(self):
+        self.flush(3)
+        ts = [sst.t for sst in self.t.sstables]
+        rows = self.get_rows()
+        self.s.close()
+        self.s = None
+
+        log_path, = self.get_log_paths()
+        size = os.path.getsize(log_path)
+
+        # header of record whose blob was not written whole
+        with open(log_path, 'ab') as f:
+            f.write(b'\x00\x00\x00\x30\x00\x00\x00\x00garbage')
+
+        self.s, self.t = self.open()
+        self.assertEqual([sst.t for sst in self.t.sstables], ts)
+        self.assertEqual(self.get_rows(), rows)
+        self.assertEqual(os.path.getsize(log_path), size)
+
+        # edits are appended after last valid record
+        self.flush(1)
+        ts = [sst.t for sst in self.t.sstables]
+        self.reopen()
+        self.assertEqual([sst.t for sst in self.t.sstables], ts)
+        self.assertEqual(self.get_rows(), sorted(self.model.items()))
+
+    def test_seq_gap(self):
+        self.flush(2)
+        manifest = self.t.manifest
+        manifest._write(manifest.f, {'seq': manifest.seq + 2, 'remove': [], 'add': []})
+        self.s.close()
+        self.s = None
+
+        try:
+            self.open()
+        except Exception as e:
+            self.assertTrue('corrupted manifest' in str(e), str(e))
+        else:
+            self.fail('seq gap not detected')
+
+    def test_checkpoint(self):
+        Manifest.MAX_EDITS = 3
+        self.flush(7)
+        manifest = self.t.manifest
+        self.assertEqual(manifest.n_checkpoints, 3)
+        self.assertEqual(manifest.n_edits, 1)
+
+        # older logs are removed, CURRENT names the only one
+        log_path, = self.get_log_paths()
+
+        with open(manifest.get_current_path()) as f:
+            self.assertEqual(f.read().strip(), os.path.basename(log_path))
+
+        ts = [sst.t for sst in self.t.sstables]
+        self.reopen()
+        self.assertEqual([sst.t for sst in self.t.sstables], ts)
+        self.assertEqual(self.get_rows(), sorted(self.model.items()))
+
+    def test_orphans_are_removed(self):
+        self.flush(2)
+        t = self.t
+        table_path = t.get_path()
+        paths = set(os.listdir(table_path))
+
+        # sstable written but not published, as by interrupted flush
+        orphan = t.sstable_class(t, '9999999999.0000', rows=iter([{'a': 1, 'b': 'orphan'}]))
+        orphan_paths = [os.path.basename(path) for path in orphan.get_paths()]
+
+        # old manifest log, CURRENT of interrupted checkpoint and file
+        # which is not table's
+        for filename in ('manifest-%020i.log' % 100, 'CURRENT.tmp', 'notes.txt'):
+            with open(os.path.join(table_path, filename), 'w') as f:
+                f.write('x')
+
+        self.assertTrue(set(orphan_paths) <= set(os.listdir(table_path)))
+        self.reopen()
+
+        self.assertEqual(set(os.listdir(table_path)), paths | set(['notes.txt']))
+        self.assertEqual(self.get_rows(), sorted(self.model.items()))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+import os
+import sys
+import unittest
+import threading
+
+BACKUP_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKUP_PATH)
+
+from store.metrics import Metrics
+
+class MetricsTest(unittest.TestCase):
+    def test_threads(self):
+        metrics = Metrics()
+
+        def work():
+            for i in range(10000):
+                metrics.incr('n')
+                metrics.add('h', i % 100)
+
+        threads = [threading.Thread(target=work) for i in range(4)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        stats = metrics.get_stats()
+        self.assertEqual(stats['counters'], {'n': 40000})
+        self.assertEqual(stats['histograms']['h']['count'], 40000)
+        self.assertEqual(stats['histograms']['h']['min'], 0)
+        self.assertEqual(stats['histograms']['h']['max'], 99)
+
+    def test_reset(self):
+        metrics = Metrics()
+        metrics.incr('a')
+        metrics.reset()
+        metrics.incr('b', 2)
+        self.assertEqual(metrics.get_stats()['counters'], {'b': 2})
+
+    def test_disabled(self):
+        metrics = Metrics(enabled=False)
+        metrics.incr('a')
+        metrics.observe('b', metrics.now())
+        self.assertEqual(metrics.get_stats()['counters'], {})
+        self.assertEqual(metrics.get_stats()['histograms'], {})
+
+if __name__ == '__main__':
+    unittest.main()
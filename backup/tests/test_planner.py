@@ -0,0 +1,87 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+BACKUP_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKUP_PATH)
+
+from store import Store
+from store.query import Query
+from store.planner import Planner
+
+class PlannerMemTableTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.s = Store(self.path, compaction=False)
+        self.t = self.s.database('db').table('t', a='int', c='int', b='str[4]', primary_key=['a', 'c'], sstable_format='block', indexes=['b'])
+
+        # older rows in sstable, newer in memtable
+        with self.s.transaction():
+            for a in range(100):
+                self.t.insert(a=a, c=0, b='x' if a % 2 else 'y')
+
+        self.t.commit()
+
+        with self.s.transaction():
+            for a in range(100):
+                for c in range(1, 5):
+                    self.t.insert(a=a, c=c, b='x' if a % 2 else 'y')
+
+    def tearDown(self):
+        self.s.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def get_planner(self, *where):
+        q = Query(self.s).select().where(*where)
+        return Planner(self.t, q)
+
+    def test_seek_memtable_by_primary_key_prefix(self):
+        t = self.t
+        planner = self.get_planner(t.a == 7, t.c >= 2)
+
+        with t.structures() as (memtables, sstables):
+            memtable = memtables[0]
+            iter_range = memtable.iter_range
+            n_read = []
+
+            def counted_iter_range(*args, **kwargs):
+                for item in iter_range(*args, **kwargs):
+                    n_read.append(1)
+                    yield item
+
+            memtable.iter_range = counted_iter_range
+
+            try:
+                rows = planner._seek_index(('a',), memtables, sstables)
+            finally:
+                del memtable.iter_range
+
+        self.assertEqual([(row['a'], row['c']) for row in rows], [(7, 2), (7, 3), (7, 4)])
+
+        # rows of a == 7 and first row after them
+        self.assertEqual(len(n_read), 5)
+
+    def test_primary_key_path_for_large_memtables(self):
+        t = self.t
+        planner = self.get_planner(t.a >= 10, t.a < 20, t.b == 'x')
+
+        with t.structures() as (memtables, sstables):
+            self.assertEqual(planner.get_plan(sstables, memtables), ('b',))
+            planner.MAX_MEMTABLE_SCAN_ROWS = 100
+            self.assertEqual(planner.get_plan(sstables, memtables), ('a', 'c'))
+
+        rows = planner.execute()
+        self.assertEqual(len(rows), 25)
+        self.assertEqual(set(row['a'] for row in rows), set(range(11, 20, 2)))
+
+        # without usable primary key range memtables are scanned anyway
+        planner = self.get_planner(t.b == 'x')
+        planner.MAX_MEMTABLE_SCAN_ROWS = 100
+
+        with t.structures() as (memtables, sstables):
+            self.assertEqual(planner.get_plan(sstables, memtables), ('b',))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,154 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import threading
+import subprocess
+
+BACKUP_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKUP_PATH)
+
+from store import Store
+
+# inserts rows and exits without closing store, as if it crashed
+CRASH_SCRIPT = '''
+import os
+import sys
+from store import Store
+
+s = Store(sys.argv[1])
+t = s.database('db').table('t', a='int', b='str', c='float', primary_key=['a', 'c'])
+
+with s.transaction():
+    t.insert(a=1, b='x')
+    t.insert(a=2, b='y', c=2.0)
+
+try:
+    with s.transaction():
+        t.insert(a=6, b='bad', c=1.0, zzz=1)
+except Exception as e:
+    pass
+
+os._exit(0)
+'''
+
+class FailingFile(object):
+    '''
+    Wal file whose first write waits for event and later writes fail.
+    '''
+
+    def __init__(self, f):
+        self.f = f
+        self.event = threading.Event()
+        self.writing = threading.Event()
+        self.n_writes = 0
+
+    def __getattr__(self, name):
+        return getattr(self.f, name)
+
+    def write(self, data):
+        self.n_writes += 1
+
+        if self.n_writes == 1:
+            self.writing.set()
+            self.event.wait(10)
+            return self.f.write(data)
+
+        raise IOError(5, 'Input/output error')
+
+class WALGroupCommitErrorTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.s = Store(self.path, compaction=False)
+        self.s.database('db').table('t', a='int', b='str', primary_key=['a'])
+        self.wal = self.s.wal
+
+    def tearDown(self):
+        self.wal.f = self.wal.f.f
+        self.s.close()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def append(self, a, results):
+        try:
+            segment = self.wal.append([('db', 't', {'a': a, 'b': 'x'})])
+        except IOError as e:
+            results.append(e.errno)
+        else:
+            results.append(segment)
+            self.wal.release(segment)
+
+    def test_failed_batch(self):
+        wal = self.wal
+        f = FailingFile(wal.f)
+        wal.f = f
+        written_batch = wal.written_batch
+
+        # leader of first batch writes, others are grouped in next batch
+        leader_results = []
+        leader = threading.Thread(target=self.append, args=(0, leader_results))
+        leader.start()
+        f.writing.wait(10)
+
+        results = []
+        threads = [threading.Thread(target=self.append, args=(a, results)) for a in range(1, 4)]
+
+        for thread in threads:
+            thread.start()
+
+        while len(wal.buffer) < 2 * len(threads):
+            threading.Event().wait(0.01)
+
+        f.event.set()
+
+        for thread in [leader] + threads:
+            thread.join(10)
+
+        self.assertEqual(leader_results, [wal.segment])
+        self.assertEqual(results, [5] * len(threads))
+        self.assertEqual(f.n_writes, 2)
+        self.assertEqual(wal.written_batch, written_batch + 1)
+        self.assertEqual(dict(wal.pending), {})
+        self.assertEqual(wal.failed_batches, {})
+        self.assertEqual(wal.n_errors, 1)
+
+class WALRecoveryTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def crash(self):
+        env = dict(os.environ, PYTHONPATH=BACKUP_PATH)
+        subprocess.check_call([sys.executable, '-c', CRASH_SCRIPT, self.path], env=env)
+
+    def reopen(self):
+        s = Store(self.path, compaction=False)
+        t = s.database('db').table('t')
+        return s, t
+
+    def test_missing_primary_key_column(self):
+        self.crash()
+        s, t = self.reopen()
+
+        with s.transaction():
+            d = t.get(1, None)
+
+        self.assertEqual(d.get(), {'a': 1, 'b': 'x', 'c': None})
+        s.close()
+
+    def test_rejected_insert_is_not_recovered(self):
+        self.crash()
+        s, t = self.reopen()
+
+        with s.transaction():
+            d = t.get(6, 1.0)
+            q = t.select()
+
+        self.assertEqual(d.get(), None)
+        self.assertEqual([r['a'] for r in q.all().get()], [1, 2])
+        s.close()
+
+if __name__ == '__main__':
+    unittest.main()